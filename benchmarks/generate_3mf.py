@@ -0,0 +1,139 @@
+"""
+Generator of synthetic 3MF packages for benchmarking the conversion
+
+Each resource object is a closed torus mesh with a chosen number of
+vertices; distinct objects have different radii, so that their meshes are
+not identical. The build places a number of items for each object; a
+chosen fraction of the items have a non-identity transform (a rotation
+about the z axis and a translation), the others have no transform attribute.
+
+usage:
+python generate_3mf.py [--vertices N] [--objects N] [--items-per-object N]
+                       [--non-identity FRACTION] OUTPUT_3MF_FILE
+"""
+
+CORE_NAMESPACE = "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>"""
+
+RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>"""
+
+# number of vertex or triangle elements formatted in one step
+CHUNK = 50000
+
+def torus_mesh( vertices, major_radius = 20.0, minor_radius = 5.0 ):
+    """
+    returns (points, triangles) arrays of a closed torus
+    with approximately the given number of vertices
+    """
+    from numpy import linspace, pi, cos, sin, arange, empty, int64
+    from math import sqrt
+    n = max( 3, int( round( sqrt( vertices / 4.0 ))))
+    m = max( 3, int( round( float(vertices) / n )))
+    u = linspace( 0.0, 2.0*pi, m, endpoint=False ).reshape((-1,1))
+    v = linspace( 0.0, 2.0*pi, n, endpoint=False ).reshape((1,-1))
+    ring = major_radius + minor_radius * cos(v)
+    points = empty( (m, n, 3) )
+    points[:,:,0] = ring * cos(u)
+    points[:,:,1] = ring * sin(u)
+    points[:,:,2] = minor_radius * sin(v) + minor_radius
+    points = points.reshape((-1,3))
+
+    i = arange(m).reshape((-1,1))
+    j = arange(n).reshape((1,-1))
+    a = (i * n + j)
+    b = (((i+1) % m) * n + j)
+    c = (((i+1) % m) * n + (j+1) % n)
+    d = (i * n + (j+1) % n)
+    triangles = empty( (m, n, 2, 3), int64 )
+    triangles[:,:,0,0] = a
+    triangles[:,:,0,1] = b
+    triangles[:,:,0,2] = c
+    triangles[:,:,1,0] = a
+    triangles[:,:,1,1] = c
+    triangles[:,:,1,2] = d
+    return points, triangles.reshape((-1,3))
+
+
+def _write_rows( f, rows, row_format ):
+    for start in range(0, len(rows), CHUNK):
+        chunk = rows[start:start+CHUNK]
+        f.write( (row_format * len(chunk)) % tuple( chunk.ravel().tolist() ))
+
+
+def write_model( f, vertices = 1000, objects = 1, items_per_object = 1,
+                 non_identity = 0.0 ):
+    """
+    writes the XML text of a 3MF model part to the file-like object f
+    """
+    from math import cos, sin, pi, sqrt, ceil
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<model unit="millimeter" xml:lang="en-US" xmlns="%s">\n' % CORE_NAMESPACE)
+    f.write('<metadata name="Title">synthetic benchmark model</metadata>\n')
+    f.write('<metadata name="Designer">generate_3mf.py</metadata>\n')
+    f.write('<resources>\n')
+    for k in range(objects):
+        points, triangles = torus_mesh( vertices, major_radius = 20.0 + 0.01 * k )
+        f.write('<object id="%i" type="model" name="torus %i">\n<mesh>\n<vertices>\n' % (k+1, k+1))
+        _write_rows( f, points, '<vertex x="%.6f" y="%.6f" z="%.6f"/>\n' )
+        f.write('</vertices>\n<triangles>\n')
+        _write_rows( f, triangles, '<triangle v1="%i" v2="%i" v3="%i"/>\n' )
+        f.write('</triangles>\n</mesh>\n</object>\n')
+    f.write('</resources>\n<build>\n')
+
+    total_items = objects * items_per_object
+    non_identity_items = int( round( non_identity * total_items ))
+    columns = int( ceil( sqrt( total_items )))
+    for n in range(total_items):
+        objectid = n % objects + 1
+        if n < non_identity_items:
+            angle = 2.0 * pi * n / max(1, total_items)
+            c, s = cos(angle), sin(angle)
+            tx, ty = 60.0 * (n % columns), 60.0 * (n // columns)
+            transform = "%f %f 0 %f %f 0 0 0 1 %f %f 0" % (c, s, -s, c, tx, ty)
+            f.write('<item objectid="%i" transform="%s" partnumber="item %i"/>\n' % (objectid, transform, n))
+        else:
+            f.write('<item objectid="%i" partnumber="item %i"/>\n' % (objectid, n))
+    f.write('</build>\n</model>\n')
+
+
+def write_3mf( path, **keyw ):
+    """
+    writes a 3MF package to path; the keyword parameters are those of write_model.
+    The model part is written to a temporary file first, so that large
+    models are compressed into the package without being held in memory
+    """
+    import os, tempfile, zipfile
+    fd, model_path = tempfile.mkstemp( suffix = ".model" )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_model( f, **keyw )
+        package = zipfile.ZipFile( path, "w", zipfile.ZIP_DEFLATED, allowZip64 = True )
+        package.writestr( "[Content_Types].xml", CONTENT_TYPES_XML )
+        package.writestr( "_rels/.rels", RELS_XML )
+        package.write( model_path, "3D/3dmodel.model" )
+        package.close()
+    finally:
+        os.remove( model_path )
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser("synthetic 3MF generator")
+    parser.add_argument('outpath', metavar="OUTPUT_3MF_FILE")
+    parser.add_argument('--vertices', type=int, default=1000, help="vertices per object mesh")
+    parser.add_argument('--objects', type=int, default=1, help="number of resource objects")
+    parser.add_argument('--items-per-object', dest='items_per_object', type=int, default=1,
+                        help="build items referring to each object")
+    parser.add_argument('--non-identity', dest='non_identity', type=float, default=0.0,
+                        help="fraction of build items with a non-identity transform")
+    args = parser.parse_args()
+    write_3mf( args.outpath, vertices = args.vertices, objects = args.objects,
+               items_per_object = args.items_per_object, non_identity = args.non_identity )
@@ -0,0 +1,379 @@
+"""
+Benchmark suite for the 3MF to X3D conversion
+
+For each scenario a synthetic 3MF package is generated with generate_3mf.py
+and each stage of convert_to_X3D is timed separately:
+
+package_open     : open the zip package and decompress the model part
+xml_parse        : iterparse the model without decoding meshes
+mesh_decode      : get_3MF_mesh on each mesh element (time spent in the
+                   decoder only, excluding the XML parsing)
+transform_bounds : layout_build; item transforms and global bounds
+serialization    : write_X3D with the direct stream writer
+template_render  : write_X3D through the genshi template
+total            : convert_to_X3D
+
+The scale scenarios have meshes of 10**3 vertices and each power of ten
+up to --max-vertices, by default 10**6; the 10**7 vertex scenario is
+only run when asked for with --max-vertices 10000000.
+
+Startup is measured separately, as the wall time of complete command line
+runs in a new interpreter: python -c pass, the baseline of the interpreter
+itself; python -m convert_3mf_to_x3d --help; and the conversion of a small
+package. The median of STARTUP_RUNS runs of each is recorded, together with
+the third party modules (NumPy, genshi, lxml) which --help imports. The
+target is that --help take at most STARTUP_TARGET seconds more than the
+bare interpreter and import none of them; a missed target is reported and
+sets the exit status to 1. (Python 2 has no -X importtime; the imported
+modules are listed from sys.modules instead.)
+
+Every stage runs in a fresh child process, after the inputs it needs have
+been prepared there, and its memory use is reported as the growth in the
+peak resident set size of that process during the stage (and the
+tracemalloc peak, where tracemalloc is available).
+
+The results are written as JSON. When a baseline result file is given,
+stages slower than the baseline by more than the tolerance are reported
+as regressions and the exit status is 1.
+
+usage:
+python benchmarks/run_benchmarks.py [--max-vertices N] [--output FILE]
+                                    [--baseline FILE] [--tolerance FRACTION]
+                                    [--startup-only]
+"""
+
+import os, sys
+sys.path.insert(0, os.path.dirname( os.path.dirname( os.path.abspath(__file__))))
+
+STAGES = ('package_open', 'xml_parse', 'mesh_decode', 'transform_bounds',
+          'serialization', 'template_render', 'total')
+
+# number of runs of each startup measurement, of which the median is taken
+STARTUP_RUNS = 7
+
+# largest time in seconds of --help beyond that of the bare interpreter
+STARTUP_TARGET = 0.05
+
+# top level modules which --help should not import
+HEAVY_MODULES = ('numpy', 'genshi', 'lxml')
+
+# lists, as JSON on stdout, the HEAVY_MODULES imported by --help
+_HELP_IMPORTS = """
+import sys, json, runpy
+sys.argv = ['convert_3mf_to_x3d', '--help']
+stdout = sys.stdout
+sys.stdout = open( %r, 'w' )
+try:
+    runpy.run_module( 'convert_3mf_to_x3d', run_name='__main__', alter_sys=True )
+except SystemExit:
+    pass
+json.dump( sorted( set( name.split('.')[0] for name in sys.modules
+                        if name.split('.')[0] in %r )), stdout )
+"""
+
+
+def scenarios( max_vertices ):
+    """
+    returns a list of (name, generator parameters) pairs
+    """
+    retVal = list()
+    vertices = 1000
+    while vertices <= max_vertices:
+        retVal.append( ("scale_v%i" % vertices,
+                        dict(vertices=vertices)) )
+        vertices *= 10
+    for objects in (10, 100):
+        retVal.append( ("objects_%ix1000" % objects,
+                        dict(vertices=1000, objects=objects)) )
+    for items in (10, 100, 1000):
+        retVal.append( ("instancing_v10000_items%i" % items,
+                        dict(vertices=10000, items_per_object=items)) )
+    for fraction in (0.0, 0.5, 1.0):
+        retVal.append( ("transforms_items100_nonidentity%i" % int(100*fraction),
+                        dict(vertices=1000, objects=10, items_per_object=10,
+                             non_identity=fraction)) )
+    return retVal
+
+
+def _null_decoder( meshNode, ns ):
+    return None
+
+
+def _read( path, mesh_decoder ):
+    from convert_3mf_to_x3d.package import open_3MF_package, open_model_part
+    from convert_3mf_to_x3d.file_conversions import read_model
+    pkg = open_3MF_package( path )
+    model_file = open_model_part( pkg )
+    try:
+        return read_model( model_file, mesh_decoder )
+    finally:
+        model_file.close()
+        pkg.close()
+
+
+def _prepare( stage, path ):
+    """
+    performs the work preceding stage; returns a callable running the stage
+    """
+    from convert_3mf_to_x3d.file_conversions import convert_to_X3D, \
+        convert_to_X3D_default, layout_build, write_X3D
+    from convert_3mf_to_x3d.package import open_3MF_package, open_model_part
+    from convert_3mf_to_x3d.reader import iter_3MF_model
+    from convert_3mf_to_x3d.mesh import get_3MF_mesh
+
+    null_output = open( os.devnull, "wb" )
+
+    if stage == 'package_open':
+        def run():
+            pkg = open_3MF_package( path )
+            model_file = open_model_part( pkg )
+            while model_file.read( 1 << 20 ):
+                pass
+            model_file.close()
+            pkg.close()
+        return run
+
+    if stage == 'xml_parse':
+        def run():
+            pkg = open_3MF_package( path )
+            model_file = open_model_part( pkg )
+            for kind, value in iter_3MF_model( model_file, _null_decoder ):
+                pass
+            pkg.close()
+        return run
+
+    if stage == 'mesh_decode':
+        # returns the time spent in the decoder as the stage time
+        def run():
+            import time
+            elapsed = [0.0]
+            def timed_decoder( meshNode, ns ):
+                start = time.time()
+                retVal = get_3MF_mesh( meshNode, ns )
+                elapsed[0] += time.time() - start
+                return retVal
+            pkg = open_3MF_package( path )
+            model_file = open_model_part( pkg )
+            for kind, value in iter_3MF_model( model_file, timed_decoder ):
+                pass
+            pkg.close()
+            return elapsed[0]
+        return run
+
+    if stage == 'total':
+        def run():
+            convert_to_X3D( path, null_output )
+        return run
+
+    params = dict( convert_to_X3D_default )
+    model = _read( path, get_3MF_mesh )
+    if stage == 'transform_bounds':
+        def run():
+            layout_build( model )
+        return run
+
+    builds, global_bounds = layout_build( model )
+    if stage == 'serialization':
+        params['serializer'] = 'direct'
+    elif stage == 'template_render':
+        params['serializer'] = 'genshi'
+    else:
+        raise ValueError("unknown stage %s" % stage)
+    def run():
+        write_X3D( null_output, model, builds, global_bounds, params )
+    return run
+
+
+def _measure( stage, path, queue ):
+    """
+    runs in a child process; puts the measurement dictionary on queue
+    """
+    import time, resource
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    try:
+        run = _prepare( stage, path )
+        rss_before = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = time.time()
+        stage_time = run()
+        elapsed = time.time() - start
+        result = {
+            'seconds' : stage_time if stage_time is not None else elapsed,
+            'peak_rss_growth_kb' : resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss - rss_before
+        }
+        if tracemalloc is not None:
+            result['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    except Exception, exc:
+        result = { 'error' : "%s: %s" % (exc.__class__.__name__, exc) }
+    queue.put( result )
+
+
+def measure_stage( stage, path ):
+    from multiprocessing import Process, Queue
+    queue = Queue()
+    process = Process( target = _measure, args = (stage, path, queue) )
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def _run_seconds( command, cwd ):
+    """
+    returns the median wall time of STARTUP_RUNS runs of command
+    """
+    import subprocess, time
+    times = list()
+    with open( os.devnull, "wb" ) as null_output:
+        for run in range( STARTUP_RUNS ):
+            start = time.time()
+            subprocess.check_call( command, cwd=cwd, stdout=null_output, stderr=null_output )
+            times.append( time.time() - start )
+    return sorted( times )[ len(times) // 2 ]
+
+
+def measure_startup( work_dir, log = sys.stderr ):
+    """
+    returns the startup results dictionary
+    """
+    import json, subprocess
+    from generate_3mf import write_3mf
+
+    top = os.path.dirname( os.path.dirname( os.path.abspath(__file__)))
+    path = os.path.join( work_dir, "startup.3mf" )
+    write_3mf( path, vertices=100 )
+    python = sys.executable
+    result = {
+        'interpreter' : _run_seconds( [python, '-c', 'pass'], top ),
+        'help' : _run_seconds( [python, '-m', 'convert_3mf_to_x3d', '--help'], top ),
+        'small_file' : _run_seconds( [python, '-m', 'convert_3mf_to_x3d', path], top ),
+        'help_imports' : json.loads( subprocess.check_output(
+            [python, '-c', _HELP_IMPORTS % (os.devnull, HEAVY_MODULES)], cwd=top )),
+        'target' : STARTUP_TARGET
+    }
+    os.remove( path )
+    result['help_overhead'] = result['help'] - result['interpreter']
+    for name in ('interpreter', 'help', 'small_file'):
+        log.write( "%-40s %-16s %9.4fs\n" % ('startup', name, result[name]) )
+    if result['help_imports']:
+        log.write( "%-40s %-16s %s\n" % ('startup', 'help_imports', " ".join( result['help_imports'] )) )
+    return result
+
+
+def startup_target_missed( startup, log = sys.stderr ):
+    """
+    returns True, after reporting it, if the startup results miss the target
+    """
+    missed = startup['help_overhead'] > startup['target'] or bool( startup['help_imports'] )
+    if missed:
+        log.write( "STARTUP TARGET MISSED: --help %.4fs over the interpreter (target %.4fs), imports %s\n" % \
+                   (startup['help_overhead'], startup['target'], ", ".join( startup['help_imports'] ) or "none") )
+    return missed
+
+
+def run_benchmarks( max_vertices, work_dir, log = sys.stderr, startup_only = False ):
+    """
+    returns the benchmark results dictionary
+    """
+    import platform, time, numpy
+    from generate_3mf import write_3mf
+    from convert_3mf_to_x3d import version
+
+    results = {
+        'converter_version' : version,
+        'python' : platform.python_version(),
+        'numpy' : numpy.__version__,
+        'platform' : platform.platform(),
+        'time' : time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+        'scenarios' : list()
+    }
+    results['startup'] = measure_startup( work_dir, log )
+    if startup_only:
+        return results
+    for name, generator_params in scenarios( max_vertices ):
+        path = os.path.join( work_dir, name + ".3mf" )
+        write_3mf( path, **generator_params )
+        scenario = {
+            'name' : name,
+            'generator' : generator_params,
+            'package_bytes' : os.path.getsize( path ),
+            'stages' : dict()
+        }
+        for stage in STAGES:
+            result = measure_stage( stage, path )
+            scenario['stages'][stage] = result
+            if 'error' in result:
+                log.write( "%-40s %-16s ERROR %s\n" % (name, stage, result['error']) )
+            else:
+                log.write( "%-40s %-16s %9.4fs %9i kB\n" % \
+                           (name, stage, result['seconds'], result['peak_rss_growth_kb']) )
+        results['scenarios'].append( scenario )
+        os.remove( path )
+    return results
+
+
+def compare( results, baseline, tolerance, log = sys.stderr ):
+    """
+    returns the list of (scenario, stage, seconds, baseline seconds)
+    for stages slower than (1 + tolerance) times the baseline
+    """
+    base_times = dict()
+    for scenario in baseline['scenarios']:
+        for stage, result in scenario['stages'].items():
+            if 'seconds' in result:
+                base_times[(scenario['name'], stage)] = result['seconds']
+
+    regressions = list()
+    for scenario in results['scenarios']:
+        for stage, result in scenario['stages'].items():
+            key = (scenario['name'], stage)
+            if 'seconds' in result and key in base_times:
+                if result['seconds'] > (1.0 + tolerance) * base_times[key]:
+                    regressions.append( key + (result['seconds'], base_times[key]) )
+    for stage in ('help', 'small_file'):
+        if stage in results.get('startup', {}) and stage in baseline.get('startup', {}):
+            seconds, base_seconds = results['startup'][stage], baseline['startup'][stage]
+            if seconds > (1.0 + tolerance) * base_seconds:
+                regressions.append( ('startup', stage, seconds, base_seconds) )
+    for name, stage, seconds, base_seconds in regressions:
+        log.write( "REGRESSION %s %s: %.4fs, baseline %.4fs\n" % (name, stage, seconds, base_seconds) )
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse, json, shutil, tempfile
+    parser = argparse.ArgumentParser("3MF to X3D conversion benchmarks")
+    parser.add_argument('--max-vertices', dest='max_vertices', type=int, default=1000000,
+                        help="largest mesh of the scale scenarios (default 10**6; "
+                             "10000000 adds the 10**7 vertex scenario)")
+    parser.add_argument('--output', default="benchmark_results.json",
+                        help="JSON result file (default benchmark_results.json)")
+    parser.add_argument('--baseline', default=None,
+                        help="JSON result file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed fractional slowdown relative to the baseline (default 0.25)")
+    parser.add_argument('--startup-only', dest='startup_only', action="store_true",
+                        help="measure only the command line startup time")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp( prefix = "bench3mf" )
+    try:
+        results = run_benchmarks( args.max_vertices, work_dir, startup_only = args.startup_only )
+    finally:
+        shutil.rmtree( work_dir )
+    with open( args.output, "w" ) as f:
+        json.dump( results, f, indent=1, sort_keys=True )
+
+    failed = startup_target_missed( results['startup'] )
+    if args.baseline is not None:
+        with open( args.baseline ) as f:
+            baseline = json.load( f )
+        if compare( results, baseline, args.tolerance ):
+            failed = True
+    if failed:
+        sys.exit(1)
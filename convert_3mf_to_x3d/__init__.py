@@ -6,24 +6,19 @@ logger = logging.getLogger('X3D_3MF')
 logger.setLevel(logging.WARN)
 logger.addHandler( logging.NullHandler() )
 
-# test non-standard library dependencies
-try:
-    try:
-        import genshi
-    except ImportError:
-        raise Exception("'genshi' python package required and not found in import path")
-        
-    try:
-        import numpy
-    except ImportError:
-        raise Exception("'NumPy' python package required and not found in import path")
-    
+# The non-standard library dependencies, NumPy and genshi, are not imported
+# here: each module imports them within the functions using them, so that
+# importing the package, and running the command line with --help, stays cheap
+
+def require( module, package ):
+    """
+    imports and returns the non-standard library dependency module;
+    raises ImportError naming the python package to install if it is
+    not found in the import path
+    """
+    import sys
     try:
-        import opc
+        __import__( module )
     except ImportError:
-        raise Exception("'opc' python package required and not found in import path")
-except Exception, exc:
-    import sys
-    sys.stderr.write("%s\n" % str(exc))
-    sys.exit(1)
-    
+        raise ImportError("'%s' python package required and not found in import path" % package)
+    return sys.modules[module]
@@ -1,26 +1,221 @@
-import logging, sys
-from . import logger
-handler = logging.StreamHandler( sys.stderr)
-handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
-logging.getLogger().addHandler( handler )
-logger.setLevel(logging.WARN)
-
-
-import argparse
-parser = argparse.ArgumentParser("3MF to X3D conversion")
-parser.add_argument('inpath', metavar="INPUT FILE", help="input 3MF file")
-parser.add_argument('--verbose', dest='verbose', action="store_true", help="print info messages to stderr")
-
-args = parser.parse_args()
-
-if args.verbose:
-    logger.setLevel(logging.DEBUG)
-
-from os.path import exists
-if not exists( args.inpath):
-    raise Exception("File %s not found" % args.inpath)
-input_path = args.inpath
-    
-    
-from file_conversions import convert_to_X3D
-convert_to_X3D(input_path, sys.stdout)
+"""
+Command line operation; see README.md
+
+The conversion modules, and their NumPy and genshi dependencies, are
+imported only once the arguments have been parsed, by the code path
+needing them, so that --help and argument errors return at once.
+"""
+
+def make_parser():
+    """
+    returns the argparse.ArgumentParser of the command line
+    """
+    import argparse
+    parser = argparse.ArgumentParser("3MF to X3D conversion")
+    parser.add_argument('inpaths', metavar="INPUT", nargs='*',
+                        help="input 3MF file; with --output-dir, 3MF files or directories of 3MF files")
+    parser.add_argument('--verbose', dest='verbose', action="store_true", help="print info messages to stderr")
+    parser.add_argument('--genshi', dest='serializer', action="store_const", const='genshi', default='direct',
+                        help="render the X3D output through the genshi template")
+    parser.add_argument('--binary', dest='serializer', action="store_const", const='binary',
+                        help="write the binary container of x3d_binary.py, with unformatted coordinate and index arrays")
+    parser.add_argument('--gzip', dest='compression', action="store_const", const='gzip', default=None,
+                        help="gzip compress the output as it is written (.x3dz)")
+    parser.add_argument('--no-share-geometry', dest='share_geometry', action="store_false",
+                        help="write the geometry of each resource object in full, even when identical to another")
+    parser.add_argument('--precision', dest='precision', metavar="STEP",
+                        help="round coordinates to multiples of STEP model units, written without trailing zeros; "
+                             "'auto' chooses a step from the model unit and the object extent")
+    parser.add_argument('--merge-vertices', dest='merge_vertices', action="store_true",
+                        help="with --precision, merge the vertices rounded to the same position")
+    parser.add_argument('--cleanup', dest='cleanup', action="store_true",
+                        help="weld duplicate vertices and remove degenerate triangles and unused vertices")
+    parser.add_argument('--weld-tolerance', dest='weld_tolerance', type=float, default=0.0, metavar="TOL",
+                        help="with --cleanup, weld vertices within a grid cell of TOL model units "
+                             "(default: 0, only identical vertices)")
+    parser.add_argument('--lod-triangles', dest='lod_triangles', type=int, default=None, metavar="N",
+                        help="write objects of more than N triangles as an LOD node with simplified levels")
+    parser.add_argument('--lod-levels', dest='lod_levels', type=int, default=2, metavar="K",
+                        help="with --lod-triangles, the largest number of simplified levels (default: 2)")
+    parser.add_argument('--lod-reduction', dest='lod_reduction', type=float, default=4.0, metavar="F",
+                        help="with --lod-triangles, the ratio of triangle counts of successive levels (default: 4)")
+    parser.add_argument('--lod-ranges', dest='lod_ranges', metavar="D1,D2,...",
+                        help="with --lod-triangles, the viewing distances in model units at which the levels "
+                             "switch; sets the number of levels (default: object size times 2, 4, 8 ...)")
+    parser.add_argument('--materials', dest='materials', action="store_true",
+                        help="translate the 3MF basematerials and colorgroup colors into Material and Color nodes")
+    parser.add_argument('--normals', dest='normals', action="store_true",
+                        help="write per-vertex normals as a Normal node of each IndexedTriangleSet")
+    parser.add_argument('--crease-angle', dest='crease_angle', type=float, default=None, metavar="RADIANS",
+                        help="with --normals, keep edges sharp where triangles meet at more than RADIANS")
+    parser.add_argument('--inline-triangles', dest='inline_triangles', type=int, default=None, metavar="N",
+                        help="write the objects of more than N triangles to separate X3D documents, "
+                             "referenced through Inline nodes")
+    parser.add_argument('--inline-dir', dest='inline_dir', metavar="DIR",
+                        help="with --inline-triangles, the directory of the separate documents")
+    parser.add_argument('--inline-url', dest='inline_url', metavar="URL",
+                        help="with --inline-triangles, the URL of the --inline-dir directory relative to "
+                             "the output document (default: the --inline-dir path)")
+    parser.add_argument('--inline-workers', dest='inline_workers', type=int, default=None, metavar="N",
+                        help="with --inline-triangles, write the separate documents on N worker processes")
+    parser.add_argument('--mesh-workers', dest='mesh_workers', type=int, default=None, metavar="N",
+                        help="decode and format the meshes of the input file on N worker processes")
+    parser.add_argument('--cache-dir', dest='cache_dir', metavar="DIR",
+                        help="reuse converted meshes stored in the cache directory DIR")
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=1024, metavar="MB",
+                        help="upper bound on the size of the cache directory (default: 1024 MB)")
+    parser.add_argument('--output-dir', dest='output_dir', metavar="DIR",
+                        help="batch mode: write an X3D file into DIR for each input")
+    parser.add_argument('--file-list', dest='file_list', metavar="FILE",
+                        help="batch mode: text file listing additional input paths, one per line")
+    parser.add_argument('--jobs', dest='jobs', type=int, default=None, metavar="N",
+                        help="batch mode: number of worker processes (default: cpu count)")
+    parser.add_argument('--serve', dest='serve', metavar="[HOST:]PORT",
+                        help="run the HTTP conversion service of service.py on PORT (host default: 127.0.0.1)")
+    parser.add_argument('--timeout', dest='timeout', type=float, default=300.0, metavar="SECONDS",
+                        help="with --serve, the longest wait for a worker and the longest conversion (default: 300)")
+    parser.add_argument('--allow-paths', dest='allow_paths', action="store_true",
+                        help="with --serve, accept requests naming an input file on this host")
+    parser.add_argument('--stats', dest='stats', action="store_true",
+                        help="write a JSON report of the time and memory of each conversion stage to stderr")
+    parser.add_argument('--stats-file', dest='stats_file', metavar="FILE",
+                        help="write the JSON report of --stats to FILE instead of stderr")
+    return parser
+
+
+def setup_logging( verbose ):
+    """
+    directs the log messages of the package to stderr
+    """
+    import logging, sys
+    from . import logger
+    handler = logging.StreamHandler( sys.stderr)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    logging.getLogger().addHandler( handler )
+    logger.setLevel(logging.DEBUG if verbose else logging.WARN)
+
+
+def main( argv = None ):
+    import sys
+    parser = make_parser()
+    args = parser.parse_args( argv )
+
+    if args.precision not in (None, 'auto'):
+        try:
+            args.precision = float(args.precision)
+        except ValueError:
+            parser.error("--precision must be a number or 'auto'")
+    if args.merge_vertices and args.precision is None:
+        parser.error("--merge-vertices requires --precision")
+    if args.weld_tolerance < 0.0:
+        parser.error("--weld-tolerance must not be negative")
+    if args.weld_tolerance and not args.cleanup:
+        parser.error("--weld-tolerance requires --cleanup")
+
+    if args.lod_ranges is not None:
+        try:
+            args.lod_ranges = [float(d) for d in args.lod_ranges.split(",")]
+        except ValueError:
+            parser.error("--lod-ranges must be a comma separated list of numbers")
+        if sorted(args.lod_ranges) != args.lod_ranges or args.lod_ranges[0] <= 0.0:
+            parser.error("--lod-ranges must be positive and increasing")
+    if args.lod_levels < 1 or args.lod_reduction <= 1.0:
+        parser.error("--lod-levels must be at least 1 and --lod-reduction greater than 1")
+
+    if args.crease_angle is not None and not args.normals:
+        parser.error("--crease-angle requires --normals")
+    if args.inline_triangles is None and (args.inline_dir or args.inline_url or args.inline_workers):
+        parser.error("--inline-dir, --inline-url and --inline-workers require --inline-triangles")
+
+    setup_logging( args.verbose )
+
+    # test non-standard library dependencies before any work is done;
+    # genshi is needed only to render through the template
+    from . import require
+    try:
+        require( 'numpy', 'NumPy' )
+        if args.serializer == 'genshi':
+            require( 'genshi', 'genshi' )
+    except ImportError, exc:
+        sys.stderr.write("%s\n" % str(exc))
+        sys.exit(1)
+
+    conversion_params = {
+        'serializer' : args.serializer,
+        'compression' : args.compression,
+        'precision' : args.precision,
+        'merge_vertices' : args.merge_vertices,
+        'cleanup' : args.cleanup,
+        'weld_tolerance' : args.weld_tolerance,
+        'lod_triangles' : args.lod_triangles,
+        'lod_levels' : args.lod_levels,
+        'lod_reduction' : args.lod_reduction,
+        'lod_ranges' : args.lod_ranges,
+        'materials' : args.materials,
+        'normals' : args.normals,
+        'crease_angle' : args.crease_angle,
+        'inline_triangles' : args.inline_triangles,
+        'share_geometry' : args.share_geometry,
+        'cache_dir'  : args.cache_dir,
+        'cache_size' : args.cache_size << 20,
+        'instrument' : args.stats or args.stats_file is not None
+    }
+
+    stats_stream = None
+    if conversion_params['instrument']:
+        stats_stream = open(args.stats_file, "a") if args.stats_file is not None else sys.stderr
+
+    if args.serve is not None:
+        if args.inpaths or args.output_dir is not None or args.file_list is not None:
+            parser.error("--serve takes no input files")
+        if args.mesh_workers is not None or args.inline_triangles is not None:
+            parser.error("--mesh-workers and --inline-triangles cannot be combined with --serve")
+        host, sep, port = args.serve.rpartition(":")
+        try:
+            address = (host or "127.0.0.1", int(port))
+        except ValueError:
+            parser.error("--serve requires a port number")
+        from multiprocessing import cpu_count
+        from .service import serve
+        serve( address, conversion_params, args.jobs or cpu_count(), args.timeout, args.allow_paths )
+        sys.exit(0)
+
+    if args.output_dir is not None:
+        if args.mesh_workers is not None:
+            parser.error("--mesh-workers cannot be combined with --output-dir")
+        if args.inline_dir is not None or args.inline_url is not None or args.inline_workers is not None:
+            parser.error("--inline-dir, --inline-url and --inline-workers cannot be combined with --output-dir")
+        from .batch import collect_inputs, convert_batch, write_summary
+        input_paths = collect_inputs( args.inpaths, args.file_list )
+        results = convert_batch( input_paths, args.output_dir, jobs=args.jobs, **conversion_params)
+        failed = write_summary( results, sys.stdout, stats_stream )
+        sys.exit( 1 if failed else 0 )
+
+    if len(args.inpaths) != 1 or args.file_list is not None:
+        parser.error("exactly one input file required unless --output-dir is given")
+
+    from os.path import exists
+    if not exists( args.inpaths[0]):
+        raise Exception("File %s not found" % args.inpaths[0])
+    input_path = args.inpaths[0]
+
+
+    conversion_params['mesh_workers'] = args.mesh_workers
+    if args.inline_triangles is not None:
+        if args.inline_dir is None:
+            parser.error("--inline-triangles requires --inline-dir unless --output-dir is given")
+        conversion_params.update( {
+            'inline_dir' : args.inline_dir,
+            'inline_url' : args.inline_url,
+            'inline_workers' : args.inline_workers
+        })
+
+    from .file_conversions import convert_to_X3D
+    report = convert_to_X3D(input_path, sys.stdout, **conversion_params)
+    if stats_stream is not None:
+        from .batch import write_report
+        write_report( report, stats_stream )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Conversion of many 3MF files in one run, distributed over a pool
+of worker processes
+
+Each worker process stays alive for the whole run, so that the
+interpreter startup and the import of numpy and the XML packages
+are paid once per worker rather than once per file.
+"""
+
+# suffix of the name of the directory holding the inline
+# documents of an output file, see inline.py
+INLINE_DIR_SUFFIX = "_inline"
+
+def collect_inputs( paths, file_list = None):
+    """
+    paths a sequence of file system paths; a path to a directory
+          stands for the files in that directory with extension .3mf
+    file_list optional path to a text file listing one input path per line
+
+    returns the list of input file paths, in the order given; a file
+    named more than once is listed once
+    """
+    import os
+    paths = list(paths)
+    if file_list is not None:
+        with open(file_list) as f:
+            paths.extend( [line.strip() for line in f if line.strip()] )
+
+    retVal = list()
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted( os.listdir(path) )
+            retVal.extend( [os.path.join(path, name) for name in names
+                            if name.lower().endswith('.3mf')] )
+        else:
+            retVal.append(path)
+
+    seen = set()
+    distinct = list()
+    for path in retVal:
+        key = os.path.realpath(path)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(path)
+    return distinct
+
+
+def output_paths_for( input_paths, output_dir, extension = ".x3d" ):
+    """
+    returns the list of the distinct paths in output_dir of the X3D files
+    converted from input_paths, in the same order. Inputs of the same base
+    name in different directories would be converted to the same output
+    file; the output of each input after the first is named with the
+    suffix _2, _3 ... instead. Names are compared without regard to case,
+    for case insensitive file systems
+    """
+    import os
+    from . import logger
+    taken = set()
+    retVal = list()
+    for input_path in input_paths:
+        base = os.path.splitext( os.path.basename(input_path) )[0]
+        name, count = base, 1
+        while name.lower() in taken:
+            count += 1
+            name = "%s_%i" % (base, count)
+        if count > 1:
+            logger.warn("output of %s named %s%s, as %s%s is the output of another input" % \
+                        (input_path, name, extension, base, extension))
+        taken.add( name.lower() )
+        retVal.append( os.path.join( output_dir, name + extension ))
+    return retVal
+
+
+def convert_file( task ):
+    """
+    task a tuple (input_path, output_path, params)
+
+    converts one file with convert_to_X3D; the output is written to a
+    temporary file which is renamed to output_path only on success
+
+    returns a tuple (input_path, success, elapsed seconds, message, report);
+    exceptions are reported in message rather than raised, so that
+    one failed file does not end the run. report is the value returned by
+    convert_to_X3D; the instrumentation report if params['instrument'] is True
+    """
+    import os, time
+    from . import logger
+    from .file_conversions import convert_to_X3D
+
+    input_path, output_path, params = task
+    partial_path = output_path + ".part"
+    start = time.time()
+    try:
+        with open(partial_path, "wb") as output_stream:
+            report = convert_to_X3D(input_path, output_stream, **params)
+        os.rename(partial_path, output_path)
+    except Exception, exc:
+        logger.debug("conversion of %s failed" % input_path, exc_info=True)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        message = "%s: %s" % (exc.__class__.__name__, exc)
+        return (input_path, False, time.time() - start, message, None)
+    return (input_path, True, time.time() - start, output_path, report)
+
+
+def _init_worker():
+    # import the conversion modules and their dependencies once per worker
+    from . import file_conversions, reader, mesh, matrix, x3d_writer
+    import numpy
+
+
+def convert_batch( input_paths, output_dir, jobs = None, **keyw):
+    """
+    input_paths a sequence of 3MF file paths
+    output_dir the directory into which the X3D files are written
+    jobs the number of worker processes; default is the cpu count.
+         If jobs is 1 the files are converted in the calling process
+    keyw parameters passed to convert_to_X3D; with inline_triangles, the
+         inline documents of each file are written into the subdirectory
+         of output_dir named after the output file with INLINE_DIR_SUFFIX
+
+    generator yielding the (input_path, success, elapsed, message, report)
+    result of each file, in the order of input_paths
+    """
+    import os
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    from .file_conversions import output_extension
+    extension = output_extension( keyw )
+    input_paths = list( input_paths )
+    tasks = list()
+    for path, output_path in zip( input_paths,
+                                  output_paths_for( input_paths, output_dir, extension )):
+        params = keyw
+        if keyw.get('inline_triangles') is not None:
+            # the inline documents of each file go into a directory
+            # of their own, next to the main document
+            inline_name = os.path.splitext( os.path.basename(output_path) )[0] + INLINE_DIR_SUFFIX
+            params = dict( keyw, inline_dir=os.path.join(output_dir, inline_name),
+                           inline_url=inline_name )
+        tasks.append( (path, output_path, params) )
+
+    if jobs == 1:
+        for task in tasks:
+            yield convert_file(task)
+        return
+
+    from multiprocessing import Pool
+    pool = Pool( processes = jobs, initializer = _init_worker )
+    try:
+        for result in pool.imap( convert_file, tasks ):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def write_summary( results, out, stats = None ):
+    """
+    results an iterable of (input_path, success, elapsed, message, report) tuples
+    out a file-like object open for writing; a line is written for
+    each result as it becomes available, followed by totals
+    stats optional file-like object; the instrumentation report of each
+    successful conversion is written to it as one line of JSON
+
+    returns the number of failed conversions
+    """
+    succeeded = failed = 0
+    total_time = 0.0
+    for input_path, success, elapsed, message, report in results:
+        total_time += elapsed
+        if success:
+            succeeded += 1
+            out.write("OK   %8.3fs %s -> %s\n" % (elapsed, input_path, message))
+            if stats is not None and report is not None:
+                write_report( report, stats )
+        else:
+            failed += 1
+            out.write("FAIL %8.3fs %s : %s\n" % (elapsed, input_path, message))
+        out.flush()
+    out.write("%i converted, %i failed, %.3fs total conversion time\n" % \
+              (succeeded, failed, total_time))
+    return failed
+
+
+def write_report( report, out ):
+    """
+    writes the instrumentation report returned by convert_to_X3D
+    to out as a single line of JSON
+    """
+    import json
+    out.write( json.dumps( report, sort_keys=True ) + "\n" )
+    out.flush()
@@ -0,0 +1,145 @@
+"""
+Bounds of transformed meshes computed from a reduced set of points
+
+The minimum and maximum of each coordinate of an affinely transformed
+point set are attained at vertices of the convex hull of the set, so only
+those points need be transformed to bound a build item. extreme_point_candidates
+returns, once per object, a subset of the mesh points which contains every
+hull vertex: the points supporting the mesh in a fixed set of directions
+span an inner polytope, and the points inside that polytope are dropped.
+The bounds computed from the candidates are the bounds of the whole mesh.
+"""
+
+# number of distinct placements of an object from which its bounds are
+# computed from the candidate extreme points; finding the candidates costs
+# about as much as transforming the whole mesh a few times
+REDUCE_MIN_PLACEMENTS = 8
+
+# meshes with fewer points than this are used whole
+MIN_REDUCED_POINTS = 64
+
+# number of points tested against the inner polytope in a single step
+CHUNK_SIZE = 65536
+
+# upper bound on the number of transformed points held at once
+# when bounding many placements of one object
+TRANSFORM_BATCH = 1 << 20
+
+def _support_directions():
+    """
+    returns a (13,3) array of the directions of the cube faces, edges and
+    corners; with their opposites the 26 directions in which support
+    points are taken
+    """
+    from numpy import array, float_
+    directions = list()
+    for i in (-1,0,1):
+        for j in (-1,0,1):
+            for k in (-1,0,1):
+                if (i,j,k) > (0,0,0):
+                    directions.append( (i,j,k) )
+    return array( directions, float_ )
+
+
+def _polytope_facets( vertices ):
+    """
+    vertices a (K,3) array of points, K small
+
+    returns a tuple (normals, offsets), a (F,3) and (F,) array;
+    the convex hull of vertices is the set of points x with
+    dot(normals, x) <= offsets. The facet planes are found by testing
+    every plane through three of the vertices; F is 0 if the points
+    do not span a volume
+    """
+    from numpy import array, cross, dot, abs, concatenate, empty, float_
+    from itertools import combinations
+
+    K = len(vertices)
+    if K < 4:
+        return empty( (0,3), float_), empty( (0,), float_)
+    triples = array( list( combinations( range(K), 3 ) ))
+    a = vertices[ triples[:,0] ]
+    normals = cross( vertices[ triples[:,1] ] - a, vertices[ triples[:,2] ] - a )
+    offsets = (normals * a).sum(axis=1)
+    heights = dot( normals, vertices.transpose() ) - offsets[:,None]
+
+    extent = abs( vertices - vertices.mean(axis=0) ).max()
+    tol = 1.0e-9 * extent * abs(normals).sum(axis=1)
+    nondegenerate = tol > 0.0
+    below = (heights <= tol[:,None]).all(axis=1) & nondegenerate
+    above = (heights >= -tol[:,None]).all(axis=1) & nondegenerate
+    # a plane with vertices on both sides is not a facet; a plane with
+    # all the vertices on it is a facet in both orientations
+    normals = concatenate( (normals[below], -normals[above]) )
+    offsets = concatenate( (offsets[below], -offsets[above]) )
+    return normals, offsets
+
+
+def extreme_point_candidates( points ):
+    """
+    points a (N,3) array of mesh vertex coordinates
+
+    returns a (M,3) array of the points which may be extreme in some
+    direction; every vertex of the convex hull of points is included,
+    so that the bounds of transform_points(M, candidates) equal
+    the bounds of transform_points(M, points) for any 3MF matrix M
+    """
+    from numpy import dot, unique, abs, bool_, zeros
+
+    N = len(points)
+    if N < MIN_REDUCED_POINTS:
+        return points
+
+    directions = _support_directions()
+    support = set()
+    for start in range(0, N, CHUNK_SIZE):
+        chunk = points[start:start+CHUNK_SIZE]
+        heights = dot( chunk, directions.transpose() )
+        support.update( (start + heights.argmax(axis=0)).tolist() )
+        support.update( (start + heights.argmin(axis=0)).tolist() )
+    support = sorted(support)
+    # the support points themselves may hold more than one point at
+    # a location, which only adds degenerate planes
+    vertices = unique( points[support], axis=0 )
+
+    normals, offsets = _polytope_facets( vertices )
+    if len(offsets) == 0:
+        return points
+
+    # a point inside the inner polytope is a convex combination of
+    # its vertices, none of which is dropped; so it cannot exceed them
+    # in any direction
+    extent = abs( vertices - vertices.mean(axis=0) ).max()
+    tol = 1.0e-9 * extent * abs(normals).sum(axis=1)
+    keep = zeros( (N,), bool_)
+    for start in range(0, N, CHUNK_SIZE):
+        chunk = points[start:start+CHUNK_SIZE]
+        heights = dot( chunk, normals.transpose() ) - offsets
+        keep[start:start+CHUNK_SIZE] = (heights >= -tol).any(axis=1)
+    keep[support] = True
+    return points[keep]
+
+
+def transformed_bounds( points, matrices ):
+    """
+    points a (N,3) array of coordinates
+    matrices a (K,4,3) array of 3MF matrices
+
+    returns a (K,2,3) array; the minimum and maximum coordinates of
+    points transformed by each of the matrices
+    """
+    from numpy import empty, float_, dot
+
+    K = len(matrices)
+    retVal = empty( (K,2,3), float_)
+    step = max( 1, TRANSFORM_BATCH // max( 1, len(points)))
+    for start in range(0, K, step):
+        M = matrices[start:start+step]
+        # one matrix product transforms the points by all the matrices
+        # of the step; column 3k+j holds coordinate j of placement k
+        linear = M[:,:3].transpose((1,0,2)).reshape((3,-1))
+        transformed = dot( points, linear )
+        translation = M[:,3]
+        retVal[start:start+step,0] = transformed.min(axis=0).reshape((-1,3)) + translation
+        retVal[start:start+step,1] = transformed.max(axis=0).reshape((-1,3)) + translation
+    return retVal
@@ -0,0 +1,266 @@
+"""
+Content-addressed on-disk cache of converted 3MF object meshes
+
+An entry holds the decoded point and index arrays of a resources/object/mesh
+element together with its formatted X3D field text. Entries are keyed by a
+SHA-1 hash of the raw text of the mesh element, as found in the model part
+by parallel.MeshSplittingStream, the converter version and the conversion
+parameters listed in CACHE_KEY_PARAMS, so that a mesh which recurs in later
+packages is neither parsed, decoded nor formatted again.
+
+An entry is a NumPy .npz archive of the arrays, the field text stored as
+arrays of bytes, and is loaded without unpickling: the cache directory may
+be shared, and a file placed in it cannot run code when read.
+
+The total size of the cache directory is bounded. The cache keeps a running
+total of the size of its entries, found by scanning the directory at the
+first entry added, and when an entry takes it over the bound the least
+recently used entries are removed until the cache is EVICT_TARGET of the
+bound; the directory is so scanned a few times in a conversion rather than
+once for each entry added.
+"""
+
+# convert_to_X3D parameters included in the cache key
+CACHE_KEY_PARAMS = ('color', 'materials')
+
+ENTRY_SUFFIX = ".mesh"
+
+# the arrays of the mesh dictionary stored in an entry, and the
+# entries of its 'text' dictionary, stored as 'text_' + name
+ENTRY_ARRAYS = ('points', 'triangles', 'properties')
+ENTRY_TEXT = ('index', 'point')
+
+# fraction of the size bound to which an over-size cache is reduced,
+# so that the entries added next do not each cause a scan
+EVICT_TARGET = 0.9
+
+class ConversionCache(object):
+    """
+    directory the cache directory, created if it does not exist
+    max_bytes the upper bound on the total size of the cache entries
+    params the dictionary of convert_to_X3D parameters
+    """
+    def __init__(self, directory, max_bytes, params):
+        import os
+        from . import version
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.key_prefix = repr( (version,) + tuple([params[p] for p in CACHE_KEY_PARAMS]) )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = None     # size of the entries, or None until scanned
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, mesh_xml):
+        from hashlib import sha1
+        h = sha1( self.key_prefix )
+        h.update( mesh_xml )
+        return h.hexdigest()
+
+    def path(self, key):
+        import os
+        return os.path.join( self.directory, key + ENTRY_SUFFIX )
+
+    def get(self, key):
+        """
+        returns the cached mesh dictionary for key, or None
+        """
+        import os
+        from zipfile import BadZipfile
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = _read_entry( f )
+            os.utime(path, None)    # most recently used
+        except (IOError, OSError, EOFError, ValueError, KeyError, BadZipfile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """
+        stores the mesh dictionary entry under key, then evicts
+        least recently used entries if the cache is over size
+        """
+        import os, tempfile
+        path = self.path(key)
+        fd, temp_path = tempfile.mkstemp( dir = self.directory, suffix = ".tmp" )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                _write_entry( f, entry )
+            size = os.path.getsize( temp_path )
+            try:
+                replaced = os.path.getsize( path )
+            except OSError:
+                replaced = 0
+            os.rename( temp_path, path )
+        except:
+            os.remove( temp_path )
+            raise
+        if self.total_bytes is None:
+            self.total_bytes = self.scan()[1]
+        else:
+            self.total_bytes += size - replaced
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def scan(self):
+        """
+        returns a 2-tuple (entries, total); entries the list of the
+        (mtime, size, path) of each entry, total the sum of their sizes
+        """
+        import os
+        entries = list()
+        total = 0
+        for name in os.listdir( self.directory ):
+            if not name.endswith( ENTRY_SUFFIX ):
+                continue
+            path = os.path.join( self.directory, name )
+            try:
+                st = os.stat(path)
+            except OSError:         # removed by another process
+                continue
+            entries.append( (st.st_mtime, st.st_size, path) )
+            total += st.st_size
+        return entries, total
+
+    def evict(self):
+        """
+        removes the least recently used entries until the cache is
+        EVICT_TARGET of its size bound; the entries added by other
+        processes are accounted for by scanning the directory again
+        """
+        import os
+        entries, total = self.scan()
+        entries.sort()
+        entries.reverse()
+        while total > EVICT_TARGET * self.max_bytes and entries:
+            mtime, size, path = entries.pop()
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def log_statistics(self):
+        from . import logger
+        logger.info("conversion cache %s: %i hits, %i misses, %i evictions" % \
+                    (self.directory, self.hits, self.misses, self.evictions))
+
+
+def _write_entry( f, entry ):
+    """
+    writes the mesh dictionary entry to the file object f as an .npz archive
+    """
+    from numpy import savez, frombuffer, uint8
+    arrays = dict( [(name, entry[name]) for name in ENTRY_ARRAYS if name in entry] )
+    if 'text' in entry:
+        for name in ENTRY_TEXT:
+            arrays['text_' + name] = frombuffer( entry['text'][name], uint8 )
+    savez( f, **arrays )
+
+
+def _read_entry( f ):
+    """
+    returns the mesh dictionary read from the file object f, as written by
+    _write_entry; raises ValueError or KeyError if f does not hold an entry
+    """
+    from numpy import load
+    archive = load( f, allow_pickle=False )
+    try:
+        entry = dict( [(name, archive[name]) for name in ENTRY_ARRAYS
+                       if name in archive.files] )
+        if 'text_' + ENTRY_TEXT[0] in archive.files:
+            entry['text'] = dict( [(name, archive['text_' + name].tostring())
+                                   for name in ENTRY_TEXT] )
+    finally:
+        archive.close()
+    points, triangles = entry['points'], entry['triangles']
+    if points.dtype.kind != 'f' or points.ndim != 2 or points.shape[1] != 3 or \
+       triangles.dtype.kind not in 'iu' or triangles.ndim != 2 or triangles.shape[1] != 3:
+        raise ValueError("not a mesh cache entry")
+    return entry
+
+
+class _PendingEntry(object):
+    """
+    a cache miss whose mesh is being decoded on a MeshDecoderPool
+    """
+    def __init__(self, key, pending):
+        self.key = key
+        self.pending = pending
+
+
+class CachingMeshDecoder(object):
+    """
+    A mesh_decoder for reader.iter_3MF_model which looks up each mesh
+    element in cache; on a miss the mesh is decoded and formatted, in this
+    process or on decoderPool if it is not None, and added to the cache.
+    The model part is to be read through the stream returned by split, so
+    that the mesh elements are not parsed unless they are missed.
+
+    The value stored for each object is to be passed to the resolve method.
+    If format_text is False a mesh decoded in this process is not formatted;
+    an entry is stored without the text, and used with or without it.
+    properties is the properties argument of mesh.get_3MF_mesh
+    """
+    def __init__(self, cache, decoderPool = None, format_text = True, properties = False):
+        from .reader import element_tree
+        self.ET = element_tree()
+        self.cache = cache
+        self.decoderPool = decoderPool
+        self.format_text = format_text
+        self.properties = properties
+        self.stream = None
+
+    def split(self, model_file):
+        """
+        returns a parallel.MeshSplittingStream reading the model part
+        from model_file; that of decoderPool if it is not None
+        """
+        if self.decoderPool is not None:
+            return self.decoderPool.split( model_file )
+        from .parallel import MeshSplittingStream
+        self.stream = MeshSplittingStream( model_file )
+        return self.stream
+
+    def mesh_xml(self, meshNode):
+        """
+        returns the text of meshNode hashed for its key, and decoded
+        on a miss; see parallel.MeshDecoderPool.mesh_xml
+        """
+        if self.decoderPool is not None:
+            return self.decoderPool.mesh_xml( meshNode )
+        mesh_xml = None
+        if self.stream is not None:
+            mesh_xml = self.stream.mesh_text( meshNode )
+        return mesh_xml or self.ET.tostring( meshNode )
+
+    def __call__(self, meshNode, ns):
+        mesh_xml = self.mesh_xml( meshNode )
+        key = self.cache.key( mesh_xml )
+        meshData = self.cache.get( key )
+        if meshData is not None:
+            return meshData
+        if self.decoderPool is not None:
+            return _PendingEntry( key, self.decoderPool.submit( mesh_xml ))
+
+        from .parallel import decode_and_format
+        meshData = decode_and_format( (mesh_xml, self.format_text, self.properties) )
+        self.cache.put( key, meshData )
+        return meshData
+
+    def resolve(self, value):
+        """
+        returns the decoded mesh dictionary of a value returned by __call__
+        """
+        if isinstance(value, _PendingEntry):
+            meshData = self.decoderPool.resolve( value.pending )
+            self.cache.put( value.key, meshData )
+            return meshData
+        return value
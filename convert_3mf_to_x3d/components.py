@@ -0,0 +1,112 @@
+"""
+Resolution of 3MF objects built from components (Core spec 1.1 Section 4.2)
+
+An object may consist of a components element in place of a mesh; each
+component places another object, through an optional transform, in the
+coordinate space of the containing object. The objects so referenced may
+themselves be built from components, to any depth, and the same object may
+be placed by many components.
+
+A ComponentResolver checks the component references of an object once,
+detecting references to unknown objects and reference cycles, and records
+for each component object the list of its resolved children. The points
+from which the bounds of an object are computed (see bounds.py) are
+likewise computed once per object, from the cached points of its children.
+"""
+
+def component_transform_strings( objects ):
+    """
+    objects the dictionary of resource objects as returned from read_model
+
+    returns the list of the transform attribute values of all the
+    components of the objects, with None for a component without one
+    """
+    retVal = list()
+    for objectRecord in objects.values():
+        for component in objectRecord.get('components') or ():
+            retVal.append( component.get('transform', None) )
+    return retVal
+
+
+class ComponentResolver(object):
+    """
+    objects the dictionary of resource objects as returned from read_model
+    transforms a dictionary mapping transform attribute values to the
+        (M, attributes) tuple of each, as returned from
+        matrix.decompose_transform_strings; including the values
+        listed by component_transform_strings
+    """
+    def __init__(self, objects, transforms):
+        self.objects = objects
+        self.transforms = transforms
+        self.resolved = set()   # ids of the objects whose subtree is valid
+        self.extents = dict()   # object id -> candidate extreme points
+
+    def resolve(self, objectid):
+        """
+        checks that object objectid and all the objects it places through
+        its components exist and have a mesh or components, and that no
+        object contains itself. For each component object in the subtree
+        the entry 'children' is added to its record: the list of
+        (M, transformData, childRecord) tuples for its components, in
+        document order
+
+        raises ValueError on an invalid reference
+        """
+        self._resolve( objectid, list() )
+
+    def _resolve(self, objectid, path):
+        if objectid in self.resolved:
+            return
+        if objectid in path:
+            cycle = path[ path.index(objectid): ] + [objectid]
+            raise ValueError("component reference cycle: %s" % " -> ".join(cycle))
+        if objectid not in self.objects:
+            raise ValueError("resource not found for id: %s" % objectid)
+
+        objectRecord = self.objects[objectid]
+        components = objectRecord.get('components')
+        if objectRecord['mesh'] is not None:
+            if components is not None:
+                raise ValueError("object id %s has both mesh and components" % objectid)
+        elif components is None:
+            raise ValueError("No mesh node for object id %s" % objectid)
+        elif not components:
+            raise ValueError("no component in components of object id %s" % objectid)
+        else:
+            path.append( objectid )
+            children = list()
+            for component in components:
+                childid = component.get('objectid')
+                if childid is None:
+                    raise ValueError("component of object id %s without objectid" % objectid)
+                self._resolve( childid, path )
+                M, transformData = self.transforms[ component.get('transform', None) ]
+                children.append( (M, transformData, self.objects[childid]) )
+            path.pop()
+            objectRecord['children'] = children
+        self.resolved.add( objectid )
+
+    def extent_points(self, objectid):
+        """
+        returns a (N,3) array of points in the coordinate space of object
+        objectid, whose bounds under any 3MF matrix are the bounds of the
+        object's geometry under that matrix; see bounds.extreme_point_candidates.
+        The object must have been resolved
+        """
+        if objectid in self.extents:
+            return self.extents[objectid]
+
+        from numpy import concatenate
+        from .bounds import extreme_point_candidates
+        from .matrix import transform_points
+
+        objectRecord = self.objects[objectid]
+        if objectRecord['mesh'] is not None:
+            points = objectRecord['mesh']['points']
+        else:
+            points = concatenate( [transform_points( M, self.extent_points( childRecord['id'] ))
+                                   for M, transformData, childRecord in objectRecord['children']] )
+        retVal = extreme_point_candidates( points )
+        self.extents[objectid] = retVal
+        return retVal
@@ -1,6 +1,6 @@
-import sys
-
 import re
+from .instrument import null_report
+
 qname_pattern=re.compile(r"\{(\S+)\}(\S+)")
 def split_tag(tag):
     """
@@ -31,29 +31,77 @@ def ns_generator( namespace ):
     return f
 
 
-def MFVec(point, format = "%f"):
+# number of array values formatted with a single % operation by
+# the chunk generators MFVec_chunks and MFInt_chunks
+FORMAT_BATCH = 65536
+
+# trailing zeros of the decimals of a number, and a decimal point left bare
+trailing_zeros_pattern = re.compile(r"(\.[0-9]*?)0+(?= |$)")
+bare_point_pattern = re.compile(r"\.(?= |$)")
+
+def _format_chunks(values, format, strip_zeros = False):
+    """
+    values a 1-dimensional array
+    generator yielding the text of successive batches of values, each
+    value formatted with format and separated by single spaces; the
+    concatenation of the yielded chunks is the complete field text.
+    If strip_zeros is True the trailing zeros of the decimals are removed
+    """
+    separator = ""
+    batch_format = None
+    for start in range(0, len(values), FORMAT_BATCH):
+        batch = values[start:start+FORMAT_BATCH].tolist()
+        if batch_format is None or len(batch) != FORMAT_BATCH:
+            batch_format = " ".join([format] * len(batch))
+        text = batch_format % tuple(batch)
+        if strip_zeros:
+            text = bare_point_pattern.sub( "", trailing_zeros_pattern.sub( r"\1", text ))
+        yield separator + text
+        separator = " "
+
+def MFVec_chunks(point, format = "%f", strip_zeros = False):
+    """
+    point an (N,3) array
+    generator yielding successive pieces of the MFVec(point, format, strip_zeros) text
+    """
+    return _format_chunks(point.reshape((-1,)), format, strip_zeros)
+
+def MFVec(point, format = "%f", strip_zeros = False):
     """
     point an (N,3) array
     returns string suitable for X3D attribute value
     for type MFVec3f
     """
-    return " ".join([ " ".join([format % x for x in p]) for p in point])
+    return "".join( MFVec_chunks(point, format, strip_zeros) )
 
     
 def SFVec(point, format="%f"):
     """
     points a (3,) object
     """
-    return " ".join([format % x for x in point])
+    return " ".join([format] * len(point)) % tuple(point)
 
 def SFColor(color):
     return SFVec(color, format="%.3f")
-    
+
+def MFInt_chunks(indices):
+    """
+    indices a (N,) array of integers
+    generator yielding successive pieces of the MFInt(indices) text
+    """
+    return _format_chunks(indices, '%i')
+
 def MFInt(indices): 
     """
     indices a (N,) array of integers
     """
-    return " ".join([('%i' % i) for i in indices])
+    return "".join( MFInt_chunks(indices) )
+
+def MFFloat(values, format="%f"):
+    """
+    values a sequence of numbers
+    """
+    return " ".join([format] * len(values)) % tuple(values)
 
 def MFString(string_list):
     """
@@ -106,195 +154,647 @@ def get_unit( modelNode ):
     
 
 convert_to_X3D_default = {
-    'color' : (0.7,0.7,0.7)
+    'color' : (0.7,0.7,0.7),
+    'serializer' : 'direct',    # or 'genshi' to render through x3d_template.xml,
+                                # or 'binary' for the container of x3d_binary.py
+    'compression' : None,       # or 'gzip' to compress the output as it is written
+    'precision' : None,         # quantization step of coordinates in model units, or
+                                # 'auto' to derive it from the unit and object extent;
+                                # None to write coordinates with six decimals
+    'merge_vertices' : False,   # with precision, merge vertices quantized to one position
+    'cleanup' : False,          # weld duplicate vertices, remove degenerate triangles and
+                                # unused vertices, store indices in the smallest integer type
+    'weld_tolerance' : 0.0,     # with cleanup, weld vertices within this grid step in model
+                                # units; 0.0 welds only identical vertices
+    'lod_triangles' : None,     # objects with more triangles are written as an LOD node with
+                                # simplified levels; None for no LOD
+    'lod_levels' : 2,           # largest number of simplified levels of an LOD node
+    'lod_reduction' : 4.0,      # ratio of the triangle counts of successive levels
+    'lod_ranges' : None,        # viewing distances in model units at which the levels switch;
+                                # None for the object size times 2, 4, 8 ...
+    'normals' : False,          # if True, write a Normal node of per-vertex normals
+    'crease_angle' : None,      # with normals, angle in radians beyond which the normals
+                                # of adjacent triangles are not averaged; None to average all
+    'materials' : False,        # if True, translate the 3MF basematerials and colorgroup
+                                # properties into Material and Color nodes; color is then
+                                # the color of the triangles without a property
+    'inline_triangles' : None,  # objects with more triangles are written to separate documents
+                                # referenced through Inline nodes; None to write all in one
+    'inline_dir' : None,        # directory of the separate documents
+    'inline_url' : None,        # URL of inline_dir relative to the main document; None for inline_dir
+    'inline_workers' : None,    # number of processes writing the separate documents; None for serial
+    'mesh_workers' : None,      # number of processes decoding meshes; None for serial
+    'cache_dir' : None,         # directory of the converted mesh cache; None for no cache
+    'cache_size' : 1 << 30,     # upper bound in bytes on the size of the cache
+    'share_geometry' : True,    # DEF/USE one IndexedTriangleSet for objects with identical meshes
+    'instrument' : False        # if True, return a report of the time and memory of each stage
 }
 
+def output_extension( params ):
+    """
+    returns the file name extension of the output written
+    with the convert_to_X3D parameters params
+    """
+    extension = ".x3db" if params.get('serializer') == 'binary' else ".x3d"
+    if params.get('compression') == 'gzip':
+        extension = ".x3dz" if extension == ".x3d" else extension + ".gz"
+    return extension
+
+
 def convert_to_X3D(input_path, output_stream, **keyw):
     """
-    input_path a file system path
+    input_path a file system path, or a seekable file-like object open
+        for reading the 3MF package
     output_stream a file-like object open for writing
+
+    The conversion proceeds in the stages: open the package, read the model
+    and decode its meshes (read_model), transform the build items and
+    compute their bounds (layout_build), and serialize the X3D document
+    (write_X3D); with the inline_triangles parameter the large meshes are
+    first written to separate documents (inline.write_inline_documents).
+    The first stages are performed by load_model and the last by
+    write_document; see also scene.read_scene
+
+    If the instrument parameter is True, returns a dictionary reporting the
+    time and peak memory use of each stage, the number of XML elements and
+    the XML element, vertex and triangle counts of each object; see
+    instrument.py
     """
-    from . import logger
-    from numpy import array
+    import time
+    from .instrument import ConversionReport
     
     params = dict()
     params.update( convert_to_X3D_default )
     params.update( keyw )
-    
-    import opc
-    logger.info( "opening 3mf file %s" % input_path )
-    pkg = opc.OpcPackage.open(input_path)
 
-    try:
-        logger.info( "main document: %s" % pkg.main_document )
-    except KeyError:
-        logger.info( "No main document found" )
+    start_time = time.time()
+    report = ConversionReport() if params['instrument'] else null_report
 
-    for part in pkg.parts:
-        logger.info( "part %s : mimetype: %s : byte-count %i" % (part.partname, part.content_type, len(part.blob)))
- 
+    model, builds, global_bounds = load_model( input_path, params, report )
+    write_document( output_stream, model, builds, global_bounds, params, report )
 
-    from io import BytesIO
-    model_as_file = BytesIO(pkg.parts[0].blob)
+    if params['instrument']:
+        retVal = report.as_dict()
+        retVal.update( {
+            'input' : str(input_path),
+            'serializer' : params['serializer'],
+            'build_items' : len( builds ),
+            'total_seconds' : time.time() - start_time
+        })
+        return retVal
 
-    # alternative: import xml.etree.ElementTree as ET
-    try:
-        import lxml.etree as  ET
-        logger.debug("Using lxml as ElementTree")
-    except ImportError:
-        import xml.etree.ElementTree as ET
-        logger.debug("Using xml.etree.ElementTree as ElementTree")
 
+def load_model( source, params, report = null_report ):
+    """
+    Reads the model of a 3MF package and prepares it for serialization:
+    the package is opened, the model read and its meshes decoded, the
+    meshes processed as set by params (materials, quantization, cleanup,
+    levels of detail, normals), and the build laid out
+
+    source a file system path, or a seekable file-like object open for
+        reading the 3MF package
+    params the dictionary of convert_to_X3D parameters
+    report an instrument.ConversionReport recording the stages
+
+    returns a 3-tuple (model, builds, global_bounds) as returned from
+    read_model and layout_build
+    """
+    from . import logger
+    from .package import open_3MF_package, open_model_part
+    logger.info( "opening 3mf file %s" % (getattr(source, 'name', source),) )
+    with report.stage('package_open'):
+        pkg = open_3MF_package(source)
+        model_as_file = open_model_part(pkg)
+
+    from .mesh import get_3MF_mesh
+
+    # meshes are decoded as each resources/object element is
+    # completed, either here or on a pool of processes
+    # the field text of quantized, cleaned or creased meshes is formatted afterwards
+    format_text = params['precision'] is None and not params['cleanup'] and \
+                  not (params['normals'] and params['crease_angle'] is not None)
+    # the triangle properties are extracted only for material translation
+    properties = params['materials']
+    decoderPool = None
+    mesh_decoder = get_3MF_mesh
+    if properties:
+        def mesh_decoder( meshNode, ns ):
+            return get_3MF_mesh( meshNode, ns, properties )
+    if params['mesh_workers'] is not None and params['mesh_workers'] > 1:
+        from .parallel import MeshDecoderPool
+        decoderPool = mesh_decoder = MeshDecoderPool( params['mesh_workers'], format_text,
+                                                      properties )
+        logger.info("decoding meshes on %i processes" % params['mesh_workers'])
+
+    cache = None
+    if params['cache_dir'] is not None:
+        from .cache import ConversionCache, CachingMeshDecoder
+        cache = ConversionCache( params['cache_dir'], params['cache_size'], params )
+        mesh_decoder = CachingMeshDecoder( cache, decoderPool, format_text, properties )
+    if hasattr( mesh_decoder, 'split' ):
+        # the mesh elements are read as text, for the workers or the
+        # cache, and are not parsed here
+        model_as_file = mesh_decoder.split( model_as_file )
+
+    completed = False
     try:
-        doc = ET.parse(  model_as_file )
-    except Exception, exc:
-        logger.exception( str(exc) )
-        sys.exit(1)
-
-    namespace, root_local_name =  split_tag( doc.getroot().tag )
-    logger.info("3MF model uses namespace %s" % namespace)
-    ns_3mf = ns_generator(namespace)
-    
-    modelNode = doc.getroot()
-    unit = get_unit( modelNode )
-    logger.info("unit identified as %s" % unit['name'])
-    
-    # collect metadata
+        model = read_model( model_as_file, mesh_decoder, report )
+        completed = True
+    finally:
+        if decoderPool is not None:
+            if completed:
+                decoderPool.close()
+            else:
+                decoderPool.terminate()
+        model_as_file.close()
+        pkg.close()
+        if cache is not None:
+            cache.log_statistics()
+            report.count( 'cache_hits', cache.hits )
+            report.count( 'cache_misses', cache.misses )
+
+    if params['materials']:
+        with report.stage('materials'):
+            materials_model( model, params['color'] )
+    if params['precision'] is not None:
+        with report.stage('quantize'):
+            quantize_model( model, params['precision'], params['merge_vertices'] )
+    if params['cleanup']:
+        with report.stage('cleanup'):
+            clean_model( model, params['weld_tolerance'], report )
+    if params['lod_triangles'] is not None:
+        with report.stage('lod'):
+            lod_model( model, params, report )
+
+    if params['normals']:
+        with report.stage('normals'):
+            normals_model( model, params['crease_angle'] )
+    with report.stage('transform_bounds'):
+        builds, global_bounds = layout_build( model )
+    return model, builds, global_bounds
+
+
+def write_document( output_stream, model, builds, global_bounds, params,
+                    report = null_report ):
+    """
+    Serializes the X3D document of a model prepared by load_model to
+    output_stream; with the inline_triangles parameter the large meshes
+    are first written to separate documents. The model is not modified,
+    so that it may be serialized again
+    """
+    external = None
+    if params['inline_triangles'] is not None:
+        from .inline import write_inline_documents
+        with report.stage('inline_write'):
+            external = write_inline_documents( model, builds, params, report )
+    with report.stage('serialization'):
+        write_X3D( output_stream, model, builds, global_bounds, params, report, external )
+
+
+def read_model( model_file, mesh_decoder, report = null_report ):
+    """
+    model_file a file-like object open for reading the 3MF model part
+    mesh_decoder the mesh_decoder argument of reader.iter_3MF_model; if it
+    has a resolve method, the value it returned for each object is replaced
+    by the value of resolve once the whole model has been read
+    report an instrument.ConversionReport recording the 'xml_parse' and
+    'mesh_decode' stages and the counts of each object mesh
+
+    returns a dictionary with entries
+    unit : dictionary returned by get_unit
+    metaitems : list of (name, content) X3D meta tags
+    objects : dictionary of resource object records, indexed by id
+    items : list of build/item attribute dictionaries, in document order
+    propertygroups : dictionary of the (N,4) uint8 RGBA colors of the
+        basematerials and colorgroup resources, indexed by id; and None
+        for the property groups which are not translated
+    """
+    from . import logger
+    from .reader import iter_3MF_model
     from .metatags import metadata_mapping
+    from .materials import parse_colors
+
+    def timed_decoder( meshNode, ns ):
+        with report.stage('mesh_decode'):
+            return mesh_decoder( meshNode, ns )
+
     metaitems = list()
-    for mNode in modelNode.findall( ns_3mf('metadata')):
-        name = mNode.get('name')
-        x3d_name = metadata_mapping.get(name, name)
-        logger.debug("metadata %s -> %s" % (name, x3d_name))
-        metaitems.append( (x3d_name, mNode.text))
+    objects = dict()        # resource objects indexed by id attribute
+    items = list()
+    propertygroups = dict() # colors of the property groups indexed by id
+    try:
+        with report.stage('xml_parse'):
+            for kind, value in iter_3MF_model( model_file, timed_decoder, report ):
+                if kind == 'model':
+                    modelNode = value
+                    namespace, root_local_name =  split_tag( modelNode.tag )
+                    logger.info("3MF model uses namespace %s" % namespace)
+                    unit = get_unit( modelNode )
+                    logger.info("unit identified as %s" % unit['name'])
+                elif kind == 'metadata':
+                    # collect metadata
+                    name, text = value
+                    x3d_name = metadata_mapping.get(name, name)
+                    logger.debug("metadata %s -> %s" % (name, x3d_name))
+                    metaitems.append( (x3d_name, text))
+                elif kind == 'object':
+                    objectid = value['id']
+                    if objectid is None:
+                        raise ValueError("resource object without id attribute")
+                    if objectid in objects:
+                        raise ValueError("duplicate resource object id: %s" % objectid)
+                    objects[objectid] = value
+                elif kind == 'item':
+                    items.append( value )
+                elif kind == 'propertygroup':
+                    groupid, colors = value
+                    if groupid is None:
+                        raise ValueError("property group without id attribute")
+                    if groupid in propertygroups:
+                        raise ValueError("duplicate property group id: %s" % groupid)
+                    propertygroups[groupid] = None if colors is None else parse_colors( colors )
+    except SyntaxError, exc:
+        raise ValueError("cannot parse 3MF model: %s" % (exc,))
+
+    if hasattr( mesh_decoder, 'resolve'):
+        with report.stage('mesh_decode'):
+            for objectRecord in objects.values():
+                if objectRecord['mesh'] is not None:
+                    objectRecord['mesh'] = mesh_decoder.resolve( objectRecord['mesh'] )
+
+    for objectRecord in objects.values():
+        meshData = objectRecord['mesh']
+        if meshData is not None:
+            report.add_object( objectRecord['id'], objectRecord['elements'],
+                               len( meshData['points'] ), len( meshData['triangles'] ))
+
     from . import version
     generator = "convert_3mf_to_x3d %s" % version
     metaitems.append( ('generator', generator) )
+
+    return {
+        'unit' : unit,
+        'metaitems' : metaitems,
+        'objects' : objects,
+        'items' : items,
+        'propertygroups' : propertygroups
+    }
+
+
+def materials_model( model, default ):
+    """
+    Resolves the color of the corners of the triangles of each object of
+    model against its property groups; see materials.py. The record of an
+    object all of one color is given the entry 'color', its (4,) uint8
+    RGBA color; otherwise its mesh is given the entry 'triangle_colors',
+    the (K,3,4) uint8 array of the corner colors
+
+    model a dictionary as returned from read_model; its object records
+          are updated in place
+    default the (r,g,b) color, components in [0,1], of the triangles
+          without a property
+
+    raises ValueError on a reference to a missing property; the triangles
+    referencing a property group which is not translated are given the
+    default color, with a warning
+    """
+    from . import logger
+    from .materials import PropertyTable, uniform_color
+
+    table = PropertyTable( model['propertygroups'],
+                           [int( round( 255 * c )) for c in default] + [255] )
+    for objectRecord in model['objects'].values():
+        meshData = objectRecord['mesh']
+        if meshData is None:
+            continue
+        try:
+            colors = table.triangle_colors( meshData, objectRecord['attributes'] )
+        except ValueError as exc:
+            raise ValueError("object id %s: %s" % (objectRecord['id'], exc))
+        meshData.pop( 'properties', None )
+        if colors is None:
+            continue
+        color = uniform_color( colors )
+        if color is not None:
+            objectRecord['color'] = color
+            logger.debug("object %s color %s" % (objectRecord['id'], color))
+        else:
+            meshData['triangle_colors'] = colors
+            logger.debug("object %s colored per triangle" % (objectRecord['id'],))
+
+
+def quantize_model( model, precision, merge = False ):
+    """
+    Rounds the mesh coordinates of each object of model to the multiples
+    of a quantization step; see mesh.quantize_mesh
+
+    model a dictionary as returned from read_model; its object records
+          are updated in place
+    precision the quantization step in model units, or 'auto' to choose
+          a step for each object from the model unit and the object extent;
+          see mesh.quantization_step
+    merge if True, vertices quantized to the same position are merged
+    """
+    from . import logger
+    from .mesh import quantization_step, quantize_mesh
+
+    conversionFactor = model['unit']['conversionFactor']
+    for objectRecord in model['objects'].values():
+        meshData = objectRecord['mesh']
+        if meshData is None:
+            continue
+        step = quantization_step( meshData['points'], precision, conversionFactor )
+        objectRecord['mesh'] = quantize_mesh( meshData, step, merge )
+        logger.debug("object %s quantized to step %g: %i of %i vertices" % \
+                     (objectRecord['id'], step, len(objectRecord['mesh']['points']),
+                      len(meshData['points'])))
+
+
+def clean_model( model, tolerance = 0.0, report = null_report ):
+    """
+    Welds the duplicate vertices of the mesh of each object of model and
+    removes its degenerate triangles and unused vertices; see mesh.clean_mesh
+
+    model a dictionary as returned from read_model; its object records
+          are updated in place
+    tolerance vertices in the same cell of a grid of this step, in model
+          units, are welded; 0.0 welds only identical vertices
+    report optional instrument.ConversionReport; the numbers of vertices
+          and triangles removed are added to its counts
+
+    raises ValueError if a triangle of an object refers to a missing vertex
+    """
+    from . import logger
+    from .mesh import clean_mesh
+
+    for objectRecord in model['objects'].values():
+        meshData = objectRecord['mesh']
+        if meshData is None:
+            continue
+        try:
+            cleaned = clean_mesh( meshData, tolerance )
+        except ValueError as exc:
+            raise ValueError("object id %s: %s" % (objectRecord['id'], exc))
+        objectRecord['mesh'] = cleaned
+        removedVertices = len(meshData['points']) - len(cleaned['points'])
+        removedTriangles = len(meshData['triangles']) - len(cleaned['triangles'])
+        report.count( 'cleanup_vertices_removed', removedVertices )
+        report.count( 'cleanup_triangles_removed', removedTriangles )
+        logger.debug("object %s cleaned: vertices %i -> %i, triangles %i -> %i, indices %s" % \
+                     (objectRecord['id'], len(meshData['points']), len(cleaned['points']),
+                      len(meshData['triangles']), len(cleaned['triangles']),
+                      cleaned['triangles'].dtype.name))
+
+
+def lod_model( model, params, report = null_report ):
+    """
+    Computes the simplified levels of detail of each object of model whose
+    mesh has more than params['lod_triangles'] triangles; see mesh.lod_meshes.
+    The entry 'lod' is added to the record of each such object, a dictionary
+    with entries
+    center : (3,) array, the center of the bounding box of the mesh
+    range : list of the viewing distances at which the levels switch
+    levels : list of the simplified meshes, one for each range value
+
+    With params['share_geometry'] the levels are computed once for the
+    objects with identical meshes, which share the list of levels.
+
+    model a dictionary as returned from read_model; its object records
+          are updated in place
+    params the dictionary of convert_to_X3D parameters
+    report optional instrument.ConversionReport; the number of simplified
+          levels is added to its 'lod_levels' count
+    """
+    from . import logger
+    from numpy import sqrt
+    from .mesh import lod_meshes, mesh_fingerprint
+
+    ranges = params['lod_ranges']
+    levels = params['lod_levels'] if ranges is None else len(ranges)
+    simplified_meshes = dict()  # mesh fingerprint -> simplified levels
+    for objectRecord in model['objects'].values():
+        meshData = objectRecord['mesh']
+        if meshData is None or len(meshData['triangles']) <= params['lod_triangles']:
+            continue
+        if params['share_geometry']:
+            fp = mesh_fingerprint( meshData )
+            if fp not in simplified_meshes:
+                simplified_meshes[fp] = lod_meshes( meshData, levels, params['lod_reduction'] )
+            simplified = simplified_meshes[fp]
+        else:
+            simplified = lod_meshes( meshData, levels, params['lod_reduction'] )
+        if not simplified:
+            continue
+        lower = meshData['points'].min(axis=0)
+        upper = meshData['points'].max(axis=0)
+        if ranges is None:
+            size = sqrt( ((upper - lower) ** 2).sum() )
+            objectRange = [size * 2.0 ** level for level in range(1, len(simplified) + 1)]
+        else:
+            objectRange = list( ranges[:len(simplified)] )
+        objectRecord['lod'] = {
+            'center' : 0.5 * (lower + upper),
+            'range'  : objectRange,
+            'levels' : simplified
+        }
+        report.count( 'lod_levels', len(simplified) )
+        logger.debug("object %s levels of detail: triangles %s" % (objectRecord['id'],
+            " ".join( ["%i" % len(m['triangles']) for m in [meshData] + simplified] )))
+
+
+def normals_model( model, creaseAngle = None ):
+    """
+    Adds the per-vertex normals to the mesh of each object of model, and
+    to the simplified meshes of its levels of detail; see mesh.vertex_normals.
+    Levels shared by several objects, see lod_model, remain shared
+
+    model a dictionary as returned from read_model; its object records
+          are updated in place
+    creaseAngle optional angle in radians; vertices at which triangles
+          meet at a larger angle are split, to keep the edge sharp
+    """
+    from . import logger
+    from .mesh import vertex_normals
+
+    level_normals = dict()  # id of a list of levels -> (that list, kept so that its
+                            # id is not reused; the levels with normals)
+    for objectRecord in model['objects'].values():
+        meshData = objectRecord['mesh']
+        if meshData is None:
+            continue
+        objectRecord['mesh'] = vertex_normals( meshData, creaseAngle )
+        lod = objectRecord.get('lod')
+        if lod is not None:
+            key = id( lod['levels'] )
+            if key not in level_normals:
+                level_normals[key] = (lod['levels'],
+                                      [vertex_normals( levelMesh, creaseAngle )
+                                       for levelMesh in lod['levels']])
+            lod['levels'] = level_normals[key][1]
+        logger.debug("object %s normals: %i vertices of %i" % \
+                     (objectRecord['id'], len(objectRecord['mesh']['points']),
+                      len(meshData['points'])))
+
+
+def layout_build( model ):
+    """
+    model a dictionary as returned from read_model
+
+    returns a 2-tuple (builds, global_bounds)
+    builds a list of (itemNode, transformData, objectRecord) for each
+           build item, in document order
+    global_bounds a (2,3) array; the minimum and maximum coordinates of
+           all the build items in global space
+    """
+    from . import logger
+    from numpy import array
+    from .matrix import decompose_transform_strings
+    from .bounds import transformed_bounds, REDUCE_MIN_PLACEMENTS
+    from .components import ComponentResolver, component_transform_strings
     
-    
-    
-    resourcesNode=modelNode.find(ns_3mf('resources'))
-    if resourcesNode is None:
-        raise ValueError("No resources node found")
-        
-    buildNode=modelNode.find(ns_3mf('build'))
-    if buildNode is None:
-        raise ValueError("No build node located")
-    
-    from mesh import get_3MF_mesh
-    from .matrix import matrix_from_string, transform_points, identity_matrix,\
-                        transform_attributes_from_matrix
-    
-    
-    items = list( buildNode.findall(ns_3mf('item')))
+    objects = model['objects']
+    items = model['items']
     logger.debug("%i build/item elements in model" % len(items))
-    
-    globalPoints = list()   # will be a collection of points
-                            # which define the extent of all built
-                            # items in global space
-                            
-    group = ET.Element("Group")
-    
-    objects_defid = dict()  # will maintain list of points already
-                            # rendered as Shapes and which can be
-                            # reused with USE/DEF construction
-                            # on Shape nodes
-                            
+
+    # each distinct transform string of the build items and the
+    # components is parsed and decomposed once, all of them together
+    # in one batch
+    transforms = decompose_transform_strings(
+                    [itemNode.get('transform',None) for itemNode in items] + \
+                    component_transform_strings( objects ))
+
+    # check every build item reference, and the components of the
+    # objects referenced, before any conversion is done
+    resolver = ComponentResolver( objects, transforms )
     for itemNode in items:
         itemid = itemNode.get('objectid')
         if itemid is None:
             raise ValueError("no objectid located")
+        if itemid not in objects:
+            raise ValueError("resource not found for id: %s" % itemid)
+        resolver.resolve( itemid )
+    
+    objects_defid = dict()  # will maintain, for each object already
+                            # rendered as a Shape or Group and which can
+                            # be reused with USE/DEF construction, the
+                            # set of its distinct transform strings
+                            
+    builds = list()         # (itemNode, transformData, objectRecord) for
+                            # each build item, in document order
+
+    for itemNode in items:
+        itemid = itemNode.get('objectid')
         logger.debug("build item id: %s" % (itemid,))
         
-         
         transformString = itemNode.get('transform',None)
-        if transformString is not None:
-            buildMatrix = matrix_from_string( transformString )
-        else:
-            buildMatrix = identity_matrix
-
-        itemTransform = ET.SubElement(group, "Transform")
-        transformData = transform_attributes_from_matrix( buildMatrix )
-        if 'translation' in transformData:
-            itemTransform.set('translation', SFVec( transformData['translation'] ))
-        if 'rotation' in transformData:
-            itemTransform.set('rotation', SFVec( transformData['rotation'] ))
-        if 'scale' in transformData:
-            itemTransform.set('scale', SFVec( transformData['scale'] ))
-
-        # add Metadata nodes pertinent to this 3MF build/item
-        metadataSetNode = ET.SubElement(itemTransform,"MetadataSet")
-        metadataSetNode.set("name","3MF:build/item")
-        itemPartnumber = itemNode.get("partnumber","")
+        buildMatrix, transformData = transforms[ transformString ]
 
-        ET.SubElement(metadataSetNode,
-                      "MetadataString",
-                      name='partnumber',
-                      containerField = 'value',
-                      value=MFString([itemPartnumber]))
-                          
-                          
-        shape = ET.SubElement(itemTransform,"Shape")
+        objectRecord = objects[itemid]
         object_id_x3d = "object_x3d_%s" % itemid
-        if object_id_x3d in objects_defid:             
-            shape.set('USE', object_id_x3d)
-            logger.debug("Reusing resource object %s" % object_id_x3d)
-        else:            
-            for objectNode in resourcesNode.findall( ns_3mf('object')):
-                if objectNode.get('id') == itemid:
-                    break
+        if object_id_x3d not in objects_defid:
+            meshData = objectRecord['mesh']
+            if meshData is not None:
+                NPoints = len( meshData['points'] )
+                NTriangles = len( meshData['triangles'] )
+                logger.debug("object %s mesh: %i vertices, %i triangles" % \
+                             (itemid, NPoints, NTriangles))
             else:
-                raise ValueError("resource not found for id: %s" % itemid)
-            
-            meshNode = objectNode.find(ns_3mf('mesh'))
-            if meshNode is None:
-                raise ValueError("No mesh node for object id %s" % itemid)
-        
-            meshData = get_3MF_mesh( meshNode, ns_3mf)
-            NPoints = len( meshData['points'] )
-            NTriangles = len( meshData['triangles'] )
-            logger.debug("object %s mesh: %i vertices, %i triangles" % \
-                         (itemid, NPoints, NTriangles))
+                logger.debug("object %s: %i components" % \
+                             (itemid, len( objectRecord['children'] )))
     
-            objects_defid[object_id_x3d] = meshData['points']
-            logger.debug("defining shape for resource object %s" %  object_id_x3d)
-
-            shape.set('DEF', object_id_x3d)
-            
-            # add Metadata nodes derived from objectNode attributes
-            objectSetNode = ET.SubElement(shape,"MetadataSet")
-            objectSetNode.set("name", "3MF:resources/object")
-            for attribName in ("type", "partnumber", "name"):
-                attribValue = objectNode.get(attribName, "")
-            
-                objectMetaNode = ET.SubElement(objectSetNode,"MetadataString")
-                objectMetaNode.set("name", attribName)
-                objectMetaNode.set("value", MFString([attribValue]))
-                objectMetaNode.set("containerField", "value")
-                    
-            # add geometry and appearance
-            geometry = ET.SubElement( shape, "IndexedTriangleSet")
-            geometry.set('ccw','true')
-            geometry.set('solid','true')    
-            geometry.set('index', MFInt( meshData['triangles'].reshape((-1,))))
+            objects_defid[object_id_x3d] = set()
+        objects_defid[object_id_x3d].add( transformString )
             
-            coordinate = ET.SubElement(geometry, "Coordinate")
-            coordinate.set('point', MFVec(meshData['points']))
-    
-            appearance = ET.SubElement(shape, "Appearance")
-            material = ET.SubElement(appearance, 'Material')
-            material.set('diffuseColor', SFColor( params['color'] ))
-            
-        buildPoints = transform_points(buildMatrix, objects_defid[object_id_x3d])            
-        globalPoints.append(buildPoints.min(axis=0))
-        globalPoints.append(buildPoints.max(axis=0))
+        builds.append( (itemNode, transformData, objectRecord) )
     #################### End iteration over build/item elements ###############        
 
+    # bound the placements of each object together; an object placed
+    # many times, or built from components, is bounded through its
+    # cached candidate extreme points only
+    globalPoints = list()   # will be a collection of points
+                            # which define the extent of all built
+                            # items in global space
+    for object_id_x3d, transformStrings in objects_defid.items():
+        objectRecord = objects[ object_id_x3d[len("object_x3d_"):] ]
+        if objectRecord['mesh'] is not None and \
+           len(transformStrings) < REDUCE_MIN_PLACEMENTS:
+            points = objectRecord['mesh']['points']
+        else:
+            points = resolver.extent_points( objectRecord['id'] )
+            logger.debug("%s bounded by %i candidate extreme points" % \
+                         (object_id_x3d, len(points)))
+        matrices = array( [transforms[t][0] for t in transformStrings] )
+        placementBounds = transformed_bounds( points, matrices )
+        globalPoints.extend( placementBounds[:,0] )
+        globalPoints.extend( placementBounds[:,1] )
         
     # form the global bounds array of shape (2,3)
     globalPoints = array(globalPoints)
     global_bounds = array([globalPoints.min(axis=0), globalPoints.max(axis=0)])
-    
+    return builds, global_bounds
+
+
+def gzip_stream( output_stream ):
+    """
+    returns a file-like object gzip compressing the data written to it
+    into output_stream; mtime 0 keeps the output of a conversion the
+    same from run to run. The returned object must be closed
+    """
+    import gzip
+    return gzip.GzipFile( filename="", mode="wb", compresslevel=6,
+                          fileobj=output_stream, mtime=0 )
+
+
+def scene_components( placed, external = None ):
+    """
+    placed a list of object records as returned from placed_objects
+    external optional dictionary of the objects written as Inline nodes
+
+    returns the list of (name, level) 2-tuples of the X3D components
+    beyond the Interchange profile needed by the nodes of the objects
+    """
+    external = external or dict()
+    retVal = list()
+    if any( [objectRecord.get('lod') is not None for objectRecord in placed
+             if objectRecord['id'] not in external] ):
+        retVal.append( ("Navigation", 2) )      # LOD
+    if external:
+        retVal.append( ("Networking", 2) )      # Inline
+    return retVal
+
+
+def write_X3D( output_stream, model, builds, global_bounds, params,
+               report = null_report, external = None ):
+    """
+    Serializes the X3D document to output_stream
+
+    model a dictionary as returned from read_model
+    builds, global_bounds as returned from layout_build
+    params the dictionary of convert_to_X3D parameters
+    report an instrument.ConversionReport recording the 'field_format' stage
+    external optional dictionary mapping the ids of the objects written to
+    separate documents to their URLs, as returned from
+    inline.write_inline_documents
+    """
+    from . import logger
+    from numpy import array
+
+    compression = params['compression']
+    if compression == 'gzip':
+        # the document is compressed as it is serialized
+        compressed_stream = gzip_stream( output_stream )
+        try:
+            write_X3D( compressed_stream, model, builds, global_bounds,
+                       dict( params, compression=None ), report, external )
+        finally:
+            compressed_stream.close()
+        return
+    elif compression is not None:
+        raise ValueError("unknown compression %s" % repr(compression))
+
+    unit = model['unit']
+    metaitems = model['metaitems']
+
     centerOfRotation = 0.5*(global_bounds[0] + global_bounds[1])
     extent = max( (global_bounds[1] - global_bounds[0])[:2] )
     logger.debug("total build horizontal extent: %f" % (extent,))
@@ -302,29 +802,433 @@ def convert_to_X3D(input_path, output_stream, **keyw):
     viewpointHeight = global_bounds[1,2] + 8.0 * extent
     position = array( list( centerOfRotation[:2]) + [viewpointHeight] )
     
-    viewpoint = ET.Element('Viewpoint')
-    viewpoint.set('centerOfRotation', SFVec( centerOfRotation))
-    viewpoint.set('position', SFVec(position))
-    viewpoint.set('description',"Printer Overhead")
+    viewpoint = [
+        ('centerOfRotation', SFVec( centerOfRotation)),
+        ('position', SFVec(position)),
+        ('description',"Printer Overhead")
+    ]
     
     viewpoints = [viewpoint]
+    components = scene_components( placed_objects( builds ), external )
+
+    from .x3d_writer import X3DStreamWriter, ElementTreeBuilder, X3D_DOCTYPE
+    serializer = params['serializer']
+    if serializer in ('direct', 'binary'):
+        if serializer == 'binary':
+            from .x3d_binary import X3DBinaryWriter
+            writer = X3DBinaryWriter(output_stream)
+        else:
+            writer = X3DStreamWriter(output_stream)
+        writer.begin_document(unit, metaitems, components)
+        for vp in viewpoints:
+            writer.element('Viewpoint', vp)
+        writer.begin_model()
+        write_model(writer, builds, params, report, external)
+        writer.end_document()
+        return
+    elif serializer != 'genshi':
+        raise ValueError("unknown serializer %s" % repr(serializer))
+
+    from .reader import element_tree
+    builder = ElementTreeBuilder( element_tree() )
+    for vp in viewpoints:
+        builder.start('Viewpoint', vp)
+        builder.end('Viewpoint')
+    write_model(builder, builds, params, report, external)
+    group = builder.roots.pop()
 
     import genshi.input
     
-    from os.path import dirname
-    from genshi.template import TemplateLoader
-    template_loader= TemplateLoader(dirname(__file__), variable_lookup='lenient')
-    template = template_loader.load('x3d_template.xml')
+    template = x3d_template()
     
     args = {
         "unit"  : unit,
         "model" :genshi.input.ET(group),
         "metatags" : metaitems,
-        "viewpoints" : [genshi.input.ET(vp) for vp in viewpoints]
+        "components" : components,
+        "viewpoints" : [genshi.input.ET(vp) for vp in builder.roots]
     }
     
     
     stream = template.generate(  **args)
     
-    X3D_DOCTYPE=('X3D', "ISO//Web3D//DTD X3D 3.3//EN", "http://www.web3d.org/specifications/x3d-3.3.dtd")
     stream.render(method='xml', encoding="utf-8", out=output_stream, doctype=X3D_DOCTYPE)
+
+
+# the compiled genshi template, loaded by the first call of x3d_template
+_template = None
+
+def x3d_template():
+    """
+    returns the genshi template x3d_template.xml; the template is loaded
+    and compiled once in each process and reused by later conversions
+    """
+    global _template
+    if _template is None:
+        from os.path import dirname
+        from . import require
+        TemplateLoader = require( 'genshi.template', 'genshi' ).TemplateLoader
+        template_loader= TemplateLoader(dirname(__file__), variable_lookup='lenient')
+        _template = template_loader.load('x3d_template.xml')
+    return _template
+
+
+def write_object_X3D( output_stream, unit, objectRecord, params, report = null_report ):
+    """
+    Serializes to output_stream an X3D document whose scene holds only the
+    node of the mesh object objectRecord, to be referenced by an Inline
+    node. The document is written by the direct serializer, or by the
+    binary one if params['serializer'] is 'binary'
+
+    unit the model unit, as the 'unit' entry of the read_model dictionary
+    params the dictionary of convert_to_X3D parameters
+    """
+    compression = params['compression']
+    if compression == 'gzip':
+        compressed_stream = gzip_stream( output_stream )
+        try:
+            write_object_X3D( compressed_stream, unit, objectRecord,
+                              dict( params, compression=None ), report )
+        finally:
+            compressed_stream.close()
+        return
+    elif compression is not None:
+        raise ValueError("unknown compression %s" % repr(compression))
+
+    from .x3d_writer import X3DStreamWriter
+    if params['serializer'] == 'binary':
+        from .x3d_binary import X3DBinaryWriter
+        writer = X3DBinaryWriter(output_stream)
+    else:
+        writer = X3DStreamWriter(output_stream)
+    writer.begin_document(unit, [], scene_components( [objectRecord] ), navigation=False)
+    write_object = object_writer( writer, [objectRecord], params, report )
+    write_object( objectRecord )
+    writer.end_document()
+
+
+def mesh_field_text( meshData ):
+    """
+    meshData a dictionary as returned from mesh.get_3MF_mesh
+    returns a dictionary with the complete X3D field text for the
+    IndexedTriangleSet 'index' and Coordinate 'point' attributes
+    """
+    return {
+        'index' : MFInt( meshData['triangles'].reshape((-1,)) ),
+        'point' : MFVec( meshData['points'], *point_format( meshData ) )
+    }
+
+
+def point_format( meshData ):
+    """
+    returns the (format, strip_zeros) arguments of MFVec for the
+    points of meshData; quantized meshes are written with the decimals
+    of their quantization step, without trailing zeros
+    """
+    if 'point_format' in meshData:
+        return meshData['point_format'], True
+    return "%f", False
+
+
+def write_geometry(builder, meshData, geometry, report = null_report):
+    """
+    Delivers the IndexedTriangleSet node for meshData to builder
+
+    meshData a dictionary as returned from mesh.get_3MF_mesh, with
+    an optional 'text' entry as returned from mesh_field_text and an
+    optional 'normals' entry as returned from mesh.vertex_normals,
+    written as a Normal node, and an optional 'triangle_colors' entry as
+    added by materials_model, written as a Color or ColorRGBA node; see
+    materials.color_mesh
+    geometry a list of leading (name, value) attributes for the node
+    report an instrument.ConversionReport timing the formatting of the
+    field text as stage 'field_format'
+
+    the index, point and normal values are delivered as x3d_writer.ArrayField
+    instances, so that the binary serializer writes the arrays unformatted,
+    recording the format of the point and normal text
+    """
+    from .x3d_writer import ArrayField
+    if 'triangle_colors' in meshData:
+        from .materials import color_mesh
+        meshData = color_mesh( meshData )
+    indexArray = meshData['triangles'].reshape((-1,))
+    pointArray = meshData['points']
+    pointFormat = point_format( meshData )
+    if 'text' in meshData:
+        # formatted by a worker process or taken from the cache
+        index = ArrayField( indexArray, [meshData['text']['index']] )
+        point = ArrayField( pointArray, [meshData['text']['point']], pointFormat )
+    else:
+        index = ArrayField( indexArray,
+                    report.timed_chunks( 'field_format', MFInt_chunks( indexArray )))
+        point = ArrayField( pointArray,
+                    report.timed_chunks( 'field_format',
+                        MFVec_chunks( pointArray, *pointFormat )), pointFormat )
+    colorAttributes = list()
+    if 'colors' in meshData:
+        colorAttributes.append( ('colorPerVertex',
+                                 'true' if meshData['color_per_vertex'] else 'false') )
+    builder.start("IndexedTriangleSet", geometry + [
+        ('ccw','true'),
+        ('solid','true')] + colorAttributes + [
+        ('index', index)])
+    builder.start("Coordinate", [('point', point)])
+    builder.end("Coordinate")
+    if 'colors' in meshData:
+        # the colors are written as text by every serializer
+        colors = meshData['colors']
+        node = "ColorRGBA" if (colors[:,3] < 255).any() else "Color"
+        values = colors if node == "ColorRGBA" else colors[:,:3]
+        color = report.timed_chunks( 'field_format',
+                    _format_chunks( values.reshape((-1,)) / 255.0, "%.3f" ))
+        builder.start(node, [('color', color)])
+        builder.end(node)
+    if 'normals' in meshData:
+        normalArray = meshData['normals']
+        vector = ArrayField( normalArray,
+                    report.timed_chunks( 'field_format', MFVec_chunks( normalArray )),
+                    ("%f", False) )
+        builder.start("Normal", [('vector', vector)])
+        builder.end("Normal")
+    builder.end("IndexedTriangleSet")
+
+
+def transform_field_attributes( transformData ):
+    """
+    transformData a dictionary as returned from
+    matrix.transform_attributes_from_matrix
+
+    returns the list of (name, value) attributes of the X3D Transform node
+    """
+    retVal = list()
+    for name in ('translation', 'rotation', 'scale', 'scaleOrientation'):
+        if name in transformData:
+            retVal.append( (name, SFVec( transformData[name] )) )
+    return retVal
+
+
+def placed_objects( builds ):
+    """
+    builds a sequence of (itemNode, transformData, objectRecord) as
+    returned from layout_build
+
+    returns the list of the distinct object records placed by the build
+    items and, to any depth, by the components of the objects they place
+    """
+    placed = list()
+    placed_ids = set()
+    pending = [objectRecord for itemNode, transformData, objectRecord in builds]
+    while pending:
+        objectRecord = pending.pop()
+        if objectRecord['id'] not in placed_ids:
+            placed_ids.add( objectRecord['id'] )
+            placed.append( objectRecord )
+            if objectRecord['mesh'] is None:
+                pending.extend( [childRecord for M, transformData, childRecord
+                                 in objectRecord['children']] )
+    return placed
+
+
+def object_writer(builder, placed, params, report = null_report, external = None):
+    """
+    returns a callable write_object(objectRecord) delivering to builder
+    the X3D node of a resource object: a Shape for a mesh object, an LOD
+    for a mesh object with the 'lod' entry added by lod_model, a Group for
+    an object built from components, or an Inline for an object written
+    to a separate document. The node is DEF'd when the object is first
+    written and USE'd when written again. The IndexedTriangleSet of a mesh,
+    and of each of its simplified levels, is DEF'd and USE'd by the objects
+    with identical meshes if params['share_geometry'] is True
+
+    placed the list of the objects which may be written, as returned from
+    placed_objects; used to find the objects with identical meshes
+    params the dictionary of convert_to_X3D parameters
+    report an instrument.ConversionReport, passed to write_geometry
+    external optional dictionary mapping the ids of objects written to
+    separate documents to the URL of each document; see inline.py
+    """
+    from . import logger
+    from .mesh import mesh_fingerprint
+
+    external = external or dict()
+
+    # identify the distinct resource objects whose meshes are identical;
+    # these share a single DEF'd IndexedTriangleSet
+    fingerprints = dict()   # object id -> mesh fingerprint
+    fingerprint_count = dict()
+    if params['share_geometry']:
+        for objectRecord in placed:
+            if objectRecord['mesh'] is not None and objectRecord['id'] not in external:
+                fp = mesh_fingerprint( objectRecord['mesh'] )
+                fingerprints[objectRecord['id']] = fp
+                fingerprint_count[fp] = fingerprint_count.get(fp, 0) + 1
+
+    objects_defid = set()   # X3D names of the object nodes already defined
+    geometry_defid = dict() # mesh fingerprint, or (mesh fingerprint, level)
+                            # for a simplified level of the mesh -> X3D name
+                            # of the IndexedTriangleSet defined for that mesh
+
+    materials_defid = dict()    # RGBA color of an object, or None for the color
+                                # parameter -> X3D name of the Material defined for it
+
+    def write_material( objectRecord ):
+        if not params['materials']:
+            builder.start('Material', [('diffuseColor', SFColor( params['color'] ))])
+            builder.end('Material')
+            return
+        color = objectRecord.get('color')
+        key = tuple( color ) if color is not None else None
+        if key in materials_defid:
+            builder.start('Material', [('USE', materials_defid[key])])
+            builder.end('Material')
+            return
+        materials_defid[key] = "material_x3d_%i" % len(materials_defid)
+        attributes = [('DEF', materials_defid[key])]
+        if color is None:
+            attributes.append( ('diffuseColor', SFColor( params['color'] )) )
+        else:
+            attributes.append( ('diffuseColor', SFColor( color[:3] / 255.0 )) )
+            if color[3] < 255:
+                attributes.append( ('transparency', "%.3f" % (1.0 - color[3] / 255.0)) )
+        builder.start('Material', attributes)
+        builder.end('Material')
+
+    def write_appearance( attributes, objectRecord ):
+        builder.start("Appearance", attributes)
+        if not attributes or attributes[0][0] != 'USE':
+            write_material( objectRecord )
+        builder.end("Appearance")
+
+    def write_mesh_geometry( objectRecord, object_id_x3d, level = None ):
+        fp = fingerprints.get( objectRecord['id'] )
+        key = fp if level is None else (fp, level)
+        if key in geometry_defid:
+            logger.debug("resource object %s reuses geometry %s" % \
+                         (object_id_x3d, geometry_defid[key]))
+            builder.start("IndexedTriangleSet", [('USE', geometry_defid[key])])
+            builder.end("IndexedTriangleSet")
+            return
+        geometry = list()
+        if fingerprint_count.get(fp, 0) > 1:
+            if level is None:
+                geometry_defid[key] = "geometry_x3d_%s" % objectRecord['id']
+            else:
+                geometry_defid[key] = "geometry_x3d_%s_%i" % (objectRecord['id'], level + 1)
+            geometry.append( ('DEF', geometry_defid[key]) )
+        if level is None:
+            meshData = objectRecord['mesh']
+        else:
+            meshData = objectRecord['lod']['levels'][level]
+        write_geometry( builder, meshData, geometry, report )
+
+    def write_object( objectRecord ):
+        object_id_x3d = "object_x3d_%s" % objectRecord['id']
+        lod = objectRecord.get('lod')
+        if objectRecord['id'] in external:
+            node = "Inline"
+        elif objectRecord['mesh'] is None:
+            node = "Group"
+        elif lod is not None:
+            node = "LOD"
+        else:
+            node = "Shape"
+        if object_id_x3d in objects_defid:
+            builder.start(node, [('USE', object_id_x3d)])
+            builder.end(node)
+            logger.debug("Reusing resource object %s" % object_id_x3d)
+            return
+
+        objects_defid.add( object_id_x3d )
+        logger.debug("defining %s for resource object %s" % (node.lower(), object_id_x3d))
+        attributes = [('DEF', object_id_x3d)]
+        if node == "Inline":
+            # the metadata, geometry and appearance are in the inlined document
+            attributes.append( ('url', MFString([external[objectRecord['id']]])) )
+            builder.start(node, attributes)
+            builder.end(node)
+            return
+        if lod is not None:
+            attributes.extend( [('center', SFVec( lod['center'] )),
+                                ('range', MFFloat( lod['range'] ))] )
+        builder.start(node, attributes)
+
+        # add Metadata nodes derived from objectNode attributes
+        builder.start("MetadataSet", [("name", "3MF:resources/object")])
+        for attribName in ("type", "partnumber", "name"):
+            attribValue = objectRecord['attributes'].get(attribName, "")
+            builder.start("MetadataString", [
+                ("name", attribName),
+                ("value", MFString([attribValue])),
+                ("containerField", "value")])
+            builder.end("MetadataString")
+        builder.end("MetadataSet")
+
+        if objectRecord['mesh'] is None:
+            # place each component object, shared through DEF/USE
+            for M, transformData, childRecord in objectRecord['children']:
+                builder.start("Transform", transform_field_attributes( transformData ))
+                write_object( childRecord )
+                builder.end("Transform")
+        elif lod is not None:
+            # a Shape for the full mesh and for each simplified level,
+            # sharing one Appearance
+            appearance_id_x3d = "appearance_x3d_%s" % objectRecord['id']
+            builder.start("Shape")
+            write_mesh_geometry( objectRecord, object_id_x3d )
+            write_appearance( [('DEF', appearance_id_x3d)], objectRecord )
+            builder.end("Shape")
+            for level in range( len(lod['levels']) ):
+                builder.start("Shape")
+                write_mesh_geometry( objectRecord, object_id_x3d, level )
+                write_appearance( [('USE', appearance_id_x3d)], objectRecord )
+                builder.end("Shape")
+        else:
+            # add geometry and appearance
+            write_mesh_geometry( objectRecord, object_id_x3d )
+            write_appearance( [], objectRecord )
+        builder.end(node)
+
+
+    return write_object
+
+
+def write_model(builder, builds, params, report = null_report, external = None):
+    """
+    Delivers the Group node holding the X3D Transform and Shape
+    nodes for the 3MF build items to builder, an instance of one of
+    the serializers in the x3d_writer module
+
+    builds a sequence of (itemNode, transformData, objectRecord) for
+    each build item; where transformData is the dictionary returned
+    by matrix.transform_attributes_from_matrix and objectRecord is
+    the resource object as returned from reader.iter_3MF_model.
+    An object built from components, with the 'children' entry added
+    by components.ComponentResolver, is written as a Group holding a
+    Transform for each component
+
+    params the dictionary of convert_to_X3D parameters
+    report an instrument.ConversionReport, passed to write_geometry
+    external optional dictionary of the objects written as Inline nodes;
+    see object_writer
+    """
+    write_object = object_writer( builder, placed_objects( builds ), params,
+                                  report, external )
+
+    builder.start("Group")
+    for itemNode, transformData, objectRecord in builds:
+        builder.start("Transform", transform_field_attributes( transformData ))
+
+        # add Metadata nodes pertinent to this 3MF build/item
+        builder.start("MetadataSet", [("name","3MF:build/item")])
+        itemPartnumber = itemNode.get("partnumber","")
+        builder.start("MetadataString", [
+            ("containerField", 'value'),
+            ("name", 'partnumber'),
+            ("value", MFString([itemPartnumber]))])
+        builder.end("MetadataString")
+        builder.end("MetadataSet")
+
+        write_object( objectRecord )
+        builder.end("Transform")
+    builder.end("Group")
@@ -0,0 +1,115 @@
+"""
+Externalization of the large meshes of a model into separate X3D documents
+
+Each resource object placed by the build whose mesh has more triangles than
+a threshold is written to a document of its own, whose scene holds only the
+node of that object (see file_conversions.write_object_X3D). The main document
+references the object through an Inline node, DEF'd where the object is first
+placed and USE'd elsewhere, so that it stays small and a viewer can show the
+scene before the geometry has been loaded; the geometry documents can be
+cached and served independently of the scene.
+
+The documents may be written on a pool of worker processes; the object
+records are sent to the workers as they are, with their decoded arrays.
+"""
+
+def inline_document_name( objectRecord, params ):
+    """
+    returns the file name of the document of objectRecord
+    """
+    from .file_conversions import output_extension
+    return "object_%s%s" % (objectRecord['id'], output_extension( params ))
+
+
+def write_inline_document( task, report = None ):
+    """
+    task a 4-tuple (path, unit, objectRecord, params)
+    report optional instrument.ConversionReport passed to write_object_X3D
+
+    writes the document of objectRecord to path; the document is written
+    to a temporary file which is renamed to path when complete
+
+    returns path
+    """
+    import os
+    from .file_conversions import write_object_X3D
+    from .instrument import null_report
+
+    path, unit, objectRecord, params = task
+    partial_path = path + ".part"
+    with open(partial_path, "wb") as output_stream:
+        write_object_X3D( output_stream, unit, objectRecord, params,
+                          report or null_report )
+    os.rename( partial_path, path )
+    return path
+
+
+def write_inline_documents( model, builds, params, report = None ):
+    """
+    Writes the document of each object placed by builds whose mesh has
+    more than params['inline_triangles'] triangles into the directory
+    params['inline_dir'], creating the directory if needed. If
+    params['inline_workers'] is greater than 1 the documents are written
+    on that number of processes
+
+    model a dictionary as returned from read_model
+    builds as returned from layout_build
+    params the dictionary of convert_to_X3D parameters
+    report optional instrument.ConversionReport timing the formatting
+        of the documents written in this process; the number of documents
+        is added to its 'inline_documents' count
+
+    returns a dictionary mapping the id of each object written to the URL
+    of its document: the file name appended to params['inline_url'], or
+    to params['inline_dir'] if inline_url is None
+    """
+    import os
+    from . import logger
+    from .file_conversions import placed_objects
+    from .instrument import null_report
+
+    report = report or null_report
+    directory = params['inline_dir']
+    if directory is None:
+        raise ValueError("inline_dir is required with inline_triangles")
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    prefix = params['inline_url']
+    if prefix is None:
+        prefix = directory.replace( os.sep, "/" )
+
+    objects = [objectRecord for objectRecord in placed_objects( builds )
+               if objectRecord['mesh'] is not None and
+               len( objectRecord['mesh']['triangles'] ) > params['inline_triangles']]
+
+    retVal = dict()
+    tasks = list()
+    for objectRecord in objects:
+        name = inline_document_name( objectRecord, params )
+        url = prefix.rstrip("/") + "/" + name if prefix else name
+        if not isinstance(url, unicode):
+            url = url.decode("utf-8")
+        retVal[objectRecord['id']] = url
+        tasks.append( (os.path.join(directory, name), model['unit'], objectRecord, params) )
+
+    workers = params['inline_workers']
+    if workers is not None and workers > 1 and len(tasks) > 1:
+        from multiprocessing import Pool
+        pool = Pool( processes = min( workers, len(tasks) ))
+        try:
+            for path in pool.imap_unordered( write_inline_document, tasks ):
+                logger.debug("wrote inline document %s" % path)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        for task in tasks:
+            path = write_inline_document( task, report )
+            logger.debug("wrote inline document %s" % path)
+
+    report.count( 'inline_documents', len(tasks) )
+    logger.info("%i objects written to inline documents in %s" % (len(tasks), directory))
+    return retVal
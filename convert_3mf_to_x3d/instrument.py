@@ -0,0 +1,143 @@
+"""
+Opt-in instrumentation of the stages of a conversion
+
+A ConversionReport records, for each named stage, the elapsed time, the
+number of times the stage was entered and the peak memory use of the
+process at the end of the stage; along with counts such as that of the
+XML elements of the document, and the XML element, vertex and triangle
+counts of each resource object. Stages may nest; the
+time recorded for a stage excludes the time of the stages nested within it.
+
+The conversion functions accept a report argument, which defaults to
+null_report; an instance of NullReport, which records nothing.
+"""
+
+def _peak_rss_kb():
+    """
+    peak resident set size of this process in kilobytes, or None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if sys.platform == 'darwin':    # reported in bytes
+        peak = peak // 1024
+    return peak
+
+
+class _Stage(object):
+    """
+    context manager timing one entry into a stage of a ConversionReport
+    """
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        import time
+        self.nested = 0.0
+        self.report.active.append( self )
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        import time
+        elapsed = time.time() - self.start
+        self.report.active.pop()
+        if self.report.active:
+            self.report.active[-1].nested += elapsed
+        self.report.record( self.name, elapsed - self.nested )
+        return False
+
+
+class ConversionReport(object):
+    def __init__(self):
+        self.stages = dict()    # stage name -> dictionary of measurements
+        self.order = list()     # stage names in order of first entry
+        self.active = list()    # _Stage instances currently entered
+        self.objects = list()
+        self.counts = dict()
+
+    def stage(self, name):
+        """
+        returns a context manager timing the enclosed code as stage name
+        """
+        return _Stage( self, name )
+
+    def record(self, name, seconds):
+        if name not in self.stages:
+            self.stages[name] = {'seconds' : 0.0, 'calls' : 0}
+            self.order.append( name )
+        data = self.stages[name]
+        data['seconds'] += seconds
+        data['calls'] += 1
+        peak = _peak_rss_kb()
+        if peak is not None:
+            data['peak_rss_kb'] = max( peak, data.get('peak_rss_kb', 0) )
+
+    def timed_chunks(self, name, chunks):
+        """
+        generator yielding the items of the iterable chunks, timing
+        the production of each item as stage name
+        """
+        iterator = iter(chunks)
+        while True:
+            with self.stage(name):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    def count(self, name, n = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_object(self, objectid, elements, vertices, triangles):
+        self.objects.append( {
+            'id' : objectid,
+            'xml_elements' : elements,
+            'vertices' : vertices,
+            'triangles' : triangles
+        })
+
+    def as_dict(self):
+        """
+        returns the report as a dictionary of JSON-serializable values
+        """
+        return {
+            'stages' : [dict( self.stages[name], name=name) for name in self.order],
+            'counts' : dict( self.counts ),
+            'objects' : list( self.objects )
+        }
+
+
+class NullReport(object):
+    """
+    A report recording nothing, with the interface of ConversionReport
+    """
+    class _NullStage(object):
+        def __enter__(self):
+            return self
+        def __exit__(self, exc_type, exc_value, traceback):
+            return False
+
+    _null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def timed_chunks(self, name, chunks):
+        return chunks
+
+    def count(self, name, n = 1):
+        pass
+
+    def add_object(self, objectid, elements, vertices, triangles):
+        pass
+
+    def as_dict(self):
+        return None
+
+null_report = NullReport()
@@ -0,0 +1,173 @@
+"""
+Translation of 3MF material and color properties into X3D colors
+(Core spec 1.1 Section 4.1.5, Materials and Properties Extension 1.0)
+
+A triangle takes its color from a property group, a resources/basematerials
+element (the displaycolor of each base) or an m:colorgroup element (the color
+of each m:color), identified by the triangle pid attribute, or else by the
+pid attribute of its object. The index of the property in the group is
+given for each corner by the p1, p2, p3 attributes, or else by the pindex
+attribute of the object; p2 and p3 default to p1.
+
+The pid, p1, p2, p3 attributes are read in bulk with the mesh (see
+mesh.get_3MF_mesh) and resolved against a single table of the colors of all
+the property groups by array indexing. An object all of one color is written
+with a Material of that color, shared by DEF/USE among the objects of the
+same color; otherwise the IndexedTriangleSet is given a Color node, with a
+color for each triangle if its corners have the same color, and else with
+a color for each vertex, vertices being split where their corners differ.
+"""
+
+# namespace of the m:colorgroup element of the Materials extension
+MATERIALS_NAMESPACE = "http://schemas.microsoft.com/3dmanufacturing/material/2015/02"
+
+def parse_colors( colors ):
+    """
+    colors a sequence of sRGB color strings of the form #RRGGBB or #RRGGBBAA
+
+    returns a (N,4) uint8 array of the RGBA components;
+    raises ValueError on a malformed color
+    """
+    from numpy import array, uint8
+    retVal = list()
+    for color in colors:
+        if color is None or len(color) not in (7, 9) or color[0] != "#":
+            raise ValueError("invalid 3MF color: %r" % (color,))
+        try:
+            retVal.append( [int( (color + "FF")[i:i+2], 16 ) for i in (1,3,5,7)] )
+        except ValueError:
+            raise ValueError("invalid 3MF color: %r" % (color,))
+    return array( retVal, uint8 ).reshape((-1,4))
+
+
+class PropertyTable(object):
+    """
+    groups a dictionary mapping the id of each property group
+        to the (N,4) uint8 array of the colors of its properties, or to
+        None for a group whose properties are not translated (textures,
+        composite materials and multiproperties)
+    default the RGBA color of the triangles without a property, and of
+        the triangles referencing a group which is not translated
+
+    The colors of all the groups are held in one array, the default color
+    last, and a pid, index pair is resolved to the row offset of pid + index
+    """
+    def __init__(self, groups, default):
+        from numpy import concatenate, array, uint8, int64, cumsum
+        self.unsupported = array( [int(groupid) for groupid in groups
+                                   if groups[groupid] is None], int64 )
+        ids = sorted( [groupid for groupid in groups if groups[groupid] is not None],
+                      key=int )
+        self.ids = array( [int(groupid) for groupid in ids], int64 )
+        self.sizes = array( [len( groups[groupid] ) for groupid in ids], int64 )
+        self.offsets = cumsum( self.sizes ) - self.sizes
+        self.colors = concatenate( [groups[groupid] for groupid in ids] +
+                                   [array( [default], uint8 )] )
+        self.default_row = self.sizes.sum()
+
+    def triangle_colors( self, meshData, attributes ):
+        """
+        meshData a dictionary as returned from mesh.get_3MF_mesh with
+            properties=True
+        attributes the attribute dictionary of the object element
+
+        returns a (K,3,4) uint8 array of the color of each triangle corner,
+        or None if neither the object nor any triangle has a pid
+
+        raises ValueError on a pid which is not the id of a property
+        group, or an index out of the range of its group; a warning is
+        logged for the triangles referencing a group which is not
+        translated, which are given the default color
+        """
+        from numpy import where, empty, int64, searchsorted, full, ones, in1d
+
+        objectPid = attributes.get('pid')
+        properties = meshData.get('properties')
+        if properties is None:
+            if objectPid is None:
+                return None
+            properties = empty( (len( meshData['triangles'] ),4), int64 )
+            properties.fill( -1 )
+        objectPid = -1 if objectPid is None else int( objectPid )
+        objectIndex = int( attributes.get('pindex', 0) )
+
+        pid = where( properties[:,0] < 0, objectPid, properties[:,0] )
+        untranslated = in1d( pid, self.unsupported )
+        if untranslated.any():
+            from . import logger
+            groupids = ", ".join( ["%i" % groupid for groupid in sorted( set( pid[untranslated] ))] )
+            logger.warn("object id %s: %i triangles given the default color, property groups "
+                        "%s are not translated" % (attributes.get('id'), untranslated.sum(), groupids))
+            pid = where( untranslated, -1, pid )
+        p1 = where( properties[:,1] < 0, objectIndex, properties[:,1] )
+        p2 = where( properties[:,2] < 0, p1, properties[:,2] )
+        p3 = where( properties[:,3] < 0, p1, properties[:,3] )
+
+        # the position of the group of each triangle in ids
+        position = searchsorted( self.ids, pid ).clip( 0, max( len(self.ids) - 1, 0 ))
+        missing = pid < 0
+        found = missing.copy()
+        if len(self.ids):
+            found |= self.ids[position] == pid
+        if not found.all():
+            raise ValueError("property group not found for pid: %i" % pid[~found][0])
+        offset = full( pid.shape, self.default_row, int64 )
+        size = ones( pid.shape, int64 )
+        if len(self.ids):
+            offset = where( missing, offset, self.offsets[position] )
+            size = where( missing, size, self.sizes[position] )
+
+        retVal = empty( (len(pid),3,4), self.colors.dtype )
+        for corner, index in enumerate( (p1, p2, p3) ):
+            index = where( missing, 0, index )
+            if len(index) and (index.min() < 0 or (index >= size).any()):
+                raise ValueError("property index out of range of its group")
+            retVal[:,corner] = self.colors[ offset + index ]
+        return retVal
+
+
+def color_mesh( meshData ):
+    """
+    meshData a mesh dictionary with the entry triangle_colors, the (K,3,4)
+    uint8 array of the colors of the triangle corners
+
+    returns a new mesh dictionary with the entries
+    colors : (M,4) uint8 array of RGBA colors
+    color_per_vertex : False if colors holds the color of each triangle,
+        True if it holds the color of each point; in that case the points
+        at which triangles of different colors meet are split, together
+        with their normals
+    """
+    from numpy import column_stack
+    from .mesh import _merge_rows, _index_type
+
+    triangleColors = meshData['triangle_colors']
+    retVal = dict( meshData )
+    del retVal['triangle_colors']
+    if (triangleColors == triangleColors[:,:1]).all():
+        retVal['colors'] = triangleColors[:,0]
+        retVal['color_per_vertex'] = False
+        return retVal
+
+    vertex = meshData['triangles'].reshape((-1,))
+    cornerColors = triangleColors.reshape((-1,4))
+    first, renumber = _merge_rows( column_stack( (vertex, cornerColors) ))
+    retVal.pop( 'text', None )
+    retVal['points'] = meshData['points'][ vertex[first] ]
+    if 'normals' in meshData:
+        retVal['normals'] = meshData['normals'][ vertex[first] ]
+    retVal['triangles'] = renumber.reshape((-1,3)).astype(
+                                _index_type( meshData['triangles'].dtype, len(first) ))
+    retVal['colors'] = cornerColors[first]
+    retVal['color_per_vertex'] = True
+    return retVal
+
+
+def uniform_color( triangleColors ):
+    """
+    returns the (4,) RGBA color of all the corners
+    of triangleColors, or None if they differ
+    """
+    if len(triangleColors) and (triangleColors == triangleColors[0,0]).all():
+        return triangleColors[0,0]
+    return None
@@ -58,6 +58,21 @@ def transform_points(M, points):
     
     return transformed_affine_points[:,0:3]
     
+def compose_matrices(A, B):
+    """
+    A, B (4,3) arrays interpreted as 3MF matrices
+
+    returns the (4,3) 3MF matrix of the transform applying A and then B;
+    so that transform_points(compose_matrices(A,B), points) equals
+    transform_points(B, transform_points(A, points))
+    """
+    assert( A.shape == (4,3) and B.shape == (4,3))
+    from numpy import empty, float_, dot
+    retVal = empty( (4,3), float_)
+    retVal[:3] = dot( A[:3], B[:3] )
+    retVal[3] = dot( A[3], B[:3] ) + B[3]
+    return retVal
+
 def transform_one_point(M, point):
     """
     convenience wrapper for point just (3,) coordinates
@@ -67,50 +82,179 @@ def transform_one_point(M, point):
     points = array( (point,))
     return transform_points(M,points)[0]
 
+def _axis_angle_from_rotations( R ):
+    """
+    R a (N,3,3) array of proper rotation matrices, acting on column vectors
+
+    returns a (N,4) array of X3D SFRotation values: a unit axis
+    followed by an angle in the range [0,pi]
+
+    Each matrix is converted to a quaternion by the method of Shepperd,
+    which forms the quaternion from the largest of its four pivots so
+    that angles near pi are as well conditioned as small angles
+    """
+    from numpy import empty, sqrt, arctan2, float_, arange, column_stack
+
+    N = R.shape[0]
+    diag = R[:, (0,1,2), (0,1,2)]
+    trace = diag.sum(axis=1)
+    pivots = empty( (N,4), float_)
+    pivots[:,0] = 1.0 + trace
+    pivots[:,1:] = 1.0 + 2.0 * diag - trace[:,None]
+
+    skew_x = R[:,2,1] - R[:,1,2]
+    skew_y = R[:,0,2] - R[:,2,0]
+    skew_z = R[:,1,0] - R[:,0,1]
+    sym_xy = R[:,1,0] + R[:,0,1]
+    sym_xz = R[:,0,2] + R[:,2,0]
+    sym_yz = R[:,2,1] + R[:,1,2]
+
+    # candidates[:,k] is the quaternion (w,x,y,z) scaled by a positive
+    # factor, as computed from pivot k
+    candidates = empty( (N,4,4), float_)
+    candidates[:,0] = column_stack((pivots[:,0], skew_x, skew_y, skew_z))
+    candidates[:,1] = column_stack((skew_x, pivots[:,1], sym_xy, sym_xz))
+    candidates[:,2] = column_stack((skew_y, sym_xy, pivots[:,2], sym_yz))
+    candidates[:,3] = column_stack((skew_z, sym_xz, sym_yz, pivots[:,3]))
+    quaternion = candidates[ arange(N), pivots.argmax(axis=1) ]
+
+    # q and -q are the same rotation; w >= 0 gives an angle in [0,pi]
+    quaternion[ quaternion[:,0] < 0.0 ] *= -1.0
+
+    vector_norm = sqrt( (quaternion[:,1:]**2).sum(axis=1) )
+    retVal = empty( (N,4), float_)
+    retVal[:,0:3] = (0.0, 0.0, 1.0)
+    nonzero = vector_norm > 0.0
+    retVal[nonzero,0:3] = quaternion[nonzero,1:] / vector_norm[nonzero,None]
+    retVal[:,3] = 2.0 * arctan2( vector_norm, quaternion[:,0] )
+    return retVal
+
+
+def _nearest_scale_orientation( Q, scale ):
+    """
+    Q a (N,3,3) array of orthogonal matrices, scale a (N,3) array
+
+    returns (Q, scale) with the columns of Q, and the entries of scale,
+    permuted and the columns of Q negated so that each Q is a proper
+    rotation as close to the identity as the permutations allow; the
+    products Q diag(scale) Q' are unchanged. An axis-aligned scale then
+    needs no scaleOrientation
+    """
+    from numpy import array, abs, arange, where
+    from numpy.linalg import det
+    from itertools import permutations
+
+    N = Q.shape[0]
+    orders = array( list( permutations( (0,1,2) )))
+    # scores[n,k] the sum of the diagonal magnitudes of Q[n] with
+    # its columns in order k
+    scores = abs(Q)[:, arange(3)[None,:], orders].sum(axis=2)
+    best = orders[ scores.argmax(axis=1) ]
+    rows = arange(N)[:,None]
+    Q = Q[ rows, :, best ].transpose((0,2,1))
+    scale = scale[ rows, best ]
+
+    diag = Q[:, (0,1,2), (0,1,2)]
+    Q = Q * where( diag < 0.0, -1.0, 1.0 )[:,None,:]
+    # a reflection remains if the determinant is negative;
+    # negate the column least aligned with its axis
+    flip = det(Q) < 0.0
+    weakest = abs(diag).argmin(axis=1)
+    Q[ flip, :, weakest[flip] ] *= -1.0
+    return Q, scale
+
+
+def transform_attributes_from_matrices( Ms ):
+    """
+    input Ms a (N,4,3) array, a stack of N 3MF matrices
+    returns a list of N dict objects whose entries are
+    fields of the X3D Transform node, as for transform_attributes_from_matrix
+
+    The linear part A of each matrix (acting on column vectors) is
+    factored by a singular value decomposition A = U S Vh as
+    A = (U Vh) (Vh' S Vh); the X3D rotation is U Vh and, if the
+    singular values differ, the X3D scale is S about the scaleOrientation
+    Vh'. A reflection (negative determinant) is carried by negating
+    a scale factor. All N matrices are decomposed in one vectorized step.
+    """
+    TOL = 1.0e-6
+    assert( len(Ms.shape) == 3 and Ms.shape[1:] == (4,3))
+    from numpy import float_, asarray, where, ones, identity, abs, matmul
+    from numpy.linalg import svd, det
+
+    Ms = asarray(Ms, float_)
+    N = Ms.shape[0]
+    if N == 0:
+        return list()
+    A = Ms[:,:3,:3].transpose((0,2,1))
+    U,S,Vh = svd( A )
+    sign = where( det(A) < 0.0, -1.0, 1.0 )
+
+    isotropic = S.ptp(axis=1) <= TOL * S.max(axis=1).clip(1.0, None)
+
+    # non-isotropic: A = (U D Vh) (Vh' D S Vh) where D = diag(1,1,sign)
+    # makes U D Vh a proper rotation
+    D = ones( (N,3), float_)
+    D[:,2] = sign
+    R = matmul( U * D[:,None,:], Vh )
+    scale = S * D
+    Q, scale = _nearest_scale_orientation( Vh.transpose((0,2,1)), scale )
+
+    # isotropic: A = R s, with s negative for a reflection
+    s = sign * S.mean(axis=1)
+    safe_s = where( s == 0.0, 1.0, s)
+    R[isotropic] = A[isotropic] / safe_s[isotropic,None,None]
+    R[isotropic & (s == 0.0)] = identity(3, float_)
+    scale[isotropic] = s[isotropic,None]
+
+    rotations = _axis_angle_from_rotations( R )
+    orientations = _axis_angle_from_rotations( Q )
+
+    retVal = list()
+    for k in range(N):
+        attributes = dict()
+        translation = Ms[k,3]
+        if (abs(translation) > 0.0).any():
+            attributes['translation'] = translation
+        if rotations[k,3] > TOL:
+            attributes['rotation'] = rotations[k]
+        if (abs(scale[k] - 1.0) > TOL).any():
+            attributes['scale'] = scale[k]
+        if not isotropic[k] and orientations[k,3] > TOL:
+            attributes['scaleOrientation'] = orientations[k]
+        retVal.append( attributes )
+    return retVal
+
+
 def transform_attributes_from_matrix( M ):
     """
     input M a (4,3) array interpreted as 3MF matrix
     returns a dict object whose entries are 
-    fields of the X3D Transform node
+    fields of the X3D Transform node: translation, rotation,
+    scale and scaleOrientation; each entry is omitted when
+    it is the default value of the field
     """
-    TOL = 1.0e-6
     assert( M.shape == (4,3))
-    retVal = dict()
-    
-    translation = M[3]
-    if (abs(translation) > 0.0).any():
-        retVal['translation'] = translation
-        
-    R = M[:3,:3].transpose()
-    from numpy.linalg import svd, det
-    from numpy import identity, float_, dot
-    from math import atan2
-    U,S,Vh = svd( R )
-    
-    scale_spread = S.ptp()
-    if scale_spread > TOL:
-        raise ValueError("non-isotropic scaling not implemented")
-    scale = S.mean()
-    R = R/scale
-    
-    if abs(scale-1.0) > TOL:
-        retVal['scale'] = array((scale,scale,scale), float_)
-    
-    U,S,Vh = svd(R-identity(3, float_))
-    Vh = Vh * det(Vh)
-    axis = Vh[2]
-    
-    K = dot(Vh, dot(R,Vh.transpose()))
-    theta = atan2(-K[0,1],K[0,0])
-    
-    if theta < 0.0:
-        theta = -theta
-        axis = -axis
-    
-    if abs(theta) > TOL:
-        retVal['rotation'] = array( list(axis) + [theta], float_)
-        
-    return retVal
+    return transform_attributes_from_matrices( M.reshape((1,4,3)) )[0]
+
+
+def decompose_transform_strings( strings ):
+    """
+    strings an iterable of 3MF transform attribute values; None stands
+    for an item without a transform attribute
+
+    returns a dictionary mapping each distinct value in strings to a tuple
+    (M, attributes); M the (4,3) 3MF matrix and attributes the dict returned
+    from transform_attributes_from_matrix. A plate repeating a few transforms
+    over many items is parsed and decomposed once per distinct transform
+    """
+    from numpy import array
+    distinct = list( set( strings ))
+    matrices = [identity_matrix if a is None else matrix_from_string(a) for a in distinct]
+    if not distinct:
+        return dict()
+    attributes = transform_attributes_from_matrices( array( matrices ))
+    return dict( zip( distinct, zip( matrices, attributes )))
     
     
 if __name__ == '__main__':
@@ -194,6 +338,74 @@ if __name__ == '__main__':
             self.assert_( len(rv) == 1 )
             t = rv['translation']
             self.assert_(self.nearly_equal_arrays( t, exact_t ))
+
+        def compose_attributes(self, rv):
+            """
+            returns the (3,3) matrix acting on column vectors of
+            the rotation, scale and scaleOrientation entries of rv
+            """
+            from numpy import identity, diag, dot, cos, sin, outer, array
+            def rotation_matrix(r):
+                axis, angle = r[:3], r[3]
+                K = array([(0,-axis[2],axis[1]),(axis[2],0,-axis[0]),(-axis[1],axis[0],0)])
+                return identity(3) + sin(angle) * K + (1.-cos(angle)) * dot(K,K)
+            R = rotation_matrix( rv['rotation'] ) if 'rotation' in rv else identity(3)
+            S = diag( rv['scale'] ) if 'scale' in rv else identity(3)
+            Q = rotation_matrix( rv['scaleOrientation'] ) if 'scaleOrientation' in rv else identity(3)
+            return dot(R, dot(Q, dot(S, Q.transpose())))
+
+        def test60(self):
+            "rotation and isotropic scale converted to X3D Transform"
+            M = CYCLIC_ROTATE.copy()
+            M[:3] *= 2.5
+            rv = transform_attributes_from_matrix( M )
+            self.assert_( set(rv) == set(['rotation', 'scale']))
+            self.assert_( self.nearly_equal_arrays( rv['scale'], array([2.5]*3)))
+            self.assert_( self.nearly_equal_arrays( self.compose_attributes(rv), M[:3].transpose()))
+
+        def test70(self):
+            "non-isotropic scale and reflection converted to X3D Transform"
+            from numpy import dot, diag
+            for scale in [(1.,2.,3.), (0.5,0.5,4.), (-1.,1.,1.), (2.,-3.,1.)]:
+                M = identity_matrix.copy()
+                M[:3] = dot( diag(scale), CYCLIC_ROTATE[:3] )
+                M[3] = (1.,2.,3.)
+                rv = transform_attributes_from_matrix( M )
+                self.assert_( self.nearly_equal_arrays( self.compose_attributes(rv), M[:3].transpose()))
+                self.assert_( self.nearly_equal_arrays( rv['translation'], M[3]))
+
+        def test80(self):
+            "rotations by angles near pi"
+            from numpy import array, cos, sin, identity, outer
+            from math import pi
+            axis = array((1.,-2.,2.))/3.
+            for angle in (pi, pi - 1.0e-9, 0.5):
+                R = cos(angle) * identity(3) + (1-cos(angle)) * outer(axis,axis) + \
+                    sin(angle) * array([(0,-axis[2],axis[1]),(axis[2],0,-axis[0]),(-axis[1],axis[0],0)])
+                M = identity_matrix.copy()
+                M[:3] = R.transpose()
+                rv = transform_attributes_from_matrix( M )
+                self.assert_( self.nearly_equal_arrays( self.compose_attributes(rv), R))
+
+        def test85(self):
+            "compose 3MF matrices"
+            from numpy import array, linspace
+            points = array([linspace(0.,1.,5), linspace(2.,-1.,5), linspace(3.,3.5,5)]).transpose()
+            M = compose_matrices( CYCLIC_ROTATE, TRANSLATE_Y )
+            self.assert_( self.nearly_equal_arrays( transform_points(M, points),
+                          transform_points(TRANSLATE_Y, transform_points(CYCLIC_ROTATE, points))))
+            M = compose_matrices( TRANSLATE_Y, CYCLIC_ROTATE )
+            self.assert_( self.nearly_equal_arrays( transform_points(M, points),
+                          transform_points(CYCLIC_ROTATE, transform_points(TRANSLATE_Y, points))))
+
+        def test90(self):
+            "batch decomposition by transform string"
+            strings = [CYCLIC_ROTATE_STRING, None, "1 0 0 0 1 0 0 0 1 0 2 0", CYCLIC_ROTATE_STRING]
+            rv = decompose_transform_strings( strings )
+            self.assert_( len(rv) == 3 )
+            self.assert_( rv[None][1] == dict() )
+            self.assert_( self.nearly_equal_arrays( rv["1 0 0 0 1 0 0 0 1 0 2 0"][0], TRANSLATE_Y))
+            self.assert_( set(rv[CYCLIC_ROTATE_STRING][1]) == set(['rotation']))
             
             
     suite = unittest.TestSuite()
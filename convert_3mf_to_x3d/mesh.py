@@ -1,40 +1,594 @@
 
 
-def get_3MF_mesh( meshNode, ns):
+# number of vertex or triangle elements whose attribute text is
+# joined and converted by numpy in a single step; bounds the size
+# of the temporary string built by _fill_array
+BATCH_SIZE = 65536
+
+def _fill_array(nodes, attribNames, out, default = None):
+    """
+    Converts the attribute values of a list of XML elements
+    into the rows of a preallocated array
+
+    nodes a list of ElementTree.Element instances, length N
+    attribNames a sequence of M attribute names
+    out an (N,M) array, filled in place; the dtype of out
+        determines whether the values are parsed as floats or integers
+    default optional text of the value of a missing attribute; if None
+        a missing attribute raises ValueError
+    """
+    from numpy import fromstring
+
+    M = len(attribNames)
+    for start in range(0, len(nodes), BATCH_SIZE):
+        batch = nodes[start:start+BATCH_SIZE]
+        try:
+            text = " ".join([node.get(an, default) for node in batch for an in attribNames])
+        except TypeError:
+            raise ValueError("%s element missing one of attributes %s" % \
+                             (batch[0].tag, ", ".join(attribNames)))
+        values = fromstring(text, dtype=out.dtype, sep=" ")
+        if values.shape[0] != len(batch) * M:
+            raise ValueError("non-numeric value in %s attributes %s" % \
+                             (batch[0].tag, ", ".join(attribNames)))
+        out[start:start+len(batch)] = values.reshape((-1,M))
+    return out
+
+def get_3MF_mesh( meshNode, ns, properties = False):
     """
     Extracts the vertex-triangle properties of an 3MF mesh element
     meshNode an ElementTree.Element instance
-    
+
     ns is a string->string callable object that converts a local-tag
     name to a namespace-qualified QName
-    
+
+    properties if True the pid, p1, p2, p3 attributes of the
+    triangles are extracted as well
+
     returns a dictionay with entries:
     points : (N,3) array of point coordinates
     triangles: (K,3) array of indices, each index  in range(N)
+    and, if properties is True and any triangle has one of the attributes
+    properties : (K,4) array of the pid, p1, p2, p3 values, -1 where absent;
+                 see materials.py
     """
-    from numpy import array, float_, int_
+    from numpy import empty, float64, int32, int64
     assert( meshNode.tag == ns('mesh') )
-    
+
     retVal = dict()
-    coordinates = list()
     vs = meshNode.find( ns('vertices'))
     if vs is None:
         raise ValueError("No vertices element found for mesh")
-    for pnode in vs.findall( ns('vertex')):
-        p = tuple([float( pnode.get(cn)) for cn in ('x','y','z')])
-        coordinates.append(p)
-    retVal['points'] = array( coordinates )
-    
-    indices = list()
+    vertexNodes = vs.findall( ns('vertex'))
+    points = empty( (len(vertexNodes),3), float64)
+    retVal['points'] = _fill_array( vertexNodes, ('x','y','z'), points)
+
     ts = meshNode.find( ns('triangles'))
     if ts is None:
         raise ValueError("Mesh triangles not found")
-        
-    for tnode in ts.findall( ns('triangle')):
-        t = tuple([int( tnode.get(jn)) for jn in ('v1','v2','v3')])
-        indices.append(t)
-    retVal['triangles'] = array(indices)
-    
+
+    triangleNodes = ts.findall( ns('triangle'))
+    triangles = empty( (len(triangleNodes),3), int32)
+    retVal['triangles'] = _fill_array( triangleNodes, ('v1','v2','v3'), triangles)
+
+    if properties:
+        values = empty( (len(triangleNodes),4), int64)
+        _fill_array( triangleNodes, ('pid','p1','p2','p3'), values, default="-1")
+        if (values >= 0).any():
+            retVal['properties'] = values
+
+    return retVal
+
+
+def mesh_fingerprint( meshData ):
+    """
+    meshData a dictionary as returned from get_3MF_mesh
+
+    returns a hex digest string identifying the geometry; meshes with
+    equal point, triangle and, if present, triangle color arrays have
+    equal fingerprints
+    """
+    from hashlib import sha1
+    from numpy import ascontiguousarray
+    h = sha1()
+    for name in ('points', 'triangles', 'triangle_colors'):
+        if name not in meshData:
+            continue
+        a = ascontiguousarray( meshData[name] )
+        h.update( "%s %s %r;" % (name, a.dtype.str, a.shape) )
+        h.update( a.data )
+    return h.hexdigest()
+
+
+def _merge_rows( keys ):
+    """
+    keys a (N,M) array
+
+    returns a 2-tuple (first, renumber); first the index of the first
+    occurrence of each distinct row of keys, in increasing order, and
+    renumber a (N,) array giving for each row the position in first
+    of its distinct row
+    """
+    from numpy import unique, argsort, empty, arange, intp
+    if len(keys) == 0:
+        return arange(0), arange(0)
+    distinct, first, inverse = unique( keys, axis=0, return_index=True,
+                                       return_inverse=True )
+    # keep the distinct rows in the order of their first occurrence
+    order = argsort( first )
+    rank = empty( (len(order),), intp )
+    rank[order] = arange( len(order) )
+    return first[order], rank[ inverse.reshape((-1,)) ]
+
+
+# the finest quantization step chosen by quantization_step for
+# precision 'auto', in meters, and relative to the extent of the mesh
+AUTO_STEP_METERS = 1.0e-6
+AUTO_STEP_RELATIVE = 1.0e-6
+
+def quantization_step( points, precision, conversionFactor ):
+    """
+    points a (N,3) array of coordinates in model units
+    precision the quantization step in model units, or 'auto'
+    conversionFactor the length of the model unit in meters
+
+    returns the quantization step; for 'auto' the power of ten
+    nearest below the larger of AUTO_STEP_METERS and AUTO_STEP_RELATIVE
+    times the extent of points
+    """
+    from math import log10, floor
+    if precision != 'auto':
+        step = float(precision)
+        if not step > 0.0:
+            raise ValueError("precision must be positive: %r" % (precision,))
+        return step
+    step = AUTO_STEP_METERS / conversionFactor
+    if len(points):
+        step = max( step, AUTO_STEP_RELATIVE * (points.max(axis=0) - points.min(axis=0)).max() )
+    return 10.0 ** floor( log10(step) )
+
+
+def step_decimals( step ):
+    """
+    returns the number of decimals with which the
+    multiples of step are written exactly (at most 15)
+    """
+    for decimals in range(16):
+        scaled = step * 10 ** decimals
+        if abs( scaled - round(scaled) ) <= 1.0e-9 * scaled:
+            return decimals
+    return 15
+
+
+def quantize_mesh( meshData, step, merge = False ):
+    """
+    meshData a dictionary as returned from get_3MF_mesh
+    step the quantization step
+    merge if True, vertices which are quantized to the same position
+          are replaced by one, and the triangle indices renumbered
+
+    returns a new mesh dictionary whose points are rounded to the nearest
+    multiples of step, with the additional entry
+    point_format : the % format writing the rounded coordinates exactly
+    """
+    from numpy import around
+
+    points = around( meshData['points'] / step ) * step
+    points += 0.0       # -0.0 becomes 0.0
+    triangles = meshData['triangles']
+    if merge:
+        first, renumber = _merge_rows( points )
+        points = points[first]
+        triangles = renumber.astype( triangles.dtype )[ triangles ]
+
+    retVal = dict( meshData )
+    retVal.pop( 'text', None )
+    retVal['points'] = points
+    retVal['triangles'] = triangles
+    retVal['point_format'] = "%%.%if" % step_decimals( step )
     return retVal
 
-    
+
+def clean_mesh( meshData, tolerance = 0.0 ):
+    """
+    meshData a dictionary as returned from get_3MF_mesh
+    tolerance vertices whose coordinates round to the same multiples of
+        tolerance are welded; if 0.0 only identical vertices are welded
+
+    returns a new mesh dictionary in which duplicate vertices are welded
+    into the first of them, triangles with repeated vertices or zero
+    area are removed, as are the triangles repeating an earlier triangle
+    with the same vertices in the same orientation, vertices used by no
+    triangle are removed and the
+    triangle indices are stored in the smallest unsigned integer type
+    holding them; the triangle_colors entry of materials.py, if present,
+    is kept for the remaining triangles
+
+    raises ValueError if a triangle index is not the index of a vertex
+    """
+    from numpy import around, cross
+
+    points = meshData['points']
+    triangles = meshData['triangles']
+    if len(triangles) and (triangles.min() < 0 or triangles.max() >= len(points)):
+        raise ValueError("triangle vertex index out of range 0..%i" % (len(points) - 1,))
+
+    keys = points if tolerance == 0.0 else around( points / tolerance )
+    first, renumber = _merge_rows( keys )
+    points = points[first]
+    triangles = renumber[ triangles ]
+
+    v1, v2, v3 = triangles[:,0], triangles[:,1], triangles[:,2]
+    keep = (v1 != v2) & (v2 != v3) & (v3 != v1)
+    normals = cross( points[v2] - points[v1], points[v3] - points[v1] )
+    keep &= (normals != 0.0).any(axis=1)
+    keep = keep.nonzero()[0]
+    keep = keep[ _distinct_triangles( triangles[keep] ) ]
+    triangles = triangles[keep]
+
+    points, triangles = _prune_vertices( points, triangles )
+
+    retVal = dict( meshData )
+    if 'triangle_colors' in meshData:
+        retVal['triangle_colors'] = meshData['triangle_colors'][keep]
+    retVal.pop( 'text', None )
+    retVal['points'] = points
+    retVal['triangles'] = triangles
+    return retVal
+
+
+def _distinct_triangles( triangles ):
+    """
+    returns the increasing indices of the triangles which do not repeat an
+    earlier triangle with the same vertices in the same orientation
+    """
+    from numpy import argmin, arange
+    # each triangle rotated to start at its lowest index, so that
+    # triangles repeated in the same orientation have equal rows
+    start = argmin( triangles, axis=1 )
+    rotation = (start[:,None] + arange(3)[None,:]) % 3
+    first, renumber = _merge_rows( triangles[ arange(len(triangles))[:,None], rotation ] )
+    return first
+
+
+def _index_type( dtype, count ):
+    """
+    returns dtype if it holds the indices of count vertices, and else
+    the smallest unsigned integer type holding them; a mesh whose
+    vertices are split keeps the index type of its triangles
+    unless the new vertex count overflows it
+    """
+    from numpy import iinfo, min_scalar_type
+    if count == 0 or iinfo( dtype ).max >= count - 1:
+        return dtype
+    return min_scalar_type( count - 1 )
+
+
+def _prune_vertices( points, triangles ):
+    """
+    returns the (points, triangles) arrays with the points used by no
+    triangle removed; the indices are stored in the smallest unsigned
+    integer type holding them
+    """
+    from numpy import zeros, bool_, cumsum, min_scalar_type, intp
+    used = zeros( (len(points),), bool_)
+    used[ triangles.reshape((-1,)) ] = True
+    renumber = cumsum( used, dtype=intp ) - 1
+    points = points[used]
+    indexType = min_scalar_type( max( len(points) - 1, 0 ))
+    return points, renumber[ triangles ].astype( indexType )
+
+
+def cluster_mesh( meshData, cell ):
+    """
+    Simplifies a mesh by vertex clustering: the vertices in each cube of
+    a grid of step cell are replaced by their mean; triangles collapsed
+    to a segment or point, and duplicates of another triangle with the
+    same vertices in the same orientation, are removed
+
+    meshData a dictionary as returned from get_3MF_mesh
+    returns a new dictionary with entries points and triangles, and
+    triangle_colors if meshData has that entry
+    """
+    from numpy import floor, bincount, empty, int64, arange, argmin, float64
+
+    points = meshData['points']
+    triangles = meshData['triangles']
+    colors = meshData.get('triangle_colors')
+    if len(triangles) == 0:
+        return { 'points' : points[:0], 'triangles' : triangles[:0] }
+
+    cells = floor( (points - points.min(axis=0)) / cell ).astype( int64 )
+    first, renumber = _merge_rows( cells )
+    counts = bincount( renumber, minlength=len(first) )
+    clustered = empty( (len(first),3), float64 )
+    for axis in range(3):
+        clustered[:,axis] = bincount( renumber, weights=points[:,axis],
+                                      minlength=len(first) ) / counts
+    triangles = renumber[ triangles ]
+
+    v1, v2, v3 = triangles[:,0], triangles[:,1], triangles[:,2]
+    keep = (v1 != v2) & (v2 != v3) & (v3 != v1)
+    triangles = triangles[keep]
+    # rotate each triangle to start at its lowest index, so that
+    # triangles repeated in the same orientation have equal rows
+    start = argmin( triangles, axis=1 )
+    rotation = (start[:,None] + arange(3)[None,:]) % 3
+    rows = arange(len(triangles))[:,None]
+    triangles = triangles[ rows, rotation ]
+    distinct, renumber = _merge_rows( triangles )
+    triangles = triangles[distinct]
+
+    points, triangles = _prune_vertices( clustered, triangles )
+    retVal = { 'points' : points, 'triangles' : triangles }
+    if colors is not None:
+        # the corner colors follow the rotation of their triangle
+        retVal['triangle_colors'] = colors[keep][ rows, rotation ][distinct]
+    return retVal
+
+
+def lod_meshes( meshData, levels, reduction ):
+    """
+    meshData a dictionary as returned from get_3MF_mesh
+    levels the largest number of simplified meshes
+    reduction the intended ratio of the triangle counts of successive meshes
+
+    returns a list of up to levels meshes as returned from cluster_mesh,
+    in order of decreasing triangle count. The grid step of each is chosen
+    so that, for a regularly triangulated surface, the number of triangles
+    is reduced by the factor reduction from the previous mesh; a level
+    which does not reduce the triangle count ends the list
+    """
+    from numpy import cross, sqrt
+
+    points = meshData['points']
+    triangles = meshData['triangles']
+    normals = cross( points[triangles[:,1]] - points[triangles[:,0]],
+                     points[triangles[:,2]] - points[triangles[:,0]] )
+    area = 0.5 * sqrt( (normals * normals).sum(axis=1) ).sum()
+
+    retVal = list()
+    count = len(triangles)
+    for level in range(1, levels + 1):
+        # a closed triangulated surface has about twice
+        # as many triangles as vertices
+        vertices = len(triangles) / (2.0 * reduction ** level)
+        if area <= 0.0 or vertices < 4:
+            break
+        simplified = cluster_mesh( meshData, sqrt( area / vertices ))
+        if not 0 < len(simplified['triangles']) < count:
+            break
+        retVal.append( simplified )
+        count = len(simplified['triangles'])
+    return retVal
+
+
+# number of triangle corners whose pairs with the other corners
+# at the same vertex are compared in a single step by vertex_normals
+CORNER_BATCH = 65536
+
+def _face_normals( points, triangles ):
+    """
+    returns the (K,3) array of the cross products of the triangle edges;
+    the length of each is twice the area of the triangle
+    """
+    from numpy import cross
+    p1 = points[triangles[:,0]]
+    return cross( points[triangles[:,1]] - p1, points[triangles[:,2]] - p1 )
+
+
+def _normalized( vectors ):
+    """
+    returns the rows of vectors scaled to unit length;
+    rows of zero length are replaced by (0,0,1)
+    """
+    from numpy import sqrt
+    length = sqrt( (vectors * vectors).sum(axis=1) )
+    zero = length == 0.0
+    length[zero] = 1.0
+    retVal = vectors / length[:,None]
+    retVal[zero] = (0.0, 0.0, 1.0)
+    return retVal
+
+
+def vertex_normals( meshData, creaseAngle = None ):
+    """
+    Computes unit normal vectors at the vertices of a mesh as the area
+    weighted mean of the normals of the triangles meeting at each vertex
+
+    meshData a dictionary as returned from get_3MF_mesh
+    creaseAngle optional angle in radians; the normal at a triangle corner
+        is then the mean over those triangles at the vertex whose normal
+        is within creaseAngle of the normal of the corner's triangle.
+        A vertex whose corners so receive different normals is split into
+        one vertex for each distinct normal
+
+    returns a new mesh dictionary with the additional entry
+    normals : (N,3) array, the unit normal at each point
+    Without creaseAngle the points and triangles are those of meshData
+    """
+    from numpy import bincount, empty, float64, argsort, arange, repeat, \
+                      cumsum, cos, around, column_stack
+
+    points = meshData['points']
+    triangles = meshData['triangles']
+    faces = _face_normals( points, triangles )
+
+    retVal = dict( meshData )
+    if creaseAngle is None:
+        corners = triangles.reshape((-1,))
+        sums = empty( (len(points),3), float64 )
+        for axis in range(3):
+            sums[:,axis] = bincount( corners, weights=repeat( faces[:,axis], 3 ),
+                                     minlength=len(points) )
+        retVal['normals'] = _normalized( sums )
+        return retVal
+
+    # the corners sorted by vertex; the corners at one vertex
+    # are the range group_start, group_start + degree
+    vertex = triangles.reshape((-1,))
+    face = repeat( arange(len(triangles)), 3 )
+    order = argsort( vertex, kind='mergesort' )
+    degree = bincount( vertex, minlength=len(points) )
+    group_start = (cumsum( degree ) - degree)[ vertex[order] ]
+    corner_degree = degree[ vertex[order] ]
+
+    # the normal unit vectors of the triangles, compared to the crease angle
+    units = _normalized( faces )
+    threshold = cos( creaseAngle )
+    sums = empty( (len(vertex),3), float64 )
+    for start in range(0, len(vertex), CORNER_BATCH):
+        stop = min( start + CORNER_BATCH, len(vertex) )
+        count = corner_degree[start:stop]
+        # one row for each pair of a corner in the batch
+        # with a corner at the same vertex
+        local = repeat( arange(stop - start), count )
+        offset = arange( count.sum() ) - repeat( cumsum(count) - count, count )
+        partner = order[ group_start[start:stop][local] + offset ]
+        own = face[ order[start:stop] ][local]
+        other = face[ partner ]
+        smooth = (units[own] * units[other]).sum(axis=1) >= threshold
+        for axis in range(3):
+            sums[start:stop, axis] = bincount( local[smooth],
+                                               weights=faces[other[smooth], axis],
+                                               minlength=stop - start )
+    cornerNormals = empty( (len(vertex),3), float64 )
+    cornerNormals[order] = _normalized( sums )
+
+    # corners at one vertex with equal normals share a vertex
+    keys = column_stack( (vertex, around( cornerNormals, 9 )) )
+    first, renumber = _merge_rows( keys )
+    retVal.pop( 'text', None )
+    retVal['points'] = points[ vertex[first] ]
+    retVal['normals'] = cornerNormals[first]
+    retVal['triangles'] = renumber.reshape((-1,3)).astype(
+                                _index_type( triangles.dtype, len(first) ))
+    return retVal
+
+
+if __name__ == '__main__':
+    from numpy import array, float_, int32, uint8, uint16, arange, zeros
+
+    # two triangles of a unit square, with the vertices of the shared
+    # edge given once for each triangle
+    SQUARE_POINTS = array( [(0,0,0),(1,0,0),(1,1,0),(0,0,0),(1,1,0),(0,1,0)], float_ )
+    SQUARE_TRIANGLES = array( [(0,1,2),(3,4,5)], int32 )
+
+    def grid_mesh( n, height = None ):
+        """
+        returns the points and triangles of an n by n grid of vertices
+        in the plane z = 0, or with z given by height(i, j)
+        """
+        points = zeros( (n*n,3), float_ )
+        i, j = arange(n*n) // n, arange(n*n) % n
+        points[:,0], points[:,1] = i, j
+        if height is not None:
+            points[:,2] = height( i, j )
+        corner = (arange(n-1)[:,None] * n + arange(n-1)[None,:]).reshape((-1,))
+        triangles = zeros( (2*len(corner),3), int32 )
+        triangles[0::2] = array( [corner, corner + n, corner + n + 1] ).transpose()
+        triangles[1::2] = array( [corner, corner + n + 1, corner + 1] ).transpose()
+        return points, triangles
+
+    import unittest
+
+    class TestCase(unittest.TestCase):
+        NEARLY_EQUAL_TOLERANCE = 1.0e-8
+
+        def nearly_equal_arrays(self, a,b):
+            return (a.shape == b.shape) and (abs(a-b) < self.NEARLY_EQUAL_TOLERANCE).all()
+
+        def same_triangles(self, mesh, points, triangles):
+            """
+            true if the triangles of mesh have the vertex coordinates
+            of the triangles of points, triangles
+            """
+            return self.nearly_equal_arrays( mesh['points'][ mesh['triangles'].astype(int) ],
+                                             points[triangles] )
+
+        def __str__(self):
+            return self._testMethodDoc
+
+        def test10(self):
+            "cleanup welds identical vertices"
+            mesh = clean_mesh( {'points' : SQUARE_POINTS, 'triangles' : SQUARE_TRIANGLES} )
+            self.assert_( len(mesh['points']) == 4 )
+            self.assert_( (mesh['triangles'] == array( [(0,1,2),(0,2,3)] )).all() )
+            self.assert_( self.same_triangles( mesh, SQUARE_POINTS, SQUARE_TRIANGLES ))
+
+        def test15(self):
+            "cleanup welds vertices within the weld tolerance"
+            points = SQUARE_POINTS.copy()
+            points[3:5] += 1.0e-4
+            mesh = clean_mesh( {'points' : points, 'triangles' : SQUARE_TRIANGLES} )
+            self.assert_( len(mesh['points']) == 6 )
+            mesh = clean_mesh( {'points' : points, 'triangles' : SQUARE_TRIANGLES}, 0.01 )
+            self.assert_( len(mesh['points']) == 4 )
+            self.assert_( (mesh['triangles'] == array( [(0,1,2),(0,2,3)] )).all() )
+
+        def test20(self):
+            "cleanup removes degenerate and duplicate triangles and unused vertices"
+            points = array( [(0,0,0),(1,0,0),(1,1,0),(0,1,0),(2,0,0),(5,5,5)], float_ )
+            triangles = array( [(0,1,2),
+                                (0,0,3),        # repeated vertex
+                                (0,1,4),        # collinear vertices, zero area
+                                (1,2,0),        # repeats the first triangle
+                                (0,2,3),
+                                (0,3,2),        # opposite orientation, kept
+                                (2,3,0)], int32 )  # repeats the fifth triangle
+            mesh = clean_mesh( {'points' : points, 'triangles' : triangles} )
+            self.assert_( len(mesh['points']) == 4 )
+            self.assert_( (mesh['triangles'] == array( [(0,1,2),(0,2,3),(0,3,2)] )).all() )
+
+        def test25(self):
+            "cleanup keeps the triangle colors of the remaining triangles"
+            colors = array( [[(i,0,0,255)]*3 for i in range(3)], uint8 )
+            triangles = array( [(0,1,2),(0,0,5),(3,4,5)], int32 )
+            mesh = clean_mesh( {'points' : SQUARE_POINTS, 'triangles' : triangles,
+                                'triangle_colors' : colors} )
+            self.assert_( (mesh['triangle_colors'][:,0,0] == array( [0,2] )).all() )
+
+        def test30(self):
+            "cleanup stores the indices in the smallest unsigned integer type"
+            mesh = clean_mesh( {'points' : SQUARE_POINTS, 'triangles' : SQUARE_TRIANGLES} )
+            self.assert_( mesh['triangles'].dtype == uint8 )
+            points, triangles = grid_mesh( 20 )
+            mesh = clean_mesh( {'points' : points, 'triangles' : triangles} )
+            self.assert_( mesh['triangles'].dtype == uint16 )
+            self.assert_( mesh['triangles'].max() == 399 )
+            self.assert_( self.same_triangles( mesh, points, triangles ))
+
+        def test35(self):
+            "cleanup rejects triangle indices out of range"
+            triangles = array( [(0,1,6)], int32 )
+            self.assertRaises( ValueError, clean_mesh,
+                               {'points' : SQUARE_POINTS, 'triangles' : triangles} )
+
+        def test40(self):
+            "crease normals split the vertices of a cleaned mesh beyond its index type"
+            # a grid folded along every edge, so that every vertex is split
+            points, triangles = grid_mesh( 15, lambda i, j: 0.5 * ((i + j) % 2) )
+            mesh = clean_mesh( {'points' : points, 'triangles' : triangles} )
+            self.assert_( mesh['triangles'].dtype == uint8 )
+            mesh = vertex_normals( mesh, 0.01 )
+            self.assert_( len(mesh['points']) > 256 )
+            self.assert_( mesh['triangles'].max() == len(mesh['points']) - 1 )
+            self.assert_( self.same_triangles( mesh, points, triangles ))
+
+        def test45(self):
+            "per-vertex colors split the vertices of a cleaned mesh beyond its index type"
+            from convert_3mf_to_x3d.materials import color_mesh
+            points, triangles = grid_mesh( 15 )
+            colors = zeros( (len(triangles),3,4), uint8 )
+            colors[:,:,0] = arange( 3*len(triangles) ).reshape((-1,3)) % 251
+            mesh = clean_mesh( {'points' : points, 'triangles' : triangles,
+                                'triangle_colors' : colors} )
+            self.assert_( mesh['triangles'].dtype == uint8 )
+            mesh = color_mesh( mesh )
+            self.assert_( mesh['color_per_vertex'] and len(mesh['points']) > 256 )
+            self.assert_( mesh['triangles'].max() == len(mesh['points']) - 1 )
+            self.assert_( self.same_triangles( mesh, points, triangles ))
+
+    suite = unittest.TestSuite()
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase(TestCase))
+    unittest.TextTestRunner(descriptions=False, verbosity=2).run(suite)
@@ -0,0 +1,114 @@
+"""
+Access to the parts of a 3MF package (Core spec 1.1 Chapter 2), which is
+a zip archive conforming to the Open Packaging Conventions
+
+Only the small relationship and content-type parts are read in full. The
+model part is located by following the package relationships to the 3D
+model start part, and is decompressed as it is read, so that no part is
+held in memory as a whole and parts which are not needed, such as
+thumbnails and textures, are not decompressed at all.
+"""
+
+MODEL_RELATIONSHIP_TYPE = "http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"
+RELATIONSHIPS_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+PACKAGE_RELATIONSHIPS = "_rels/.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+
+def _member_name( zipFile, part_name ):
+    """
+    returns the name of the zip member holding the part part_name,
+    an absolute OPC part name such as /3D/3dmodel.model. Part names
+    are compared case-insensitively, as OPC requires
+    """
+    from urllib import unquote
+    name = unquote( part_name ).lstrip("/")
+    if name in zipFile.NameToInfo:
+        return name
+    for member in zipFile.namelist():
+        if member.lower() == name.lower():
+            return member
+    raise ValueError("part %s not found in package" % part_name)
+
+
+def content_types( zipFile ):
+    """
+    returns a str->str callable giving the content type of a zip member,
+    as declared in the [Content_Types].xml part; None if not declared
+    """
+    from .reader import element_tree
+    from .file_conversions import ns_generator
+    ET = element_tree()
+    ns = ns_generator( CONTENT_TYPES_NAMESPACE )
+
+    defaults = dict()
+    overrides = dict()
+    if CONTENT_TYPES in zipFile.NameToInfo:
+        typesNode = ET.fromstring( zipFile.read( CONTENT_TYPES ))
+        for node in typesNode.findall( ns('Default')):
+            defaults[ node.get('Extension','').lower() ] = node.get('ContentType')
+        for node in typesNode.findall( ns('Override')):
+            overrides[ node.get('PartName','').lstrip("/").lower() ] = node.get('ContentType')
+
+    def f(member):
+        key = member.lower()
+        if key in overrides:
+            return overrides[key]
+        return defaults.get( key.rsplit(".",1)[-1] )
+    return f
+
+
+def model_part_name( zipFile ):
+    """
+    returns the part name of the 3D model start part, the target of the
+    package relationship of type MODEL_RELATIONSHIP_TYPE
+    """
+    from .reader import element_tree
+    from .file_conversions import ns_generator
+    ET = element_tree()
+    ns = ns_generator( RELATIONSHIPS_NAMESPACE )
+
+    if PACKAGE_RELATIONSHIPS not in zipFile.NameToInfo:
+        raise ValueError("package relationships part %s not found" % PACKAGE_RELATIONSHIPS)
+    relsNode = ET.fromstring( zipFile.read( PACKAGE_RELATIONSHIPS ))
+    for relNode in relsNode.findall( ns('Relationship')):
+        if relNode.get('Type') == MODEL_RELATIONSHIP_TYPE:
+            target = relNode.get('Target')
+            if target is None:
+                raise ValueError("3D model relationship without Target")
+            if not target.startswith("/"):
+                target = "/" + target
+            return target
+    raise ValueError("no 3D model relationship in package")
+
+
+def open_3MF_package( source ):
+    """
+    source a file system path or a seekable file-like object
+    returns a zipfile.ZipFile instance; part sizes are
+    logged from the zip directory
+    """
+    from . import logger
+    import zipfile
+    try:
+        zipFile = zipfile.ZipFile( source, "r" )
+    except zipfile.BadZipfile, exc:
+        raise ValueError("3MF package is not a zip archive: %s" % (exc,))
+
+    content_type = content_types( zipFile )
+    for info in zipFile.infolist():
+        logger.info( "part /%s : mimetype: %s : byte-count %i : compressed %i" % \
+                     (info.filename, content_type(info.filename), info.file_size, info.compress_size))
+    return zipFile
+
+
+def open_model_part( zipFile ):
+    """
+    returns a file-like object which reads the decompressed
+    content of the 3D model start part
+    """
+    from . import logger
+    part_name = model_part_name( zipFile )
+    logger.info( "main document: %s" % part_name )
+    return zipFile.open( _member_name( zipFile, part_name ))
@@ -0,0 +1,330 @@
+"""
+Decoding and formatting of the meshes of one 3MF model on a pool
+of worker processes
+
+The model part is read through a MeshSplittingStream, which finds each
+resources/object/mesh element in the raw document text and hands to the XML
+parser the element with its content replaced by a key; the main process so
+does not parse the vertex and triangle elements, which are most of the
+document. The MeshDecoderPool given the emptied element submits the raw text
+of the mesh to the pool. Each worker parses the mesh, extracts the point and
+index arrays with get_3MF_mesh and formats the IndexedTriangleSet field text.
+Each result is attached to the record of its own object before any output is
+generated, so the X3D output, including its DEF/USE structure and node order,
+is the same as that of the serial conversion.
+
+A conversion with a cache directory reads the model part through a
+MeshSplittingStream as well, so that the cache is looked up with the raw
+text of each mesh, and a mesh found in the cache is not parsed at all.
+
+The raw text is scanned as UTF-8, the encoding required of the model part
+by the 3MF Core specification; a document in another encoding is handed to
+the parser unchanged, and its mesh elements are serialized for the workers.
+"""
+
+import re
+
+# bytes of the model part read at each step of the MeshSplittingStream
+READ_SIZE = 1 << 16
+
+# the markup constructs of the document text outside the mesh elements
+MARKUP = re.compile( r"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>|<![^>]*>|"
+                     r"<(/?)([^\s/>]+)((?:\s+[^\s=/>]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*(/?)>",
+                     re.S )
+UNPARSED = re.compile( r"<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>", re.S )
+XMLNS = re.compile( r"""xmlns(?::([^\s=]+))?\s*=\s*(?:"([^"]*)"|'([^']*)')""" )
+ENCODING = re.compile( r"""<\?xml[^>]*encoding\s*=\s*["']([^"']*)["']""" )
+
+# tag of the element wrapping the raw text of a mesh, declaring the
+# namespaces in scope at the mesh element
+WRAPPER = "mesh-text"
+
+
+class MeshSplittingStream(object):
+    """
+    A file-like object reading the 3MF model document from source, in which
+    the content of each mesh element of the namespace of the document
+    element is replaced by a key; texts is a dictionary of the raw text of
+    each such mesh element, wrapped in a WRAPPER element declaring the
+    namespaces in scope, indexed by key; elements the dictionary of the
+    number of elements within each, indexed by key
+    """
+    def __init__(self, source):
+        self.source = source
+        self.texts = dict()
+        self.elements = dict()
+        self.buffer = ""        # raw text read and not yet scanned
+        self.output = ""        # scanned text not yet read
+        self.eof = False
+        self.passthrough = None # True if the text is not scanned
+        self.scopes = list()    # namespace declarations of the open elements
+        self.namespace = None   # namespace of the document element
+        self.mesh = None        # (name, start tag, wrapper start tag) within a mesh
+        self.body = list()      # raw text of the mesh being read
+        self.count = 0
+
+    def read(self, size = -1):
+        while not self.eof and (size < 0 or len(self.output) < size):
+            data = self.source.read( READ_SIZE )
+            self.eof = not data
+            self.buffer += data
+            self.scan()
+        if size < 0:
+            size = len(self.output)
+        data, self.output = self.output[:size], self.output[size:]
+        return data
+
+    def close(self):
+        self.source.close()
+
+    def mesh_text(self, meshNode):
+        """
+        returns the raw text of meshNode if it is a mesh element emptied by
+        this stream, which is then released; else None
+        """
+        if len(meshNode) == 0:
+            return self.texts.pop( (meshNode.text or "").strip(), None )
+        return None
+
+    def mesh_elements(self, meshNode):
+        """
+        returns the number of elements within meshNode in the document if
+        it is a mesh element emptied by this stream, else 0
+        """
+        if len(meshNode) == 0:
+            return self.elements.pop( (meshNode.text or "").strip(), 0 )
+        return 0
+
+    def declarations(self, attributes):
+        return dict( [(prefix, double or single)
+                      for prefix, double, single in XMLNS.findall( attributes )] )
+
+    def resolve(self, name):
+        """
+        returns the namespace of the qualified element name, from
+        the declarations of the open elements
+        """
+        prefix = name.split(":")[0] if ":" in name else ""
+        for scope in reversed( self.scopes ):
+            if prefix in scope:
+                return scope[prefix]
+        return None
+
+    def wrapper(self):
+        """
+        returns the start tag of an element declaring the
+        namespaces of the open elements
+        """
+        scope = dict()
+        for declarations in self.scopes:
+            scope.update( declarations )
+        attributes = [(' xmlns:%s="%s"' if prefix else ' xmlns%s="%s"') % (prefix, uri)
+                      for prefix, uri in sorted( scope.items() )]
+        return "<%s%s>" % (WRAPPER, "".join( attributes ))
+
+    def scan(self):
+        """
+        moves the text of buffer which is complete to output,
+        emptying the mesh elements
+        """
+        if self.passthrough is None:
+            if len(self.buffer) < 256 and not self.eof:
+                return
+            encoding = ENCODING.match( self.buffer )
+            self.passthrough = self.buffer[:2] in ("\xff\xfe", "\xfe\xff") or \
+                (encoding is not None and
+                 encoding.group(1).lower() not in ("utf-8", "utf8", "us-ascii", "ascii"))
+        if self.passthrough:
+            self.output += self.buffer
+            self.buffer = ""
+            return
+
+        buf = self.buffer
+        pos = 0
+        out = list()
+        while pos < len(buf):
+            if self.mesh is not None:
+                pos = self.scan_mesh( buf, pos, out )
+                if self.mesh is not None:
+                    break
+                continue
+            start = buf.find( "<", pos )
+            if start < 0:
+                out.append( buf[pos:] )
+                pos = len(buf)
+                break
+            out.append( buf[pos:start] )
+            pos = start
+            markup = MARKUP.match( buf, start )
+            if markup is None:
+                if self.eof:
+                    # not well-formed; left for the parser to report
+                    out.append( buf[start:] )
+                    pos = len(buf)
+                break
+            pos = markup.end()
+            out.append( markup.group(0) )
+            closing, name, attributes, empty = markup.groups()
+            if name is None:
+                continue
+            if closing:
+                if self.scopes:
+                    self.scopes.pop()
+                continue
+            self.scopes.append( self.declarations( attributes ))
+            if self.namespace is None:
+                self.namespace = self.resolve( name )
+            if empty:
+                self.scopes.pop()
+            elif name.split(":")[-1] == "mesh" and self.resolve( name ) == self.namespace:
+                # the declarations of the start tag are part of the mesh text,
+                # and its end tag is not scanned here
+                self.scopes.pop()
+                self.mesh = (name, markup.group(0), self.wrapper())
+                self.body = list()
+        if self.eof and self.mesh is not None:
+            # an unclosed mesh element, left for the parser to report
+            out.extend( self.body )
+            out.append( buf[pos:] )
+            pos = len(buf)
+            self.mesh = None
+        self.output += "".join( out )
+        self.buffer = buf[pos:]
+
+    def scan_mesh(self, buf, pos, out):
+        """
+        scans the content of the current mesh element from pos; returns
+        the position after the mesh end tag, or else the position of the
+        first text left for the next read
+        """
+        name, startTag, wrapper = self.mesh
+        pattern = re.compile( r"<!--|<!\[CDATA\[|</%s\s*>" % re.escape(name) )
+        while True:
+            found = pattern.search( buf, pos )
+            if found is None:
+                # the text from the last '<' may begin the end tag
+                last = max( pos, buf.rfind( "<", pos ))
+                self.body.append( buf[pos:last] )
+                return last
+            if found.group(0) in ("<!--", "<![CDATA["):
+                end = buf.find( "-->" if found.group(0) == "<!--" else "]]>", found.end() )
+                if end < 0:
+                    self.body.append( buf[pos:found.start()] )
+                    return found.start()
+                self.body.append( buf[pos:end+3] )
+                pos = end + 3
+                continue
+            self.body.append( buf[pos:found.start()] )
+            key = str( self.count )
+            self.count += 1
+            body = "".join( self.body )
+            self.texts[key] = "".join( [wrapper, startTag, body,
+                                        found.group(0), "</%s>" % WRAPPER] )
+            self.elements[key] = count_elements( body )
+            self.body = list()
+            self.mesh = None
+            out.append( key )
+            out.append( found.group(0) )
+            return found.end()
+
+
+def count_elements( text ):
+    """
+    returns the number of start and empty-element tags in the
+    well-formed XML content text
+    """
+    if "<!" in text or "<?" in text:
+        # comments, CDATA sections and processing instructions
+        # are not elements, and may contain '<'
+        text = UNPARSED.sub( "", text )
+    return text.count("<") - text.count("</")
+
+
+def decode_and_format( task ):
+    """
+    task a 3-tuple (mesh_xml, format_text, properties); mesh_xml the mesh
+    element serialized, or wrapped by a MeshSplittingStream, properties the
+    properties argument of get_3MF_mesh
+
+    returns the get_3MF_mesh dictionary, with if format_text is True
+    the additional entry
+    text : the dictionary returned by file_conversions.mesh_field_text
+    """
+    from .reader import element_tree
+    from .file_conversions import ns_generator, split_tag, mesh_field_text
+    from .mesh import get_3MF_mesh
+
+    mesh_xml, format_text, properties = task
+    ET = element_tree()
+    meshNode = ET.fromstring( mesh_xml )
+    if split_tag( meshNode.tag )[1] == WRAPPER:
+        meshNode = meshNode[0]
+    namespace, local_name = split_tag( meshNode.tag )
+    meshData = get_3MF_mesh( meshNode, ns_generator(namespace), properties )
+    if format_text:
+        meshData['text'] = mesh_field_text( meshData )
+    return meshData
+
+
+class MeshDecoderPool(object):
+    """
+    A mesh_decoder for reader.iter_3MF_model which submits each mesh
+    to a pool of processes worker processes; the value stored for each
+    object is a pending result, to be passed to the resolve method.
+    If format_text is False the workers only decode the meshes; if
+    properties is True they also extract the triangle properties.
+
+    The model part is to be read through the stream returned by split,
+    so that the mesh elements are not parsed in this process
+    """
+    def __init__(self, processes, format_text = True, properties = False):
+        from multiprocessing import Pool
+        from .reader import element_tree
+        self.ET = element_tree()
+        self.pool = Pool( processes = processes )
+        self.format_text = format_text
+        self.properties = properties
+        self.stream = None
+
+    def split(self, model_file):
+        """
+        returns a MeshSplittingStream reading the model part from model_file
+        """
+        self.stream = MeshSplittingStream( model_file )
+        return self.stream
+
+    def mesh_xml(self, meshNode):
+        """
+        returns the text of meshNode for the workers: the raw text of an
+        element emptied by the split stream, which is then released, else
+        the serialized element
+        """
+        mesh_xml = None
+        if self.stream is not None:
+            mesh_xml = self.stream.mesh_text( meshNode )
+        return mesh_xml or self.ET.tostring( meshNode )
+
+    def submit(self, mesh_xml):
+        """
+        submits the text returned by mesh_xml to the pool;
+        returns the pending result
+        """
+        return self.pool.apply_async( decode_and_format,
+                                      ((mesh_xml, self.format_text, self.properties),) )
+
+    def __call__(self, meshNode, ns):
+        return self.submit( self.mesh_xml( meshNode ))
+
+    def resolve(self, pending):
+        """
+        waits for and returns the decoded mesh dictionary of pending
+        """
+        return pending.get()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,150 @@
+"""
+Streaming reader for the XML model part of a 3MF package
+(Core spec 1.1 Chapter 3)
+
+The model document is read with the iterparse function of the ElementTree
+implementation; each resources/object element is handed to the caller as
+soon as its end tag has been parsed and is then removed from the partially
+built tree. The largest amount of XML held in memory at one time is a
+single object element, rather than the whole document.
+"""
+
+from .file_conversions import split_tag, ns_generator
+
+# local-names of the property group elements of the Materials extension
+# whose properties are not translated into colors
+UNSUPPORTED_GROUPS = ('texture2dgroup', 'compositematerials', 'multiproperties')
+
+def element_tree():
+    """
+    returns the ElementTree implementation module used for
+    parsing; lxml.etree is preferred when it is installed
+    """
+    from . import logger
+    # alternative: import xml.etree.ElementTree as ET
+    try:
+        import lxml.etree as  ET
+        logger.debug("Using lxml as ElementTree")
+    except ImportError:
+        import xml.etree.ElementTree as ET
+        logger.debug("Using xml.etree.ElementTree as ElementTree")
+    return ET
+
+def iter_3MF_model( model_file, mesh_decoder, report = None ):
+    """
+    model_file a file-like object open for reading the model part
+    mesh_decoder a callable (meshNode, ns) -> value, invoked on each
+        resources/object/mesh element as soon as it is complete. ns is a
+        string->string callable that converts a local-name to a QName
+    report optional instrument.ConversionReport; the number of XML
+        elements of the document is added to its 'xml_elements' count
+
+    generator yielding (kind, value) 2-tuples in document order:
+    ('model', modelNode) when the model start tag has been read; the
+            attributes of modelNode are available but not its children
+    ('metadata', (name, text)) for each model/metadata element
+    ('object', objectRecord) for each resources/object element, where
+            objectRecord is a dictionary with entries
+            id : the value of the id attribute
+            attributes : dictionary of the object element attributes
+            mesh : value returned by mesh_decoder, or None if the object
+                   has no mesh child
+            components : list of the attribute dictionaries of the
+                   components/component children, or None if the
+                   object has no components child
+            elements : the number of XML elements of the object,
+                   including the object element
+    ('item', attributes) for each build/item element, attributes a dictionary
+    ('propertygroup', (id, colors)) for each resources/basematerials element,
+            colors the list of the displaycolor attributes of its base
+            children, and for each resources/m:colorgroup element, colors
+            the list of the color attributes of its m:color children; for
+            the property groups of the Materials extension which are not
+            translated (UNSUPPORTED_GROUPS), colors is None
+
+    raises ValueError if the model has no resources or build element;
+    XML syntax errors are raised as instances of SyntaxError
+    """
+    from .materials import MATERIALS_NAMESPACE
+    ET = element_tree()
+    colorgroup_tag = "{%s}colorgroup" % MATERIALS_NAMESPACE
+    color_tag = "{%s}color" % MATERIALS_NAMESPACE
+    unsupported_tags = set( ["{%s}%s" % (MATERIALS_NAMESPACE, name)
+                             for name in UNSUPPORTED_GROUPS] )
+
+    ns = None
+    stack = list()      # ancestors of the current element, from the root
+    seen = set()        # local-names of the children of model element
+    meshValue = None    # decoded mesh of the object being read
+    components = None   # component attributes of the object being read
+    elements = 0
+    first = 0           # number of the first element of the current child of resources
+    # a model_file emptying the mesh elements, as parallel.MeshSplittingStream,
+    # gives the number of elements it removed from each
+    mesh_elements = getattr( model_file, 'mesh_elements', None )
+    for event, elem in ET.iterparse( model_file, events=('start','end')):
+        if event == 'start':
+            elements += 1
+            if not stack:
+                namespace, root_local_name = split_tag( elem.tag )
+                ns = ns_generator( namespace )
+                yield 'model', elem
+            elif len(stack) == 2:
+                first = elements
+            stack.append( elem )
+            continue
+
+        stack.pop()
+        depth = len(stack)
+        if depth == 1:
+            seen.add( split_tag( elem.tag )[1] )
+            if elem.tag == ns('metadata'):
+                yield 'metadata', (elem.get('name'), elem.text)
+        elif depth == 2 and elem.tag == ns('object'):
+            yield 'object', {
+                'id'         : elem.get('id'),
+                'attributes' : dict( elem.items() ),
+                'mesh'       : meshValue,
+                'components' : components,
+                'elements'   : elements - first + 1
+            }
+            meshValue = None
+            components = None
+        elif depth == 2 and elem.tag == ns('item'):
+            yield 'item', dict( elem.items() )
+        elif depth == 2 and elem.tag == ns('basematerials'):
+            yield 'propertygroup', (elem.get('id'),
+                    [base.get('displaycolor') for base in elem.findall( ns('base'))])
+        elif depth == 2 and elem.tag == colorgroup_tag:
+            yield 'propertygroup', (elem.get('id'),
+                    [color.get('color') for color in elem.findall( color_tag )])
+        elif depth == 2 and elem.tag in unsupported_tags:
+            yield 'propertygroup', (elem.get('id'), None)
+        elif depth == 3 and elem.tag == ns('mesh') and \
+             stack[-1].tag == ns('object'):
+            if mesh_elements is not None:
+                elements += mesh_elements( elem )
+            meshValue = mesh_decoder( elem, ns )
+            # emptying the vertices and triangles elements before the mesh
+            # is detached avoids lxml reconciling the namespace of every
+            # vertex and triangle element as the subtree is moved
+            for child in elem:
+                child.clear()
+            stack[-1].remove( elem )
+        elif depth == 3 and elem.tag == ns('components') and \
+             stack[-1].tag == ns('object'):
+            components = [dict( c.items() ) for c in elem.findall( ns('component'))]
+            stack[-1].remove( elem )
+
+        # release the consumed element; the remaining children
+        # of an object are held until the object end tag
+        if 1 <= depth <= 2:
+            stack[-1].remove( elem )
+
+    if report is not None:
+        report.count( 'xml_elements', elements )
+
+    if 'resources' not in seen:
+        raise ValueError("No resources node found")
+    if 'build' not in seen:
+        raise ValueError("No build node located")
@@ -0,0 +1,211 @@
+"""
+In-memory conversion: a 3MF package read from a byte string or a
+seekable file-like object into a scene model, serialized to X3D later
+
+read_scene performs the reading stages of convert_to_X3D (open the package,
+read the model and decode its meshes, process the meshes, lay out the build)
+and returns a Scene. The Scene exposes the model as small __slots__ objects
+holding the NumPy arrays of the meshes, the 3MF matrices of the build items,
+the metadata, the unit and the global bounds, so that a caller needs neither
+a temporary file for the input nor to parse the X3D output to inspect the
+model. Scene.write serializes the X3D document, as often as needed and with
+different output parameters, without reading the package again.
+
+The arrays are those serialized by Scene.write; they are not copied, and
+should be treated as read only.
+"""
+
+from .file_conversions import convert_to_X3D_default
+
+# the convert_to_X3D parameters which Scene.write accepts; the others
+# are applied as the scene is read, and are given to read_scene
+WRITE_PARAMS = ('serializer', 'compression', 'share_geometry', 'inline_triangles',
+                'inline_dir', 'inline_url', 'inline_workers', 'instrument')
+
+
+class SceneObject(object):
+    """
+    a resource object of the model
+
+    id the value of the id attribute
+    attributes dictionary of the object element attributes
+    points (N,3) float array of the vertex coordinates, or None for an
+        object built from components
+    triangles (K,3) integer array (int32 by default) of the vertex indices
+        of the triangles, or None
+    normals (N,3) float array of the vertex normals with the normals
+        parameter, else None
+    triangle_colors (K,3,4) uint8 array of the RGBA colors of the triangle
+        corners of an object of several colors with the materials parameter,
+        else None
+    color (4,) uint8 RGBA color of an object all of one color with the
+        materials parameter, else None
+    components list of (objectid, M) 2-tuples for the components of the
+        object, M the (4,3) 3MF matrix of each; None for a mesh object
+
+    matrix a callable returning the 3MF matrix of a transform attribute value
+    """
+    __slots__ = ('id', 'attributes', 'points', 'triangles', 'normals',
+                 'triangle_colors', 'color', 'components')
+
+    def __init__(self, objectRecord, matrix):
+        self.id = objectRecord['id']
+        self.attributes = objectRecord['attributes']
+        self.color = objectRecord.get('color')
+        meshData = objectRecord['mesh']
+        if meshData is not None:
+            self.points = meshData['points']
+            self.triangles = meshData['triangles']
+            self.normals = meshData.get('normals')
+            self.triangle_colors = meshData.get('triangle_colors')
+            self.components = None
+        else:
+            self.points = self.triangles = self.normals = self.triangle_colors = None
+            self.components = [(component.get('objectid'), matrix( component.get('transform') ))
+                               for component in objectRecord['components']]
+
+    def __repr__(self):
+        if self.points is None:
+            return "<SceneObject %s: %i components>" % (self.id, len(self.components))
+        return "<SceneObject %s: %i vertices, %i triangles>" % \
+               (self.id, len(self.points), len(self.triangles))
+
+
+class SceneItem(object):
+    """
+    a build item of the model
+
+    objectid the id of the resource object placed
+    attributes dictionary of the item element attributes
+    matrix the (4,3) 3MF matrix placing the object
+    """
+    __slots__ = ('objectid', 'attributes', 'matrix')
+
+    def __init__(self, objectid, attributes, matrix):
+        self.objectid = objectid
+        self.attributes = attributes
+        self.matrix = matrix
+
+    def __repr__(self):
+        return "<SceneItem %s>" % (self.objectid,)
+
+
+class Scene(object):
+    """
+    the model of a 3MF package, as returned from read_scene
+
+    unit the X3D unit name of the model unit
+    conversion_factor the length of the model unit in meters
+    metadata list of the (name, content) X3D meta tags
+    objects dictionary of the SceneObject instances, indexed by id
+    items list of the SceneItem instances, in document order
+    bounds (2,3) array of the minimum and maximum coordinates of all
+        the build items in global space
+    params the dictionary of convert_to_X3D parameters of the scene
+    report the dictionary reporting the reading stages with the
+        instrument parameter, as returned from convert_to_X3D; else None
+    """
+    __slots__ = ('unit', 'conversion_factor', 'metadata', 'objects', 'items',
+                 'bounds', 'params', 'report', '_model', '_builds')
+
+    def __init__(self, model, builds, global_bounds, params, report = None):
+        from .matrix import identity_matrix, matrix_from_string
+
+        matrices = dict()   # transform attribute value -> 3MF matrix
+        def matrix( transformString ):
+            if transformString not in matrices:
+                matrices[transformString] = identity_matrix if transformString is None \
+                                            else matrix_from_string( transformString )
+            return matrices[transformString]
+
+        self.unit = model['unit']['name']
+        self.conversion_factor = model['unit']['conversionFactor']
+        self.metadata = model['metaitems']
+        self.objects = dict( [(objectid, SceneObject( objectRecord, matrix ))
+                              for objectid, objectRecord in model['objects'].items()] )
+        self.items = [SceneItem( objectRecord['id'], itemNode, matrix( itemNode.get('transform') ))
+                      for itemNode, transformData, objectRecord in builds]
+        self.bounds = global_bounds
+        self.params = params
+        self.report = report
+        self._model = model
+        self._builds = builds
+
+    def write(self, output_stream, **keyw):
+        """
+        Serializes the X3D document of the scene to output_stream
+
+        keyw the convert_to_X3D parameters listed in WRITE_PARAMS, replacing
+        those given to read_scene; raises ValueError for another parameter
+
+        If the instrument parameter is True, returns a dictionary reporting
+        the serialization stages; see convert_to_X3D
+        """
+        import time
+        from .file_conversions import write_document
+        from .instrument import ConversionReport, null_report
+
+        for name in keyw:
+            if name not in WRITE_PARAMS:
+                raise ValueError("parameter %s must be given to read_scene" % name)
+        params = dict( self.params )
+        params.update( keyw )
+
+        start_time = time.time()
+        report = ConversionReport() if params['instrument'] else null_report
+        write_document( output_stream, self._model, self._builds, self.bounds,
+                        params, report )
+        if params['instrument']:
+            retVal = report.as_dict()
+            retVal.update( {
+                'serializer' : params['serializer'],
+                'build_items' : len( self._builds ),
+                'total_seconds' : time.time() - start_time
+            })
+            return retVal
+
+    def to_bytes(self, **keyw):
+        """
+        returns the X3D document of the scene as a byte string; keyw as
+        for write
+        """
+        from io import BytesIO
+        output_stream = BytesIO()
+        self.write( output_stream, **keyw )
+        return output_stream.getvalue()
+
+
+def read_scene( source, **keyw ):
+    """
+    source the content of a 3MF package as a byte string, or a seekable
+        file-like object open for reading the package
+    keyw the parameters of convert_to_X3D
+
+    returns a Scene; raises ValueError if the package cannot be converted
+    """
+    import time
+    from .file_conversions import load_model
+    from .instrument import ConversionReport, null_report
+
+    params = dict()
+    params.update( convert_to_X3D_default )
+    params.update( keyw )
+
+    if not hasattr( source, 'read' ):
+        from cStringIO import StringIO
+        source = StringIO( source )
+    elif not hasattr( source, 'seek' ):
+        raise ValueError("3MF package file object must be seekable")
+
+    start_time = time.time()
+    report = ConversionReport() if params['instrument'] else null_report
+    model, builds, global_bounds = load_model( source, params, report )
+
+    reportDict = None
+    if params['instrument']:
+        reportDict = report.as_dict()
+        reportDict.update( {
+            'build_items' : len( builds ),
+            'total_seconds' : time.time() - start_time
+        })
+    return Scene( model, builds, global_bounds, params, reportDict )
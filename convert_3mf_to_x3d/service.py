@@ -0,0 +1,284 @@
+"""
+Long running conversion service over HTTP
+
+The service keeps a fixed number of worker processes, each of which has
+imported the conversion modules and NumPy and compiled the genshi template
+before the first request arrives, so that a request pays only for its own
+conversion. The number of workers bounds the number of conversions running
+at once; a request waits up to the timeout for an idle worker. A conversion
+which does not complete within the timeout is abandoned: its worker process
+is terminated and replaced by a fresh one.
+
+Requests:
+
+    POST /convert     the body is the 3MF package; or, if the service was
+                      started with allow_paths and the Content-Type is
+                      application/json, an object {"path": PATH} naming a
+                      3MF file readable by the service
+    GET  /health      responds 200 while the service is running
+
+A successful conversion responds 200 with the X3D output as the body,
+copied from the worker's output file in pieces. A failed conversion
+responds 422, a timeout 504, and a request finding no idle worker
+within the timeout 503; the body of an error response is a text message.
+"""
+
+# bytes copied at a time between the sockets and the temporary files
+COPY_SIZE = 1 << 16
+
+# Content-Type and Content-Encoding of the output, by output_extension
+CONTENT_TYPES = {
+    ".x3d"    : ("model/x3d+xml", None),
+    ".x3dz"   : ("model/x3d+xml", "gzip"),
+    ".x3db"   : ("application/octet-stream", None),
+    ".x3db.gz": ("application/octet-stream", "gzip")
+}
+
+def _worker_main( connection, params ):
+    """
+    body of a worker process: receives (input_path, output_path) tasks
+    on connection and answers each with (success, message); None ends
+    the process
+    """
+    # import the conversion modules and their dependencies, and compile
+    # the template, before the first task
+    from . import file_conversions, reader, mesh, matrix, x3d_writer, logger
+    import numpy
+    if params['serializer'] == 'genshi':
+        file_conversions.x3d_template()
+
+    while True:
+        task = connection.recv()
+        if task is None:
+            return
+        input_path, output_path = task
+        try:
+            with open(output_path, "wb") as output_stream:
+                file_conversions.convert_to_X3D( input_path, output_stream, **params )
+        except Exception, exc:
+            logger.debug("conversion of %s failed" % input_path, exc_info=True)
+            connection.send( (False, "%s: %s" % (exc.__class__.__name__, exc)) )
+        else:
+            connection.send( (True, output_path) )
+
+
+class WorkerProcess(object):
+    """
+    a warm worker process converting one file at a time
+    """
+    def __init__(self, params):
+        from multiprocessing import Process, Pipe
+        self.connection, child = Pipe()
+        self.process = Process( target=_worker_main, args=(child, params) )
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def convert(self, input_path, output_path, timeout):
+        """
+        returns (success, message) as sent by the worker,
+        or None if the worker does not answer within timeout seconds
+        """
+        self.connection.send( (input_path, output_path) )
+        if not self.connection.poll( timeout ):
+            return None
+        return self.connection.recv()
+
+    def stop(self):
+        try:
+            self.connection.send( None )
+        except (IOError, OSError):
+            pass
+        self.process.join( 1.0 )
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join()
+
+
+class ConversionService(object):
+    """
+    params the dictionary of convert_to_X3D parameters of every conversion
+    workers the number of worker processes
+    timeout the seconds a request may wait for a worker, and a conversion
+        may take, before it is abandoned
+    """
+    def __init__(self, params, workers, timeout):
+        import Queue
+        self.params = params
+        self.timeout = timeout
+        self.idle = Queue.Queue()
+        for i in range(workers):
+            self.idle.put( WorkerProcess( params ))
+
+    def convert(self, input_path, output_path):
+        """
+        converts input_path into output_path on an idle worker
+
+        returns a tuple (status, message); status is 'ok', 'failed',
+        'timeout' or 'busy'
+        """
+        import Queue
+        from . import logger
+        try:
+            worker = self.idle.get( timeout=self.timeout )
+        except Queue.Empty:
+            return 'busy', "no idle worker within %g seconds" % self.timeout
+        try:
+            result = worker.convert( input_path, output_path, self.timeout )
+        except (EOFError, IOError, OSError):
+            result = (False, "worker process ended")
+            worker.terminate()
+            worker = WorkerProcess( self.params )
+        if result is None:
+            logger.warn("conversion of %s timed out" % input_path)
+            worker.terminate()
+            worker = WorkerProcess( self.params )
+            status = ('timeout', "conversion exceeded %g seconds" % self.timeout)
+        elif result[0]:
+            status = ('ok', result[1])
+        else:
+            status = ('failed', result[1])
+        self.idle.put( worker )
+        return status
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().stop()
+
+
+def make_server( address, service, allow_paths = False, max_bytes = 1 << 30 ):
+    """
+    address a (host, port) tuple
+    service a ConversionService
+    allow_paths if True a request may name an input file instead of
+        sending the package
+    max_bytes the largest 3MF package accepted in a request body
+
+    returns a threaded BaseHTTPServer.HTTPServer; call its serve_forever method
+    """
+    import BaseHTTPServer, SocketServer
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                self.send_text( 200, "ok" )
+            else:
+                self.send_text( 404, "not found" )
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/convert":
+                self.send_text( 404, "not found" )
+                return
+            import os, tempfile
+            temporary = list()
+            try:
+                input_path = self.request_input( temporary )
+                if input_path is None:
+                    return
+                from .file_conversions import output_extension
+                extension = output_extension( service.params )
+                descriptor, output_path = tempfile.mkstemp( suffix=extension )
+                os.close( descriptor )
+                temporary.append( output_path )
+                status, message = service.convert( input_path, output_path )
+                if status == 'ok':
+                    self.send_file( output_path, extension )
+                else:
+                    code = {'failed' : 422, 'timeout' : 504, 'busy' : 503}[status]
+                    self.send_text( code, message )
+            finally:
+                for path in temporary:
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        def request_input(self, temporary):
+            """
+            returns the path of the input file of the request, or None
+            if an error response has been sent; the paths of the
+            temporary files created are appended to temporary
+            """
+            import os, json, tempfile
+            try:
+                length = int( self.headers.get('Content-Length') )
+            except (TypeError, ValueError):
+                self.send_text( 411, "Content-Length required" )
+                return None
+            if length > max_bytes:
+                self.send_text( 413, "request body exceeds %i bytes" % max_bytes )
+                return None
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                if not allow_paths:
+                    self.send_text( 403, "input paths are not accepted" )
+                    return None
+                try:
+                    path = json.loads( self.rfile.read( length ))['path']
+                except (ValueError, KeyError, TypeError):
+                    self.send_text( 400, 'expected {"path": PATH}' )
+                    return None
+                if not os.path.isfile( path ):
+                    self.send_text( 404, "file not found: %s" % path )
+                    return None
+                return path
+            descriptor, path = tempfile.mkstemp( suffix=".3mf" )
+            temporary.append( path )
+            with os.fdopen( descriptor, "wb" ) as f:
+                while length > 0:
+                    data = self.rfile.read( min( length, COPY_SIZE ))
+                    if not data:
+                        break
+                    f.write( data )
+                    length -= len(data)
+            if length > 0:
+                self.send_text( 400, "request body truncated" )
+                return None
+            return path
+
+        def send_file(self, path, extension):
+            import os, shutil
+            contentType, encoding = CONTENT_TYPES[extension]
+            self.send_response( 200 )
+            self.send_header( 'Content-Type', contentType )
+            if encoding is not None:
+                self.send_header( 'Content-Encoding', encoding )
+            self.send_header( 'Content-Length', str( os.path.getsize(path) ))
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj( f, self.wfile, COPY_SIZE )
+
+        def send_text(self, code, message):
+            body = message.encode("utf-8") if isinstance(message, unicode) else message
+            self.send_response( code )
+            self.send_header( 'Content-Type', "text/plain; charset=utf-8" )
+            self.send_header( 'Content-Length', str( len(body) ))
+            self.end_headers()
+            self.wfile.write( body )
+
+        def log_message(self, format, *args):
+            from . import logger
+            logger.info( "%s %s" % (self.address_string(), format % args) )
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    return Server( address, Handler )
+
+
+def serve( address, params, workers, timeout, allow_paths = False ):
+    """
+    runs the conversion service on address until interrupted
+    """
+    import sys
+    service = ConversionService( params, workers, timeout )
+    server = make_server( address, service, allow_paths )
+    sys.stderr.write("conversion service listening on %s:%i with %i workers\n" % \
+                     (server.server_address[0], server.server_address[1], workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,263 @@
+"""
+Binary container for X3D documents with unformatted numeric arrays
+
+The container holds the text of an X3D XML document in which the values of
+the array-valued attributes (the IndexedTriangleSet index and Coordinate
+point fields) are not written as text; in their place the raw NumPy array
+buffer is stored. Coordinates and indices are thus written straight from
+the arrays decoded from the 3MF mesh, and stored at 8 and 4 bytes per
+value rather than about 10 characters of text.
+
+This is not the X3D Compressed Binary Encoding (ISO/IEC 19776-3), which
+requires a Fast Infoset encoder. expand() converts a container into the
+X3D XML document which the direct serializer writes for the same model.
+
+Layout, all integers little-endian:
+
+    MAGIC                    8 bytes
+    chunk*                   each chunk is
+        tag                  4 bytes: TEXT_TAG, ARRAY_TAG or END_TAG
+        length               unsigned 64 bit integer; the payload size
+        payload              length bytes
+
+TEXT payload : a piece of the XML document text, UTF-8 encoded
+ARRAY payload: the value of the attribute whose opening quote ends the
+               preceding text:
+        dtype length         unsigned 8 bit integer
+        dtype                the numpy dtype string, e.g. '<f8' or '<i4'
+        ndim                 unsigned 8 bit integer
+        shape                ndim unsigned 64 bit integers
+        format length        unsigned 8 bit integer; 0 for an integer field
+        format               the printf format of the field values, e.g. '%f'
+        strip zeros          unsigned 8 bit integer; 1 if the trailing zeros
+                             of the values are removed, else 0
+        data                 the array values in C order
+END payload  : empty; the last chunk
+
+The concatenation of the TEXT pieces, with each ARRAY formatted in place
+as an MFVec3f field with its format, or as an MFInt32 field if it has none,
+is the X3D document.
+"""
+
+MAGIC = "X3DARR\r\n"
+TEXT_TAG = "TEXT"
+ARRAY_TAG = "ARRY"
+END_TAG = "END "
+
+# bytes of document text collected before a TEXT chunk is written
+TEXT_CHUNK_SIZE = 1 << 16
+
+from .x3d_writer import X3DStreamWriter, ArrayField
+
+class X3DBinaryWriter(X3DStreamWriter):
+    """
+    Writes the X3D document to output_stream in the binary container
+    format; the array of each ArrayField attribute value is written as
+    an ARRAY chunk instead of the field text
+    """
+    def __init__(self, output_stream, encoding="utf-8"):
+        X3DStreamWriter.__init__(self, output_stream, encoding)
+        self.pending = list()       # document text not yet written
+        self.pending_size = 0
+        output_stream.write( MAGIC )
+
+    def chunk(self, tag, length, payload=()):
+        """
+        writes a chunk header followed by the strings or buffers in payload
+        """
+        import struct
+        self.output_stream.write( tag + struct.pack("<Q", length) )
+        for data in payload:
+            self.output_stream.write( data )
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding)
+        self.pending.append( text )
+        self.pending_size += len(text)
+        if self.pending_size >= TEXT_CHUNK_SIZE:
+            self.flush_text()
+
+    def flush_text(self):
+        if self.pending:
+            text = "".join( self.pending )
+            self.chunk( TEXT_TAG, len(text), [text] )
+            self.pending = list()
+            self.pending_size = 0
+
+    def attribute_value(self, value):
+        if not isinstance(value, ArrayField):
+            X3DStreamWriter.attribute_value(self, value)
+            return
+        import struct
+        from numpy import ascontiguousarray
+        array = ascontiguousarray( value.array )
+        dtype = array.dtype.newbyteorder('<')
+        array = array.astype( dtype, copy=False )
+        format, strip_zeros = value.format or ("", False)
+        header = struct.pack("<B", len(dtype.str)) + dtype.str + \
+                 struct.pack("<B%iQ" % array.ndim, array.ndim, *array.shape) + \
+                 struct.pack("<B", len(format)) + format + \
+                 struct.pack("<B", 1 if strip_zeros else 0)
+        self.flush_text()
+        self.chunk( ARRAY_TAG, len(header) + array.nbytes, [header, array.data] )
+
+    def end_document(self):
+        X3DStreamWriter.end_document(self)
+        self.flush_text()
+        self.chunk( END_TAG, 0 )
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("binary X3D container is truncated")
+    return data
+
+
+def iter_chunks( input_stream ):
+    """
+    input_stream a file-like object open for reading a binary container
+
+    generator yielding ('text', str) for each TEXT chunk and
+    ('array', (array, format)) for each ARRAY chunk, in order, format the
+    (format, strip_zeros) arguments of MFVec for the array, or None for an
+    integer field; raises ValueError if input_stream does not hold a
+    complete container
+    """
+    import struct
+    from numpy import frombuffer, dtype
+
+    magic = input_stream.read( len(MAGIC) )
+    if magic != MAGIC:
+        raise ValueError("not a binary X3D container")
+    while True:
+        tag, length = struct.unpack( "<4sQ", _read_exactly( input_stream, 12 ))
+        payload = _read_exactly( input_stream, length )
+        if tag == TEXT_TAG:
+            yield 'text', payload
+        elif tag == ARRAY_TAG:
+            size = struct.unpack( "<B", payload[0] )[0]
+            arrayType = dtype( payload[1:1+size] )
+            ndim = struct.unpack( "<B", payload[1+size] )[0]
+            offset = 2 + size + 8 * ndim
+            shape = struct.unpack( "<%iQ" % ndim, payload[2+size:offset] )
+            size = struct.unpack( "<B", payload[offset] )[0]
+            format = payload[offset+1:offset+1+size]
+            strip_zeros = payload[offset+1+size] != "\0"
+            offset += 2 + size
+            format = (format, strip_zeros) if format else None
+            array = frombuffer( payload, arrayType, offset=offset ).reshape( shape )
+            yield 'array', (array, format)
+        elif tag == END_TAG:
+            return
+        else:
+            raise ValueError("unknown chunk %r in binary X3D container" % tag)
+
+
+def expand( input_stream, output_stream ):
+    """
+    writes to output_stream the X3D XML document held in the
+    binary container read from input_stream
+    """
+    from .file_conversions import MFVec_chunks, MFInt_chunks
+    for kind, value in iter_chunks( input_stream ):
+        if kind == 'text':
+            output_stream.write( value )
+        else:
+            array, format = value
+            if format is not None:
+                chunks = MFVec_chunks( array, *format )
+            else:
+                chunks = MFInt_chunks( array.reshape((-1,)) )
+            for chunk in chunks:
+                output_stream.write( chunk )
+
+
+if __name__ == '__main__':
+    # python -m convert_3mf_to_x3d.x3d_binary CONTAINER_FILE > OUTPUT_X3D_FILE
+    # the container may be gzip compressed
+    # python -m convert_3mf_to_x3d.x3d_binary --test
+    # checks that expanded containers equal the direct output
+    import sys, gzip
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m convert_3mf_to_x3d.x3d_binary CONTAINER_FILE | --test")
+
+    if sys.argv[1] != '--test':
+        with open( sys.argv[1], "rb" ) as f:
+            compressed = f.read(2) == "\x1f\x8b"
+        source = gzip.open( sys.argv[1], "rb" ) if compressed else open( sys.argv[1], "rb" )
+        try:
+            expand( source, sys.stdout )
+        finally:
+            source.close()
+        sys.exit()
+
+    import unittest, zipfile
+    from io import BytesIO
+    from .scene import read_scene
+
+    # a tetrahedron with coordinates of more than six decimals
+    MODEL_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+<resources><object id="1" type="model"><mesh>
+<vertices><vertex x="0" y="0" z="0"/><vertex x="1.23456789" y="0" z="0"/>
+<vertex x="0" y="2.5" z="0.00000004"/><vertex x="0.5" y="0.5" z="3.000000012"/></vertices>
+<triangles><triangle v1="0" v2="2" v3="1"/><triangle v1="0" v2="1" v3="3"/>
+<triangle v1="1" v2="2" v3="3"/><triangle v1="2" v2="0" v3="3"/></triangles>
+</mesh></object></resources>
+<build><item objectid="1"/></build>
+</model>"""
+
+    RELS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>"""
+
+    def package():
+        """
+        returns the content of the 3MF package of MODEL_XML
+        """
+        output_stream = BytesIO()
+        zipFile = zipfile.ZipFile( output_stream, "w" )
+        zipFile.writestr( "_rels/.rels", RELS_XML )
+        zipFile.writestr( "3D/3dmodel.model", MODEL_XML )
+        zipFile.close()
+        return output_stream.getvalue()
+
+    class TestCase(unittest.TestCase):
+
+        def expanded(self, container):
+            output_stream = BytesIO()
+            expand( BytesIO( container ), output_stream )
+            return output_stream.getvalue()
+
+        def assert_round_trip(self, **keyw):
+            scene = read_scene( package(), **keyw )
+            direct = scene.to_bytes()
+            self.assertEqual( self.expanded( scene.to_bytes( serializer='binary' )), direct )
+            return direct
+
+        def __str__(self):
+            return self._testMethodDoc
+
+        def test10(self):
+            "expanded container equals the direct output"
+            self.assert_round_trip()
+
+        def test20(self):
+            "expanded container keeps the decimals of a precision below 1e-6"
+            direct = self.assert_round_trip( precision=1.0e-8 )
+            self.assert_( "1.23456789" in direct and "3.00000001" in direct )
+
+        def test25(self):
+            "expanded container keeps the decimals of the auto precision"
+            self.assert_round_trip( precision='auto' )
+
+        def test30(self):
+            "expanded container equals the direct output with normals"
+            self.assert_round_trip( normals=True, precision=1.0e-3 )
+
+    suite = unittest.TestSuite()
+    suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase(TestCase))
+    unittest.TextTestRunner(descriptions=False, verbosity=2).run(suite)
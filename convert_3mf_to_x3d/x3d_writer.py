@@ -0,0 +1,193 @@
+"""
+Serializers for the X3D scene graph produced from a 3MF model
+
+Nodes are delivered to a serializer as a sequence of start(tag, attributes)
+and end(tag) calls, where attributes is a sequence of (name, value) pairs
+in output order. A value is either a string or an iterator yielding
+successive pieces of the attribute text, such as the numeric field
+generators MFVec_chunks and MFInt_chunks of file_conversions; the pieces
+are not escaped. Two serializers implement this interface:
+
+ElementTreeBuilder : assembles ElementTree elements, which are rendered
+                     through the genshi template x3d_template.xml
+
+X3DStreamWriter : writes XML text directly to an output stream as each
+                  node is delivered. The document text is identical to that
+                  rendered by genshi from x3d_template.xml
+
+A third serializer, x3d_binary.X3DBinaryWriter, extends X3DStreamWriter to
+write the numeric arrays of ArrayField attribute values without formatting
+"""
+
+X3D_DOCTYPE=('X3D', "ISO//Web3D//DTD X3D 3.3//EN", "http://www.web3d.org/specifications/x3d-3.3.dtd")
+
+def escape_attribute(value):
+    """
+    returns value with the XML special characters &<>" replaced
+    by character references, as genshi does for attribute values
+    """
+    return value.replace("&", "&amp;")\
+                .replace("<", "&lt;")\
+                .replace(">", "&gt;")\
+                .replace('"', "&#34;")
+
+
+class ArrayField(object):
+    """
+    An attribute value holding a numeric array. Iterating over an ArrayField
+    yields the pieces of the field text, as for any attribute value which is
+    not a string; a serializer may instead write the array itself
+
+    array the numpy array of the field values
+    chunks an iterable of the pieces of the field text of array
+    format the (format, strip_zeros) arguments of MFVec with which the
+        chunks of a floating point array are formatted, else None
+    """
+    def __init__(self, array, chunks, format = None):
+        self.array = array
+        self.chunks = chunks
+        self.format = format
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class ElementTreeBuilder(object):
+    """
+    Assembles the delivered nodes into ElementTree elements; the
+    top-level elements are accumulated in the roots list
+    """
+    def __init__(self, ET):
+        self.ET = ET
+        self.roots = list()
+        self.stack = list()
+
+    def start(self, tag, attributes=()):
+        if self.stack:
+            elem = self.ET.SubElement(self.stack[-1], tag)
+        else:
+            elem = self.ET.Element(tag)
+            self.roots.append(elem)
+        for name, value in attributes:
+            if value is None:
+                continue
+            if not isinstance(value, basestring):
+                value = "".join(value)
+            elem.set(name, value)
+        self.stack.append(elem)
+
+    def end(self, tag):
+        elem = self.stack.pop()
+        assert( elem.tag == tag )
+
+
+class X3DStreamWriter(object):
+    """
+    Writes the X3D document to output_stream as it is generated,
+    encoded with encoding. The document is written in the order:
+
+    begin_document(unit, metaitems)
+    Viewpoint nodes
+    begin_model()
+    the Group node holding the build items
+    end_document()
+    """
+    def __init__(self, output_stream, encoding="utf-8"):
+        self.output_stream = output_stream
+        self.encoding = encoding
+        self.stack = list()
+        self.tag_open = False   # True when the '>' of the start tag
+                                # of the last started element is pending
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding)
+        self.output_stream.write(text)
+
+    def text(self, text):
+        """
+        writes character data, completing a pending start tag
+        """
+        if self.tag_open:
+            self.write(">")
+            self.tag_open = False
+        self.write(text)
+
+    def start(self, tag, attributes=()):
+        self.text("<%s" % tag)
+        for name, value in attributes:
+            if value is None:
+                continue
+            self.write(' %s="' % name)
+            self.attribute_value(value)
+            self.write('"')
+        self.stack.append(tag)
+        self.tag_open = True
+
+    def attribute_value(self, value):
+        if isinstance(value, basestring):
+            self.write(escape_attribute(value))
+        else:
+            for chunk in value:
+                self.write(chunk)
+
+    def end(self, tag):
+        assert( self.stack.pop() == tag )
+        if self.tag_open:
+            self.write("/>")
+            self.tag_open = False
+        else:
+            self.write("</%s>" % tag)
+
+    def element(self, tag, attributes=()):
+        self.start(tag, attributes)
+        self.end(tag)
+
+    def begin_document(self, unit, metaitems, components=(), navigation=True):
+        """
+        unit : a dictionary with keys  'name' (string) and  'conversionFactor' (float)
+        metaitems : a sequence of 2-tuples (name, content)
+        components : a sequence of 2-tuples (name, level) of the X3D
+                     components used beyond the Interchange profile
+        navigation : if False the NavigationInfo and Background nodes are
+                     omitted, as in a document referenced by an Inline node
+        """
+        self.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.write('<!DOCTYPE %s PUBLIC "%s" "%s">\n' % X3D_DOCTYPE)
+        self.start("X3D", [
+            ("xmlns:xsd", "http://www.w3.org/2001/XMLSchema-instance"),
+            ("profile", "Interchange"),
+            ("version", "3.3"),
+            ("xsd:noNamespaceSchemaLocation", "http://www.web3d.org/specifications/x3d-3.3.xsd")])
+        self.text("\n    ")
+        self.start("head")
+        self.text("\n        ")
+        for name, level in components:
+            self.element("component", [("name", name), ("level", "%i" % level)])
+            self.text("\n        ")
+        self.element("unit", [
+            ("category", "length"),
+            ("conversionFactor", '%f' % (unit['conversionFactor'],)),
+            ("name", unit['name'])])
+        self.text("\n        ")
+        for ky, val in metaitems:
+            self.element("meta", [("content", val), ("name", ky)])
+        self.text("\n    ")
+        self.end("head")
+        self.text("\n    ")
+        self.start("Scene")
+        self.text("\n        ")
+        if navigation:
+            self.element("NavigationInfo")
+            self.text("\n        ")
+            self.element("Background", [("skyColor", "0.9 0.9 0.9")])
+            self.text("\n        ")
+
+    def begin_model(self):
+        self.text("\n        ")
+
+    def end_document(self):
+        self.text("\n    ")
+        self.end("Scene")
+        self.text("\n")
+        self.end("X3D")